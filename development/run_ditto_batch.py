@@ -0,0 +1,31 @@
+""" DICOM Integrity Tool, batch mode
+
+Compares every (RayStation export, Aria retrieval) pair of a manifest without the
+GUI, and writes one CSV result table with the Result flag of each attribute.
+
+Usage: python run_ditto_batch.py manifest.csv results.csv [--workers N]
+"""
+
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+ditto_path = Path(__file__).parent.parent / "library" / "DITTO"
+sys.path.insert(1, str(ditto_path))
+import BatchIntegrityTool
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("manifest", help="CSV with the columns raystation, aria and label")
+    parser.add_argument("output", help="CSV file the result table is written to")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Number of worker processes (default: one per processor)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    summary = BatchIntegrityTool.run_batch_dicom_integrity_tool(
+        args.manifest, args.output, max_workers=args.workers,
+    )
+    for label, result in summary.items():
+        print(f"{label}: {result}")
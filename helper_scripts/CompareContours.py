@@ -50,12 +50,13 @@ def main():
     #
     # Initialize return variable
     Pd = namedtuple('Pd', ['error','db', 'case', 'patient', 'exam', 'plan', 'beamset'])
+    scope = GeneralOperations.ScopeSnapshot()
     # Get current patient, case, exam
     pd = Pd(error = [],
-            patient = GeneralOperations.find_scope(level='Patient'),
-            case = GeneralOperations.find_scope(level='Case'),
-            exam = GeneralOperations.find_scope(level='Examination'),
-            db = GeneralOperations.find_scope(level='PatientDB'),
+            patient = GeneralOperations.find_scope(level='Patient', scope=scope),
+            case = GeneralOperations.find_scope(level='Case', scope=scope),
+            exam = GeneralOperations.find_scope(level='Examination', scope=scope),
+            db = GeneralOperations.find_scope(level='PatientDB', scope=scope),
             plan = None,
             beamset = None)
     defined_rois = []
@@ -48,22 +48,23 @@ def main():
     #
     # Initialize return variable
     PatientData = namedtuple('Pd', ['error','db', 'case', 'patient', 'exam', 'plan', 'beamset'])
+    scope = GeneralOperations.ScopeSnapshot()
     # Get current patient, case, exam
     ptdat =PatientData(error = [],
-            patient = GeneralOperations.find_scope(level='Patient'),
-            case = GeneralOperations.find_scope(level='Case'),
-            exam = GeneralOperations.find_scope(level='Examination'),
-            db = GeneralOperations.find_scope(level='PatientDB'),
-            plan = GeneralOperations.find_scope(level='Plan'),
-            beamset = GeneralOperations.find_scope(level='BeamSet'),
+            patient = GeneralOperations.find_scope(level='Patient', scope=scope),
+            case = GeneralOperations.find_scope(level='Case', scope=scope),
+            exam = GeneralOperations.find_scope(level='Examination', scope=scope),
+            db = GeneralOperations.find_scope(level='PatientDB', scope=scope),
+            plan = GeneralOperations.find_scope(level='Plan', scope=scope),
+            beamset = GeneralOperations.find_scope(level='BeamSet', scope=scope),
     )
     if ptdat.beamset.DeliveryTechnique == 'TomoHelical':
         beam_params = BeamOperations.gather_tomo_beam_params(ptdat.beamset)
     else:
         sys.exit('Unable to show a sinogram for this kind of plan')
-    sino_i = beam_params.loc[0].sinogram * beam_params.loc[0].proj_time *1000. #ms per s
-    num_proj_i = beam_params.iloc[0].sinogram.shape[0]
-    num_mlc_i = beam_params.iloc[0].sinogram.shape[1]
+    sino_i = beam_params.sinogram * beam_params.proj_time *1000. #ms per s
+    num_proj_i = beam_params.sinogram.shape[0]
+    num_mlc_i = beam_params.sinogram.shape[1]
     extent_i = [0, num_mlc_i, 0 , num_proj_i]
     plt.style.use('grayscale')
     plt.imshow(1-sino_i, interpolation='none',extent=extent_i)
@@ -14,11 +14,12 @@ import re
 
 
 def main():
-    patient = GeneralOperations.find_scope(level='Patient')
-    case = GeneralOperations.find_scope(level='Case')
-    exam = GeneralOperations.find_scope(level='Examination')
-    plan = GeneralOperations.find_scope(level='Plan')
-    beamset = GeneralOperations.find_scope(level='BeamSet')
+    scope = GeneralOperations.ScopeSnapshot()
+    patient = GeneralOperations.find_scope(level='Patient', scope=scope)
+    case = GeneralOperations.find_scope(level='Case', scope=scope)
+    exam = GeneralOperations.find_scope(level='Examination', scope=scope)
+    plan = GeneralOperations.find_scope(level='Plan', scope=scope)
+    beamset = GeneralOperations.find_scope(level='BeamSet', scope=scope)
     #try:
     #    patient = connect.get_current('Patient')
     #    case = connect.get_current("Case")
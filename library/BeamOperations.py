@@ -62,7 +62,6 @@ __copyright__ = 'Copyright (C) 2018, University of Wisconsin Board of Regents'
 
 import math
 import numpy as np
-import pandas as pd
 import math
 import logging
 import sys
@@ -76,6 +75,8 @@ import Beams
 import datetime
 import os
 import xml
+from collections import namedtuple
+from contextlib import contextmanager
 from UW_Definitions import *
 
 PROTOCOL_FOLDER = r'../protocols'
@@ -86,6 +87,26 @@ PATH_BEAMSETS = os.path.join(os.path.dirname(__file__),
 
 clr.AddReference('System')
 
+# Segment data read from a beam by get_beam_segment_data
+BeamSegmentData = namedtuple('BeamSegmentData',
+                             ['beam', 'banks', 'weights', 'jaw_positions', 'delta_gantry_angles'])
+# Delivery parameters of a tomo beam returned by get_tomo_beam_params
+TomoBeamParams = namedtuple('TomoBeamParams',
+                            ['beam_name',
+                             'time',  # Total time of plan [s]
+                             'proj_time',  # Time of each projection [s]
+                             'rp',  # Rotation period [s]
+                             'total_travel',  # Couch travel [cm]
+                             'couch_speed',  # Speed of couch [cm/s]
+                             'sinogram',  # Leaf open fractions [projection, leaf] or None
+                             'mod_factor',  # Max/Ave_Nonzero
+                             ])
+# Cache of BeamSegmentData keyed on the (name, number) of the beam it was read from, filled only
+# while a beam_segment_pass is open
+_BEAM_SEGMENT_CACHE = {}
+# Number of beam_segment_pass currently open
+_BEAM_SEGMENT_PASSES = 0
+
 
 class Beam(object):
 
@@ -873,59 +894,103 @@ def modify_tomo_beam_properties(settings, plan, beamset, beam):
                                 sys.exit(u'{}'.format(e))
 
 
-def gather_tomo_beam_params(beamset):
-    # Compute time, rotation period, couch speed, pitch
-    #   mod factor
+def iter_tomo_sinogram(beam, chunk_size=1024, dtype=np.float32):
+    """
+    Stream the sinogram of a tomo beam in blocks of projections, so very long helical
+    deliveries can be processed without holding the whole sinogram
+    :param beam: RayStation tomo beam object
+    :param chunk_size: number of projections per block
+    :param dtype: numpy dtype of the blocks
+    :return: generator of numpy arrays [projection, leaf] of leaf open fractions
+    """
+    segments = beam.Segments
+    number_segments = len(segments)
+    number_leaves = len(segments[0].LeafOpenFraction)
+    for start in range(0, number_segments, chunk_size):
+        stop = min(start + chunk_size, number_segments)
+        block = np.empty((stop - start, number_leaves), dtype=dtype)
+        for p in range(start, stop):
+            block[p - start, :] = segments[p].LeafOpenFraction
+        yield block
+
+
+def read_tomo_sinogram(beam, dtype=np.float32):
+    """
+    Read the full sinogram of a tomo beam into a preallocated array
+    :param beam: RayStation tomo beam object
+    :param dtype: numpy dtype of the sinogram
+    :return: numpy array [projection, leaf] of leaf open fractions
+    """
+    segments = beam.Segments
+    sinogram = np.empty((len(segments), len(segments[0].LeafOpenFraction)), dtype=dtype)
+    for p, s in enumerate(segments):
+        sinogram[p, :] = s.LeafOpenFraction
+    return sinogram
+
+
+def tomo_mod_factor(sinogram_blocks):
+    """
+    Modulation factor, max(LOT) / mean of the non-zero LOT, accumulated over blocks
+    :param sinogram_blocks: iterable of numpy arrays, e.g. [sinogram] or
+        iter_tomo_sinogram(beam)
+    :return: mod factor
+    """
+    max_lot = 0.
+    sum_lot = 0.
+    number_non_zero = 0
+    for block in sinogram_blocks:
+        non_zero = block[block != 0]
+        if non_zero.size:
+            max_lot = max(max_lot, float(np.max(non_zero)))
+            sum_lot += float(np.sum(non_zero, dtype=np.float64))
+            number_non_zero += non_zero.size
+    if number_non_zero == 0:
+        return None
+    return max_lot / (sum_lot / number_non_zero)
+
+
+def get_tomo_beam_params(beam, lazy=False):
+    """
+    Compute time, rotation period, couch speed and mod factor of a tomo beam
+    :param beam: RayStation tomo beam object
+    :param lazy: if True the sinogram is streamed to compute the mod factor and not kept
+        (sinogram is None in the result)
+    :return: TomoBeamParams
+    """
+    segments = beam.Segments
+    number_segments = len(segments)
+    # Projection time in Rs is just MU
+    proj_time = beam.BeamMU
+    # Total Time: Projection time x Number of Segments = Total Time
+    time = proj_time * number_segments
+    # Rotation period: Projection Time * 51
+    rp = proj_time * 51.
+    # Couch Speed: Total Distance Traveled / Total Time
+    total_travel = segments[number_segments - 1].CouchYOffset - segments[0].CouchYOffset
+    couch_speed = total_travel / time
+    if lazy:
+        sinogram = None
+        mod_factor = tomo_mod_factor(iter_tomo_sinogram(beam))
+    else:
+        sinogram = read_tomo_sinogram(beam)
+        mod_factor = tomo_mod_factor([sinogram])
+    return TomoBeamParams(beam_name=beam.Name, time=time, proj_time=proj_time, rp=rp,
+                          total_travel=total_travel, couch_speed=couch_speed,
+                          sinogram=sinogram, mod_factor=mod_factor)
+
+
+def gather_tomo_beam_params(beamset, lazy=False):
+    """
+    Compute time, rotation period, couch speed, pitch and mod factor of the (helical) beam
+    in a tomo beamset
+    :param beamset: RayStation tomo beamset
+    :param lazy: if True, do not keep the sinogram (see get_tomo_beam_params)
+    :return: TomoBeamParams of the last beam in the beamset
+    """
+    params = None
     for b in beamset.Beams:
-        number_segments = 0
-        total_travel = 0
-        max_lot = 0
-        sinogram = []
-        for s in b.Segments:
-            number_segments += 1
-            leaf_pos = []
-            for l in s.LeafOpenFraction:
-                leaf_pos.append(l)
-            sinogram.append(leaf_pos)
-        # Projection time in Rs is just MU
-        proj_time = b.BeamMU
-        # Total Time: Projection time x Number of Segments = Total Time
-        time = b.BeamMU * number_segments
-        # Rotation period: Projection Time * 51
-        rp = b.BeamMU * 51.
-        # Couch Speed: Total Distance Traveled / Total Time
-        total_travel = b.Segments[number_segments - 1].CouchYOffset \
-                       - b.Segments[0].CouchYOffset
-        couch_speed = total_travel / time
-        # Pitch: Distance traveled in rotation / field width
-
-        # Convert sinogram to numpy array
-        sino_array = np.array(sinogram)
-        # Find non-zero elements
-        non_zero = np.where(sino_array != 0)
-        sino_non_zero = sino_array[non_zero]
-        # Mod Factor = Average / Max LOT
-        mod_factor = np.max(sino_non_zero) / np.mean(sino_non_zero)
-        # Declare the tomo dataframe
-        dtypes = np.dtype([
-            ('time', float),  # Total time of plan [s]
-            ('proj_time', float),  # Time of each projection [s]
-            ('total_travel', float),  # Couch travel [cm]
-            ('couch_speed', float),  # Speed of couch [cm/s]
-            ('sinogram', object),  # List of leaf openings
-            ('mod_factor', float)  # Max/Ave_Nonzero
-        ])
-        data = np.empty(0, dtype=dtypes)
-        df = pd.DataFrame(data)
-        # Return a dataframe for json output
-        df.at[0, 'time'] = time
-        df.at[0, 'proj_time'] = proj_time
-        df.at[0, 'rp'] = rp
-        df.at[0, 'total_travel'] = total_travel
-        df.at[0, 'couch_speed'] = couch_speed
-        df.at[0, 'sinogram'] = sino_array
-        df.at[0, 'mod_factor'] = mod_factor
-    return df
+        params = get_tomo_beam_params(b, lazy=lazy)
+    return params
 
 
 def check_pa(plan, beam):
@@ -1729,6 +1794,136 @@ def rename_beams(site_name=None, input_technique=None):
         raise IOError("Patient Orientation Unsupported.. Manual Beam Naming Required")
 
 
+def get_beam_segment_data(beam, refresh=False):
+    """
+    Read the segments of a beam. Inside a beam_segment_pass the result is cached under the name
+    and number of the beam, which RayStation keeps unique within a plan, and later calls for the
+    same beam return the same arrays, whichever beam object RayStation handed out. So the
+    review, complexity and filtering code share a single read of beam.Segments. The arrays are
+    read-only, copy before editing.
+
+    :param beam: RayStation beam object
+    :param refresh: if True, discard any cached data for this beam and read it again
+    :return: BeamSegmentData with
+        banks: leaf positions [leaf, bank, control point]
+        weights: segment relative weights [control point]
+        jaw_positions: [control point, (X1, X2, Y1, Y2)]
+        delta_gantry_angles: gantry angle of each segment relative to the beam start
+            [control point], nan if the segments have none
+        or None if the beam has no segments
+    """
+    key = _beam_segment_key(beam)
+    cached = _BEAM_SEGMENT_CACHE.get(key)
+    if cached is not None and not refresh:
+        return cached
+    try:
+        segments = beam.Segments
+        number_segments = len(segments)
+        s0 = segments[0]
+    except Exception:
+        logging.debug('Beam {} does not have segments.'.format(beam.Name))
+        return None
+    num_leaves_per_bank = int(s0.LeafPositions[0].shape[0])
+    banks = np.empty((num_leaves_per_bank, 2, number_segments))
+    weights = np.empty(number_segments)
+    jaw_positions = np.empty((number_segments, 4))
+    delta_gantry_angles = np.full(number_segments, np.nan)
+    has_gantry = hasattr(s0, 'DeltaGantryAngle')
+    for cp, s in enumerate(segments):
+        lp = s.LeafPositions
+        banks[:, 0, cp] = lp[0]
+        banks[:, 1, cp] = lp[1]
+        weights[cp] = s.RelativeWeight
+        jaw_positions[cp, :] = list(s.JawPositions)
+        if has_gantry:
+            delta_gantry_angles[cp] = s.DeltaGantryAngle
+    for a in (banks, weights, jaw_positions, delta_gantry_angles):
+        a.flags.writeable = False
+    segment_data = BeamSegmentData(beam=beam, banks=banks, weights=weights,
+                                   jaw_positions=jaw_positions,
+                                   delta_gantry_angles=delta_gantry_angles)
+    if _BEAM_SEGMENT_PASSES > 0:
+        _BEAM_SEGMENT_CACHE[key] = segment_data
+    return segment_data
+
+
+def _beam_segment_key(beam):
+    return beam.Name, beam.Number
+
+
+@contextmanager
+def beam_segment_pass():
+    """
+    Share the segment data read by get_beam_segment_data for the length of one review or
+    filtering pass, which should stay within one plan. The cache is emptied when the outermost
+    pass ends, so no beam objects are held past it. Usable as a with statement or as a
+    decorator.
+    """
+    global _BEAM_SEGMENT_PASSES
+    _BEAM_SEGMENT_PASSES += 1
+    try:
+        yield
+    finally:
+        _BEAM_SEGMENT_PASSES -= 1
+        if _BEAM_SEGMENT_PASSES == 0:
+            _BEAM_SEGMENT_CACHE.clear()
+
+
+def clear_beam_segment_cache(beam=None):
+    """
+    Discard the segment data cached by get_beam_segment_data
+    :param beam: RayStation beam object to discard, or None to discard all beams
+    """
+    if beam is None:
+        _BEAM_SEGMENT_CACHE.clear()
+    else:
+        _BEAM_SEGMENT_CACHE.pop(_beam_segment_key(beam), None)
+
+
+def stationary_leaf_gap_mask(banks, min_gap_moving, threshold=1e-6):
+    """
+    Flag the leaf pairs that are closed to the minimum moving gap and do not move in the
+    neighbouring control points.
+
+    A pair is evaluated only if it is not parked at (0, 0) and its separation is within
+    (1 + threshold) * min_gap_moving. The pair is stationary if neither bank moves more than
+    threshold across the two adjacent control point steps: (cp-1 -> cp, cp -> cp+1) in the
+    interior, the two following steps for the first control point and the two preceding steps
+    for the last control point.
+
+    :param banks: numpy array of leaf positions [leaf, bank, control point]
+    :param min_gap_moving: minimum dynamic leaf gap of the machine [cm]
+    :param threshold: tolerance for equivalence of positions [cm]
+    :return: boolean numpy array of the same shape as banks, equal for both banks
+    """
+    single_segment = banks.ndim == 2
+    if single_segment:
+        banks = banks[:, :, np.newaxis]
+    x1 = banks[:, 0, :]
+    x2 = banks[:, 1, :]
+    # Pairs parked at the origin are non-dynamic and pairs open beyond the minimum gap are
+    # not closed, neither is a candidate
+    candidate = ~((x1 == 0) & (x2 == 0)) & \
+        (np.abs(x1 - x2) <= (1 + threshold) * min_gap_moving)
+    number_of_control_points = banks.shape[2]
+    if number_of_control_points > 1:
+        # still[:, k] is True if neither bank moves between control points k and k + 1
+        still = np.all(np.abs(np.diff(banks, axis=2)) <= threshold, axis=1)
+        last_step = number_of_control_points - 2
+        steps = np.arange(number_of_control_points)
+        # The step into this control point (the first control point looks two ahead)
+        previous_step = np.clip(np.where(steps == 0, 1, steps - 1), 0, last_step)
+        # The step out of this control point (the last control point looks two behind)
+        next_step = np.clip(np.where(steps == last_step + 1, last_step - 1, steps), 0, last_step)
+        stationary = still[:, previous_step] & still[:, next_step]
+    else:
+        stationary = np.ones_like(candidate)
+    leaf_gaps = np.repeat((candidate & stationary)[:, np.newaxis, :], 2, axis=1)
+    if single_segment:
+        leaf_gaps = leaf_gaps[:, :, 0]
+    return leaf_gaps
+
+
 class mlc_properties:
     """
     Class of mlc_properties:
@@ -1749,35 +1944,27 @@ class mlc_properties:
     # Initialize with a RS beam object
     def __init__(self, beam):
         self.beam = beam  # A Raystation beam object that has segments
-        try:
-            s0 = self.beam.Segments[0]
-            self.has_segments = True
-        except:
-            self.has_segments = False
+        segment_data = get_beam_segment_data(self.beam)
+        self.has_segments = segment_data is not None
 
         if self.has_segments:
             current_machine_name = self.beam.MachineReference.MachineName
-            current_machine = GeneralOperations.get_machine(current_machine_name)
-            # If the plan is imported then the MlcPhysics methods will not be defined
-            try:
-                mlc_physics = current_machine.Physics.MlcPhysics
-            except AttributeError:
-                mlc_physics = None
+            physics = GeneralOperations.get_machine_physics(current_machine_name)
 
+            # If the plan is imported then the MlcPhysics methods will not be defined
             # TODO: This variable changed in 10. Find it
-            if mlc_physics:
+            if physics.leaf_widths is not None:
                 # Maximum motion of a leaf on its own side of the origin
-                self.max_tip = mlc_physics.MaxTipDifference
+                self.max_tip = physics.max_tip
                 # Maximum leaf out of carriage distance [cm]
-                self.max_leaf_carriage = mlc_physics.Carriage.MaxLeafOutOfCarriageDistance
+                self.max_leaf_carriage = physics.max_leaf_carriage
                 # Grab the leaf centers and widths
-                self.leaf_centers = \
-                    current_machine.Physics.MlcPhysics.UpperLayer.LeafCenterPositions
-                self.leaf_widths = current_machine.Physics.MlcPhysics.UpperLayer.LeafWidths
+                self.leaf_centers = physics.leaf_centers
+                self.leaf_widths = physics.leaf_widths
                 # Grab the distance behind the x-jaw a dynamic leaf is supposed to be placed
-                self.leaf_jaw_overlap = current_machine.Physics.MlcPhysics.LeafJawOverlap
+                self.leaf_jaw_overlap = physics.leaf_jaw_overlap
                 # Grab the minimum gap allowed for a dynamic leaf
-                self.min_gap_moving = current_machine.Physics.MlcPhysics.MinGapMoving
+                self.min_gap_moving = physics.min_gap_moving
             else:
                 self.max_tip = None
                 self.max_leaf_carriage = 15  # Plug a guess in here
@@ -1787,22 +1974,14 @@ class mlc_properties:
                 self.min_gap_moving = 0.05  # Guess in here
 
             # Compute the number of leaves in the bank based on the first segment
-            self.num_leaves_per_bank = int(s0.LeafPositions[0].shape[0])
+            self.num_leaves_per_bank = segment_data.banks.shape[0]
 
             #
-            # Set up a numpy array that will be a combine segments
-            # into a single ndarray of size:
+            # Copy the shared segment data into a single ndarray of size:
             # MLC leaf number x number of banks x number of segments
-            self.banks = np.column_stack((s0.LeafPositions[0], s0.LeafPositions[1]))
-            self.number_segments = len(beam.Segments)
+            self.number_segments = segment_data.banks.shape[2]
             if self.number_segments > 1:
-                for cp in range(1, self.number_segments):
-                    # for s in beam.Segments:
-                    s = beam.Segments[cp]
-                    # Take the bank positions on X1-bank, and X2 Bank and put them in column 0,
-                    # 1 respectively
-                    bank = np.column_stack((s.LeafPositions[0], s.LeafPositions[1]))
-                    self.banks = np.dstack((self.banks, bank))
+                self.banks = np.copy(segment_data.banks)
                 # Determine if leaves are in retracted position
                 if np.all(self.banks[:, 0, :] <= - self.max_leaf_carriage):
                     x1_bank_retracted = True
@@ -1813,6 +1992,7 @@ class mlc_properties:
                 else:
                     x2_bank_retracted = False
             else:
+                self.banks = np.copy(segment_data.banks[:, :, 0])
                 # Determine if leaves are in retracted position
                 if np.all(self.banks[:, 0] <= - self.max_leaf_carriage):
                     x1_bank_retracted = True
@@ -1830,7 +2010,6 @@ class mlc_properties:
 
     # MLC methods:
     def stationary_leaf_gaps(self):
-        threshold = 1e-6
         # Find the MLC gaps that are closed (set to the minimum moving leaf opening) and return them
         # If stationary_only is True, return only leaf gaps that are closed to minimum and do not
         # move in the next
@@ -1838,59 +2017,7 @@ class mlc_properties:
         # closed leaf gaps: [# MLC, # Banks, #Control points]
         if not self.has_segments:
             return None
-        leaf_gaps = np.empty_like(self.banks, dtype=bool)
-        # Solve only for gaps that do not move in the next control point
-        number_of_control_points = leaf_gaps.shape[2]
-        for cp in range(number_of_control_points):
-            for l in range(leaf_gaps.shape[0]):
-                # Only flag leaves that have a difference in position equal to the minimum moving
-                # leaf gap
-                diff = abs(self.banks[l, 0, cp] - self.banks[l, 1, cp])
-                # If the leaf is defined as non-dynamic (0, 0) then ignore it.
-                if self.banks[l, 0, cp] == 0 and self.banks[l, 1, cp] == 0:
-                    ignore_leaf_pair = True
-                elif diff > (1 + threshold) * self.min_gap_moving:
-                    ignore_leaf_pair = True
-                else:
-                    ignore_leaf_pair = False
-                #
-                if ignore_leaf_pair:
-                    leaf_gaps[l, :, cp] = False
-                else:
-                    #
-                    # Check if the leaf gap is a "closed leaf gap" that is not moving in adjacent
-                    # control points
-                    # See if leaf pair moves from one iteration to the next
-                    #
-                    # First control point only evaluate ahead two control points for changes
-                    if cp == 0:
-                        x1_diff_0 = abs(self.banks[l, 0, cp + 1] - self.banks[l, 0, cp])
-                        x1_diff_1 = abs(self.banks[l, 0, cp + 2] - self.banks[l, 0, cp + 1])
-                        x2_diff_0 = abs(self.banks[l, 1, cp + 1] - self.banks[l, 1, cp])
-                        x2_diff_1 = abs(self.banks[l, 1, cp + 2] - self.banks[l, 1, cp + 1])
-                    # Last control point only evaluate last two control points for changes
-                    elif cp == number_of_control_points - 1:
-                        x1_diff_0 = abs(self.banks[l, 0, cp] - self.banks[l, 0, cp - 1])
-                        x1_diff_1 = abs(self.banks[l, 0, cp - 1] - self.banks[l, 0, cp - 2])
-                        x2_diff_0 = abs(self.banks[l, 1, cp] - self.banks[l, 1, cp - 1])
-                        x2_diff_1 = abs(self.banks[l, 1, cp - 1] - self.banks[l, 1, cp - 2])
-                    else:
-                        # Check if the previous closed leaf pair was in a different position
-                        x1_diff_0 = abs(self.banks[l, 0, cp] - self.banks[l, 0, cp - 1])
-                        x1_diff_1 = abs(self.banks[l, 0, cp + 1] - self.banks[l, 0, cp])
-                        x2_diff_0 = abs(self.banks[l, 1, cp] - self.banks[l, 1, cp - 1])
-                        x2_diff_1 = abs(self.banks[l, 1, cp + 1] - self.banks[l, 1, cp])
-                    x1_diff = [x1_diff_0, x1_diff_1]
-                    x2_diff = [x2_diff_0, x2_diff_1]
-                    # Evaluate each control point difference to see if it is less than the
-                    # threshold for equivalence
-                    if all(x1 <= threshold for x1 in x1_diff) and all(
-                            x2 <= threshold for x2 in x2_diff):
-                        leaf_gaps[l, :, cp] = True
-                    else:
-                        leaf_gaps[l, :, cp] = False
-
-        return leaf_gaps
+        return stationary_leaf_gap_mask(self.banks, self.min_gap_moving)
 
     def closed_leaf_gaps(self):
         threshold = 1e-6
@@ -1979,21 +2106,14 @@ def maximum_beam_leaf_extent(beam):
     :param beam: RayStation beam object
     :return: numpy array of maximum (most open) leaf position over all control points
     """
-    try:
-        # Find the number of leaves in the first segment to initialize the array
-        s0 = beam.Segments[0]
-    except:
+    segment_data = get_beam_segment_data(beam)
+    if segment_data is None:
         logging.debug('Beam {} does not have segments for a ciao.'.format(beam.Name))
         return None
-
-    num_leaves_per_bank = int(s0.LeafPositions[0].shape[0])
-    banks = np.column_stack((s0.LeafPositions[0], s0.LeafPositions[1]))
-    # Combine the segments into a single ndarray of size:
+    # Segments combined into a single ndarray of size:
     # number of MLCs x number of banks x number of segments
-    for s in beam.Segments:
-        # Take the bank positions on X1-bank, and X2 Bank and put them in column 0, 1 respectively
-        bank = np.column_stack((s.LeafPositions[0], s.LeafPositions[1]))
-        banks = np.dstack((banks, bank))
+    banks = segment_data.banks
+    num_leaves_per_bank = banks.shape[0]
 
     # Determine the maximum of any leaf position for all segments
     # completely irradiated area outline
@@ -2009,21 +2129,15 @@ def maximum_leaf_carriage_extent(beam):
     :param beam: RayStation beam object
     :return: numpy array of maximum (most open) leaf position over all control points
     """
-    try:
-        # Find the number of leaves in the first segment to initialize the array
-        s0 = beam.Segments[0]
-    except:
+    t_init = datetime.datetime.now()
+    segment_data = get_beam_segment_data(beam)
+    if segment_data is None:
         logging.debug('Beam {} does not have segments for a ciao.'.format(beam.Name))
         return None
-    t_init = datetime.datetime.now()
-    num_leaves_per_bank = int(s0.LeafPositions[0].shape[0])
-    banks = np.column_stack((s0.LeafPositions[0], s0.LeafPositions[1]))
-    # Combine the segments into a single ndarray of size:
+    # Segments combined into a single ndarray of size:
     # number of MLCs x number of banks x number of segments
-    for s in beam.Segments:
-        # Take the bank positions on X1-bank, and X2 Bank and put them in column 0, 1 respectively
-        bank = np.column_stack((s.LeafPositions[0], s.LeafPositions[1]))
-        banks = np.dstack((banks, bank))
+    banks = segment_data.banks
+    num_leaves_per_bank = banks.shape[0]
 
     # Determine the maximum travel of any leaf on the bank
     max_travel = np.empty(shape=(num_leaves_per_bank, 2))
@@ -2036,6 +2150,46 @@ def maximum_leaf_carriage_extent(beam):
     return max_travel
 
 
+def set_beam_leaf_positions(beam, banks, current_banks=None):
+    """
+    Write a full set of leaf positions back to the beam. The array is compared to the current
+    positions and only segments with a changed leaf are written, so an unchanged array costs
+    no writes.
+
+    :param beam: RayStation beam object
+    :param banks: numpy array of leaf positions [leaf, bank, control point]
+    :param current_banks: numpy array of the positions currently on the beam, if already known
+        (e.g. from mlc_properties). If None, they are read from the beam segments.
+    :return: number of segment LeafPositions writes issued
+    """
+    if banks.ndim == 2:
+        banks = banks[:, :, np.newaxis]
+    if current_banks is None:
+        current_banks = np.empty_like(banks)
+        for cp, s in enumerate(beam.Segments):
+            current_banks[:, 0, cp] = s.LeafPositions[0]
+            current_banks[:, 1, cp] = s.LeafPositions[1]
+    elif current_banks.ndim == 2:
+        current_banks = current_banks[:, :, np.newaxis]
+    # Leaf pairs [leaf, control point] with a new position on either bank
+    changed_leaves = np.any(banks != current_banks, axis=1)
+    changed_segments = np.flatnonzero(np.any(changed_leaves, axis=0))
+    for cp in changed_segments:
+        segment = beam.Segments[int(cp)]
+        lp = segment.LeafPositions
+        for l in np.flatnonzero(changed_leaves[:, cp]):
+            lp[0][int(l)] = float(banks[l, 0, cp])
+            lp[1][int(l)] = float(banks[l, 1, cp])
+        segment.LeafPositions = lp
+    number_writes = len(changed_segments)
+    if number_writes:
+        # The cached segment data for this beam is now stale
+        clear_beam_segment_cache(beam)
+    logging.debug('Beam {}: leaf positions written to {} of {} segments'.format(
+        beam.Name, number_writes, banks.shape[2]))
+    return number_writes
+
+
 def repair_leaf_gap(beam):
     """ Find all of the closed leaves. Repair the leaf gap rounding problem so that the leaves
     are spaced
@@ -2086,16 +2240,41 @@ def repair_leaf_gap(beam):
         logging.debug(
             'Beam {} Filtered and initial arrays are equal. No filtering applied'.format(beam.Name))
     else:
-        # Set the leaf positions to the np array (one-by-one...ugh)
-        for cp in range(len(beam.Segments)):
-            lp = beam.Segments[cp].LeafPositions
-            for l in range(len(lp[0])):
-                lp[0][l] = beam_mlc.banks[l, 0, cp]
-                lp[1][l] = beam_mlc.banks[l, 1, cp]
-            beam.Segments[cp].LeafPositions = lp
+        # Write back only the segments that changed
+        set_beam_leaf_positions(beam, beam_mlc.banks, current_banks=initial_beam_mlc)
     return None
 
 
+def park_closed_leaf_pairs(banks, closed_leaves, x1_jaw, x2_jaw, offset, min_gap_moving):
+    """
+    Move the closed leaf pairs behind the nearest x-jaw, in place. A pair whose X1-bank leaf
+    is nearer to (or equidistant from) x1_jaw is placed at x1_jaw - offset, otherwise at
+    x2_jaw + offset, with the pair separated by min_gap_moving.
+
+    :param banks: numpy array of leaf positions [leaf, bank, control point], modified in place
+    :param closed_leaves: boolean numpy array of the pairs to move, e.g. from
+        stationary_leaf_gap_mask
+    :param x1_jaw: most open X1 position [cm]
+    :param x2_jaw: most open X2 position [cm]
+    :param offset: distance behind the jaw to place the pair [cm]
+    :param min_gap_moving: minimum dynamic leaf gap of the machine [cm]
+    :return: (behind_x1, behind_x2) boolean masks [leaf, control point] of the moved pairs
+    """
+    closed = closed_leaves[:, 0, :]
+    x1_diff = np.abs(banks[:, 0, :] - x1_jaw)
+    x2_diff = np.abs(banks[:, 0, :] - x2_jaw)
+    # These leaves should close behind the x1_jaw
+    behind_x1 = closed & (x1_diff <= x2_diff)
+    # These leaves should close behind the x2_jaw
+    behind_x2 = closed & (x1_diff > x2_diff)
+    banks[:, 0, :][behind_x1] = x1_jaw - offset - min_gap_moving
+    banks[:, 1, :][behind_x1] = x1_jaw - offset
+    banks[:, 0, :][behind_x2] = x2_jaw + offset
+    banks[:, 1, :][behind_x2] = x2_jaw + offset + min_gap_moving
+    return behind_x1, behind_x2
+
+
+@beam_segment_pass()
 def filter_leaves(beam):
     """ Examine all leaves that are currently set to be at a minimum leaf gap. If those leaves
         are not moving from control point to control point, then place them such that they will
@@ -2140,44 +2319,17 @@ def filter_leaves(beam):
     closed_leaves = beam_mlc.stationary_leaf_gaps()
     # Store the initial position of the leaves to see if filtering will be necessary
     initial_beam_mlc = np.copy(beam_mlc.banks)
-    # Loop over leaves
-    for i in range(beam_mlc.banks.shape[0]):
-        # Loop over control points
-        for j in range(beam_mlc.banks.shape[2]):
-            # If this is part of the closed leaf range, then evaluate which jaw it is closest to.
-            if np.all(closed_leaves[i, 0, j]):
-                x1_diff = abs(beam_mlc.banks[i, 0, j] - x1_jaw)
-                x2_diff = abs(beam_mlc.banks[i, 0, j] - x2_jaw)
-                if x1_diff <= x2_diff:
-                    # This leaf should close behind the x1_jaw
-                    beam_mlc.banks[i, 0, j] = x1_jaw - offset - beam_mlc.min_gap_moving
-                    beam_mlc.banks[i, 1, j] = x1_jaw - offset
-                    logging.debug(
-                        'Beam {}, leaf pair {}, control point {}: Dynamic closed pair '
-                        .format(beam.Name, j + 1, i + 1) +
-                        'should be moved from {} to {}'
-                        .format(initial_beam_mlc[i, 1, j], beam_mlc.banks[i, 1, j]))
-                elif x1_diff > x2_diff:
-                    # This leaf should close behind the x1_jaw
-                    beam_mlc.banks[i, 0, j] = x2_jaw + offset
-                    beam_mlc.banks[i, 1, j] = x2_jaw + offset + beam_mlc.min_gap_moving
-                    logging.debug(
-                        'Beam {}, leaf pair {}, control point {}: Dynamic closed pair '
-                        .format(beam.Name, j + 1, i + 1) +
-                        'should be moved from {} to {}'
-                        .format(initial_beam_mlc[i, 0, j], beam_mlc.banks[i, 0, j]))
+    behind_x1, behind_x2 = park_closed_leaf_pairs(
+        beam_mlc.banks, closed_leaves, x1_jaw, x2_jaw, offset, beam_mlc.min_gap_moving)
+    logging.debug('Beam {}: {} dynamic closed leaf pair positions moved behind X1, {} behind X2'
+                  .format(beam.Name, np.count_nonzero(behind_x1), np.count_nonzero(behind_x2)))
 
     if np.all(np.equal(initial_beam_mlc, beam_mlc.banks)):
         logging.debug(
             'Beam {} Filtered and initial arrays are equal. No filtering applied'.format(beam.Name))
     else:
-        # Set the leaf positions to the np array (one-by-one...ugh)
-        for cp in range(len(beam.Segments)):
-            lp = beam.Segments[cp].LeafPositions
-            for l in range(len(lp[0])):
-                lp[0][l] = beam_mlc.banks[l, 0, cp]
-                lp[1][l] = beam_mlc.banks[l, 1, cp]
-            beam.Segments[cp].LeafPositions = lp
+        # Write back only the segments that changed
+        set_beam_leaf_positions(beam, beam_mlc.banks, current_banks=initial_beam_mlc)
         error = None
         return error
 
@@ -2349,11 +2501,9 @@ def check_y_jaw_positions(jaw_positions, beam):
 
     error = ''
     current_machine_name = beam.MachineReference.MachineName
-    machine_db = connect.get_current('MachineDB')
-    current_machine = machine_db.GetTreatmentMachine(machineName=current_machine_name,
-                                                     lockMode=None)
+    physics = GeneralOperations.get_machine_physics(current_machine_name)
     # Maximum jaw overtravel (minimum) position
-    min_y2_jaw_limit = current_machine.Physics.JawPhysics.MinBottomJawPos
+    min_y2_jaw_limit = physics.min_bottom_jaw_pos
     min_y1_jaw_limit = - min_y2_jaw_limit
 
     if beam.DeliveryTechnique == 'TomoHelical':
@@ -2370,12 +2520,8 @@ def check_y_jaw_positions(jaw_positions, beam):
     # Maximum MLC defined positions: Leaf Center + 0.2 Leaf_Width this ensures at least a full
     # millimeter
     # of cushion for jaw inaccuracies on a 5 mm leaf and 2 mm on a 1 cm leaf
-    current_mlc_physics = current_machine.Physics.MlcPhysics
-    max_y1_jaw_limit = current_mlc_physics.UpperLayer.LeafCenterPositions[0] - \
-                       0.2 * current_mlc_physics.UpperLayer.LeafWidths[0]
-    n_leaves = len(current_mlc_physics.UpperLayer.LeafCenterPositions)
-    max_y2_jaw_limit = current_mlc_physics.UpperLayer.LeafCenterPositions[n_leaves - 1] + \
-                       0.2 * current_mlc_physics.UpperLayer.LeafWidths[n_leaves - 1]
+    max_y1_jaw_limit = physics.leaf_centers[0] - 0.2 * physics.leaf_widths[0]
+    max_y2_jaw_limit = physics.leaf_centers[-1] + 0.2 * physics.leaf_widths[-1]
 
     # Check jaws
     if jaw_positions['Y1'] > min_y1_jaw_limit:
@@ -2438,12 +2584,6 @@ def rounded_jaw_positions(beam):
         # TODO: Use Jaw Offset is not working correctly in 11B. Disabled for now.
     else:
         use_round_open = True
-    # For some bizzare reason, the __init__ method of beam does not pull the data from
-    # the MLC MachineReference physics. So we are searching for the machine directly here.
-    current_machine = GeneralOperations.get_machine(machine_name=beam.MachineReference.MachineName)
-    # Maximum jaw overtravel (minimum) position
-    current_mlc_physics = current_machine.Physics.MlcPhysics
-
     # If the target is small, try to use jaw offsets.
     beam_mlc = mlc_properties(beam)
     if use_jaw_offset:
@@ -2549,6 +2689,7 @@ def jaws_rounded(beam):
     return rounded
 
 
+@beam_segment_pass()
 def round_jaws(beamset):
     """
     Rounds the jaws.
@@ -2576,6 +2717,8 @@ def round_jaws(beamset):
             j0 = rounded_jaw_positions(b)
             for s in b.Segments:
                 s.JawPositions = [j0['X1'], j0['X2'], j0['Y1'], j0['Y2']]
+            # The cached segment data for this beam is now stale
+            clear_beam_segment_cache(b)
             GeneralOperations.logcrit('Beam {}: jaw positions changed '.format(b.Name) +
                                       '<X1: {0:.2f}->{1:.2f}>, '.format(init_positions[0],
                                                                         s.JawPositions[0]) +
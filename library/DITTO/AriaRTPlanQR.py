@@ -33,6 +33,7 @@ import PySimpleGUI as sg
 import os
 import pathlib
 import socket
+import time
 
 # Constants
 local_aet = socket.gethostname()
@@ -42,6 +43,13 @@ aria_port = 108  # Aria database daemon port number
 local_storage_port = (
     104  # I think this is the port that Aria will try to send to on this local AE
 )
+# Seconds a C-FIND result for a patient is reused before Aria is queried again
+rtplan_list_ttl = 300
+# Retrieved RTPlans, stored as ARIA<SOPInstanceUID>.dcm and reused while present
+rtplan_store_dir = pathlib.Path(tempfile.gettempdir(), "AriaRTPlanStore")
+
+# C-FIND results by PatientID: (time of the query, results)
+_rtplan_list_cache = {}
 
 
 def aria_echo():
@@ -95,7 +103,7 @@ def aria_echo():
     return success
 
 
-def aria_rtplan_list(verbose=False):
+def aria_rtplan_list(verbose=False, patient_id=None, refresh=False):
     """
     Returns a dict of plans available in Aria for the current patient.
     Each object in the dict will be keyed with the RTPlanLabel, and the
@@ -104,7 +112,18 @@ def aria_rtplan_list(verbose=False):
     SOPClassUID, SOPInstanceUID.
 
     Returns None if unsuccessful.
+
+    patient_id: the patient to search, defaults to the current RayStation patient.
+    Results are reused for rtplan_list_ttl seconds per patient, unless refresh
+    is True.
     """
+    if patient_id is None:
+        patient_id = patient.PatientID
+    if not refresh:
+        cached = _cached_rtplan_list(patient_id)
+        if cached is not None:
+            return cached
+
     # Attempt to search Aria database for a specific patient's RTPlans
     find_ae = pynetdicom.AE()
 
@@ -117,7 +136,7 @@ def aria_rtplan_list(verbose=False):
 
     # Create our Identifier (query) dataset
     ds = pydicom.dataset.Dataset()
-    ds.PatientID = patient.PatientID
+    ds.PatientID = patient_id
     ds.QueryRetrieveLevel = "IMAGE"
     ds.StudyInstanceUID = ""
     ds.SeriesInstanceUID = ""
@@ -126,6 +145,7 @@ def aria_rtplan_list(verbose=False):
     ds.SOPInstanceUID = ""
 
     results = {}
+    completed = False
 
     try:
         assoc = find_ae.associate(aria_host, aria_port, ae_title=aria_aet)
@@ -164,6 +184,8 @@ def aria_rtplan_list(verbose=False):
                     print(
                         "Connection timed out, was aborted or received invalid response"
                     )
+                # The final response carries a Success status, and no identifier
+                completed = bool(status) and status.Status == 0x0000
         else:
             print("C-FIND Association rejected, aborted or never connected")
     except:
@@ -181,10 +203,58 @@ def aria_rtplan_list(verbose=False):
     else:
         assoc.release()
 
+    if completed and results is not None:
+        _rtplan_list_cache[patient_id] = (
+            time.monotonic(),
+            {label: dict(tags) for label, tags in results.items()},
+        )
+
     return results
 
 
-def aria_get_rtplan(input_dict, file_dir=tempfile.gettempdir()):
+def _cached_rtplan_list(patient_id):
+    """
+    Returns a copy of the C-FIND results of the patient if they are less than
+    rtplan_list_ttl seconds old, otherwise None.
+    """
+    cached = _rtplan_list_cache.get(patient_id)
+    if cached is None or time.monotonic() - cached[0] >= rtplan_list_ttl:
+        return None
+    return {label: dict(tags) for label, tags in cached[1].items()}
+
+
+def clear_aria_cache(patient_id=None, remove_files=False):
+    """
+    Forgets the C-FIND results of a patient, or of all patients if no
+    patient_id is given. With remove_files, the RTPlans retrieved into
+    rtplan_store_dir are deleted as well.
+    """
+    if patient_id is None:
+        _rtplan_list_cache.clear()
+    else:
+        _rtplan_list_cache.pop(patient_id, None)
+    if remove_files and rtplan_store_dir.is_dir():
+        for f in rtplan_store_dir.glob("ARIA*.dcm"):
+            f.unlink()
+
+
+def _stored_rtplan(file_location, sop_instance_uid):
+    """
+    Returns True if file_location holds the RTPlan with this SOPInstanceUID
+    """
+    if not file_location.is_file():
+        return False
+    try:
+        header = pydicom.dcmread(
+            file_location, stop_before_pixels=True, specific_tags=["SOPInstanceUID"],
+            force=True,
+        )
+    except Exception:
+        return False
+    return header.get("SOPInstanceUID") == sop_instance_uid
+
+
+def aria_get_rtplan(input_dict, file_dir=None, patient_id=None):
     """
     This method takes in a dict defining the fields and values of DICOM header
     to pull out of Aria, and returns a pathname to the location where 
@@ -197,12 +267,27 @@ def aria_get_rtplan(input_dict, file_dir=tempfile.gettempdir()):
     SOPClassUID, and SOPInstanceUID.
 
     file_dir: the root directory where the file will be saved.
-    If not provided, then saved into tempfile.gettempdir()
+    If not provided, then saved into rtplan_store_dir
     Must be a path-like object.
+
+    Files are named by SOPInstanceUID, so a plan already in file_dir is
+    returned without a C-MOVE.
+
+    patient_id: defaults to the current RayStation patient.
     """
+    if file_dir is None:
+        file_dir = rtplan_store_dir
+    if patient_id is None:
+        patient_id = patient.PatientID
+
+    file_location = pathlib.Path(file_dir, ("ARIA" + str(input_dict["SOPInstanceUID"]) + ".dcm"))
+    if _stored_rtplan(file_location, input_dict["SOPInstanceUID"]):
+        return file_location
+    os.makedirs(file_dir, exist_ok=True)
+
     # Create the search dataset
     ds = pydicom.dataset.Dataset()
-    ds.PatientID = patient.PatientID
+    ds.PatientID = patient_id
     ds.QueryRetrieveLevel = "IMAGE"
     ds.StudyInstanceUID = input_dict["StudyInstanceUID"]
     ds.SeriesInstanceUID = input_dict["SeriesInstanceUID"]
@@ -210,16 +295,17 @@ def aria_get_rtplan(input_dict, file_dir=tempfile.gettempdir()):
     ds.SOPClassUID = input_dict["SOPClassUID"]
     ds.SOPInstanceUID = input_dict["SOPInstanceUID"]
 
-    file_location = pathlib.Path(file_dir, ("ARIA" + str(ds.SOPInstanceUID) + ".dcm"))
-
     # implement the handler for c_store event
     def handle_store(event):
         """Handle a C-STORE request event."""
         ds = event.dataset
         ds.file_meta = event.file_meta
 
-        # Save the dataset using the SOP Instance UID as the filename
-        ds.save_as(file_location, write_like_original=True)
+        # Save the dataset using the SOP Instance UID as the filename. Write it under
+        # a temporary name first, so an interrupted transfer never looks stored.
+        partial_location = file_location.with_suffix(".part")
+        ds.save_as(partial_location, write_like_original=True)
+        os.replace(partial_location, file_location)
 
         # Return a 'Success' status
         return 0x0000
@@ -284,6 +370,9 @@ def aria_get_rtplan(input_dict, file_dir=tempfile.gettempdir()):
         assoc.release()
 
     local_scp.shutdown()
+    if file_location is not None and not file_location.is_file():
+        print("C-MOVE did not return " + str(ds.SOPInstanceUID))
+        file_location = None
     return file_location
 
 
@@ -378,12 +467,15 @@ def aria_qr(root_dir=None):
     If empty, defaults to a tempdir selected automatically.
     Should be a pathlike object.
     """
-    # If you run aria_get_rtplan, clean up your tmpfile mess!
+    # Aria plans are kept in rtplan_store_dir unless a root_dir is given, so a plan
+    # compared again is not retrieved twice. Use clear_aria_cache to clean it up.
+    aria_dir = root_dir
     if not root_dir:
         root_dir = tempfile.gettempdir()
 
-    # Check for echo and fail if broken
-    if not aria_echo():
+    # Check for echo and fail if broken. A patient queried recently needs no echo,
+    # since its plan list comes from the cache.
+    if _cached_rtplan_list(patient.PatientID) is None and not aria_echo():
         return (None, None, None)
 
     # Get the lists of valid objects and fail if there are no valid RTPlans or beamsets
@@ -399,7 +491,7 @@ def aria_qr(root_dir=None):
         return (None, None, None)
 
     # Export the Aria RTPlan file
-    aria_file_location = aria_get_rtplan(dict_aria_plans[selected_aria], root_dir)
+    aria_file_location = aria_get_rtplan(dict_aria_plans[selected_aria], aria_dir)
     print("Aria plan " + selected_aria + " saved to " + str(aria_file_location))
 
     # Export the RayStation beamset file
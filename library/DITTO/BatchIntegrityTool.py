@@ -0,0 +1,181 @@
+"""
+Headless batch mode of the DICOM Integrity Tool.
+
+Compares every (RayStation export, Aria retrieval) pair listed in a manifest
+across a process pool, and writes one consolidated CSV table with a row per
+compared attribute, sequence and sequence item, carrying its Result flag.
+
+The manifest is a CSV file with the columns "raystation" and "aria", holding
+the paths to the two DICOM-RT plan files of each pair, and an optional
+"label" column naming the pair in the results. Relative paths are resolved
+against the folder of the manifest.
+"""
+
+import csv
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from DicomIntegrityTool import compare_dicomrt_plans
+from DicomPairClasses import ElementPair, SequencePair
+
+RESULT_COLUMNS = [
+    "label",
+    "raystation_file",
+    "aria_file",
+    "key",
+    "kind",
+    "result",
+    "acceptable",
+    "raystation_value",
+    "aria_value",
+    "comment",
+]
+
+
+def read_manifest(manifest):
+    """ Reads the (RayStation export, Aria retrieval) pairs listed in a manifest
+
+    PARAMETERS
+    ----------
+    manifest: Path or string
+        The path to a CSV manifest with the columns "raystation", "aria" and
+        optionally "label"
+
+    RETURNS
+    -------
+    list of tup(string, Path, Path)
+        The label, RayStation file and Aria file of each pair
+    """
+    manifest = Path(manifest)
+    pairs = []
+    with open(manifest, newline="") as f:
+        for row in csv.DictReader(f):
+            try:
+                rs_file = manifest.parent / row["raystation"].strip()
+                aria_file = manifest.parent / row["aria"].strip()
+            except KeyError as e:
+                raise ValueError(
+                    f"Manifest {manifest} has no column {e}"
+                ) from None
+            label = (row.get("label") or "").strip() or rs_file.stem
+            pairs.append((label, rs_file, aria_file))
+    return pairs
+
+
+def _format_value(value):
+    """ Writes a DICOM value as text for the result table """
+    if value is None:
+        return ""
+    if isinstance(value, bytes):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, (list, tuple)) or type(value).__name__ == "MultiValue":
+        return "\\".join(str(v) for v in value)
+    return str(value)
+
+
+def flatten_dicom_tree_pair(dicom_tree_pair):
+    """ Lists the nodes of a comparison tree as rows of the result table
+
+    PARAMETERS
+    ----------
+    dicom_tree_pair: DicomTreePair
+        The result of create_dicom_tree_pair
+
+    RETURNS
+    -------
+    list of tup
+        (key, kind, result, acceptable, value1, value2, comment) for each
+        element, sequence and sequence item of the tree, in tree order
+    """
+    rows = []
+    stack = [dicom_tree_pair]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ElementPair):
+            value1, value2 = node.value_pair
+            rows.append((
+                node.return_global_key(), "Element", node.match_result.name,
+                node.is_acceptable_match(), _format_value(value1),
+                _format_value(value2), node.comment,
+            ))
+            continue
+        if isinstance(node, SequencePair):
+            key, kind, children = node.return_global_key(), "Sequence", node.sequence_list
+        else:
+            key = f"{node.parent_key}>{node.tree_label}" if node.parent_key else node.tree_label
+            kind = "Item" if node.parent is not None else "Plan"
+            children = node.tree_list
+        rows.append((
+            key, kind, node.match_result.name, node.is_acceptable_match(), "", "",
+            node.comment,
+        ))
+        stack.extend(reversed(children))
+    return rows
+
+
+def compare_plan_pair(pair):
+    """ Compares one pair of DICOM-RT plans, in a worker process
+
+    PARAMETERS
+    ----------
+    pair: tup(string, Path, Path)
+        The label, RayStation file and Aria file of the pair
+
+    RETURNS
+    -------
+    list of dict
+        The result table rows of the pair. A pair that could not be compared
+        gives a single row with the result "ERROR" and the reason as comment.
+    """
+    label, rs_file, aria_file = pair
+    common = {"label": label, "raystation_file": str(rs_file), "aria_file": str(aria_file)}
+    try:
+        dicom_tree_pair = compare_dicomrt_plans(rs_file, aria_file)
+    except Exception as e:
+        return [dict(common, key="", kind="Plan", result="ERROR", acceptable=False,
+                     raystation_value="", aria_value="", comment=f"{type(e).__name__}: {e}")]
+    return [
+        dict(common, key=key, kind=kind, result=result, acceptable=acceptable,
+             raystation_value=value1, aria_value=value2, comment=comment)
+        for key, kind, result, acceptable, value1, value2, comment
+        in flatten_dicom_tree_pair(dicom_tree_pair)
+    ]
+
+
+def run_batch_dicom_integrity_tool(manifest, output, max_workers=None):
+    """ Compares every plan pair of a manifest and writes one result table
+
+    PARAMETERS
+    ----------
+    manifest: Path or string
+        The CSV manifest of plan pairs, see read_manifest
+    output: Path or string
+        The CSV file the result table is written to
+    max_workers: int
+        The number of worker processes. Defaults to the number of processors.
+
+    RETURNS
+    -------
+    dict of {string: string}
+        The overall result of each pair, by label: the Result name of the plan
+        comparison, or "ERROR" when the pair could not be compared
+    """
+    pairs = read_manifest(manifest)
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(pairs)))
+
+    summary = {}
+    with open(output, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            # Results come back in manifest order, so the table is the same for any
+            # number of workers
+            for pair, rows in zip(pairs, executor.map(compare_plan_pair, pairs)):
+                writer.writerows(rows)
+                summary[pair[0]] = rows[0]["result"]
+                logging.info(f"DITTO {pair[0]}: {rows[0]['result']}")
+    return summary
@@ -29,6 +29,45 @@ ATTRIBUTE_MATCH_DICT = {
 # Need to add Applicator Sequence, Block Sequence, ReferencedReferenceImageSequence, PlannedVerificationImageSequence
 
 
+def match_value(item, match_keyword):
+    """ Returns the value of the match keyword of a sequence item, in a hashable form
+
+    PARAMETERS
+    ----------
+    item: pydicom.Dataset
+        A sequence item
+    match_keyword: str
+        The keyword used to pair the items of the sequence, from ATTRIBUTE_MATCH_DICT
+    """
+    value = item[match_keyword].value
+    try:
+        hash(value)
+    except TypeError:
+        # Multi-valued elements
+        value = tuple(value)
+    return value
+
+
+def index_sequence(sequence, match_keyword):
+    """ Indexes the items of a sequence by the value of their match keyword
+
+    PARAMETERS
+    ----------
+    sequence: pydicom.Sequence
+        The sequence to index
+    match_keyword: str
+        The keyword used to pair the items of the sequence, from ATTRIBUTE_MATCH_DICT
+
+    RETURNS
+    -------
+    dict of {match value: [item, ...]}, with the items of each value in sequence order
+    """
+    index = {}
+    for item in sequence:
+        index.setdefault(match_value(item, match_keyword), []).append(item)
+    return index
+
+
 def create_dicom_tree_pair(
         ds1,
         ds2,
@@ -52,8 +91,14 @@ def create_dicom_tree_pair(
     else:
         childs_parent_key = f"{parent_key}>{tree_label}"
 
+    # Index the keywords of each dataset once for this level
+    ds1_keywords = ds1.dir()
+    ds2_keywords = ds2.dir()
+    ds1_keyword_set = set(ds1_keywords)
+    ds2_keyword_set = set(ds2_keywords)
+
     # Loop over all keywords in the first DICOM file
-    for ds1_keyword in ds1.dir():
+    for ds1_keyword in ds1_keywords:
 
         if ds1_keyword in PROCESS_FUNCTION_DICT:
             process_func, kwargs = PROCESS_FUNCTION_DICT[ds1_keyword]
@@ -63,7 +108,7 @@ def create_dicom_tree_pair(
         # CASE 1: The item is not a Sequence
         if ds1[ds1_keyword].VR != "SQ":
 
-            if ds1_keyword not in ds2.dir():
+            if ds1_keyword not in ds2_keyword_set:
                 value_pair = (ds1[ds1_keyword].value, None)
             else:
                 value_pair = (ds1[ds1_keyword].value, ds2[ds1_keyword].value)
@@ -89,7 +134,7 @@ def create_dicom_tree_pair(
         # In order to match items in a sequences, we must know which data element
         # to use for matching. Check ATTRIBUTE_MATCH_DICT to see if one is specified.
         # If not, skip it.
-        if ds1_keyword not in ATTRIBUTE_MATCH_DICT.keys():
+        if ds1_keyword not in ATTRIBUTE_MATCH_DICT:
             tree_list.append(
                 SequencePair(
                     parent=dicom_tree_pair,
@@ -113,7 +158,7 @@ def create_dicom_tree_pair(
         # We will do the latter, as the details of the unique item may be of importance
         # and we want to preserve that information for analysis.
         match_keyword = ATTRIBUTE_MATCH_DICT[ds1_keyword]
-        if ds1_keyword not in ds2.dir():
+        if ds1_keyword not in ds2_keyword_set:
 
             sequence_pair = SequencePair(
                 parent=dicom_tree_pair,
@@ -161,27 +206,29 @@ def create_dicom_tree_pair(
         )
 
         sequence_list = []
-        # This is the slowest way to find matches, but it works.
-        # O(N) = N^2. Could probably get O(N) = 2N.
+        # Index the items of ds2 by their match value, so each item of ds1 is paired
+        # with a dictionary lookup rather than a scan of the ds2 sequence
+        ds2_index = index_sequence(ds2[ds1_keyword], match_keyword)
+        ds1_match_values = set()
         for item1 in ds1[ds1_keyword]:
-            found = False
+            value1 = match_value(item1, match_keyword)
+            ds1_match_values.add(value1)
+            matches = ds2_index.get(value1, [])
             label = f"{match_keyword}={item1[match_keyword].value}"
-            for item2 in ds2[ds1_keyword]:
-                if item1[match_keyword].value == item2[match_keyword].value:
-                    # We found a match. Send each element tree into comparison
-                    found = True
-                    sequence_list.append(
-                        create_dicom_tree_pair(
-                            ds1=item1,
-                            ds2=item2,
-                            parent=sequence_pair,
-                            depth=depth + 2,
-                            parent_key=f"{childs_parent_key}>{ds1_keyword}",
-                            tree_label=label,
-                        )
+            for item2 in matches:
+                # We found a match. Send each element tree into comparison
+                sequence_list.append(
+                    create_dicom_tree_pair(
+                        ds1=item1,
+                        ds2=item2,
+                        parent=sequence_pair,
+                        depth=depth + 2,
+                        parent_key=f"{childs_parent_key}>{ds1_keyword}",
+                        tree_label=label,
                     )
+                )
 
-            if not found:
+            if not matches:
                 # If we don't find a match, then this sequence item is unique
                 # We will pair it with blank dataset, which will result in
                 # all child elements being declared unique.
@@ -198,14 +245,8 @@ def create_dicom_tree_pair(
 
         # Repeat with ds2 as the search focus, to find unique items in ds2
         for item2 in ds2[ds1_keyword]:
-            found = False
             label = f"{match_keyword}={item2[match_keyword].value}"
-            for item1 in ds1[ds1_keyword]:
-                if item1[match_keyword].value == item2[match_keyword].value:
-                    # We found a match.
-                    found = True
-
-            if not found:
+            if match_value(item2, match_keyword) not in ds1_match_values:
                 # Unique to dataset 2
                 sequence_list.append(
                     create_dicom_tree_pair(
@@ -224,7 +265,7 @@ def create_dicom_tree_pair(
         tree_list.append(sequence_pair)
 
     # Loop over all keywords in the second DICOM file to capture items unique to dataset 2
-    for ds2_keyword in ds2.dir():
+    for ds2_keyword in ds2_keywords:
         if ds2_keyword in PROCESS_FUNCTION_DICT:
             process_func, kwargs = PROCESS_FUNCTION_DICT[ds2_keyword]
         else:
@@ -233,7 +274,7 @@ def create_dicom_tree_pair(
         if ds2[ds2_keyword].VR != "SQ":
 
             # Address Unique attributes in ds2
-            if ds2_keyword not in ds1.dir():
+            if ds2_keyword not in ds1_keyword_set:
                 value_pair = (None, ds2[ds2_keyword].value)
 
                 tree_list.append(
@@ -252,7 +293,7 @@ def create_dicom_tree_pair(
             continue
 
         # CASE 2a: Sequence ds2_keyword is not in our match sequence dictionary
-        if (ds2_keyword not in ATTRIBUTE_MATCH_DICT.keys()) and (ds2_keyword not in ds1.dir()):
+        if (ds2_keyword not in ATTRIBUTE_MATCH_DICT) and (ds2_keyword not in ds1_keyword_set):
             sequence_pair = SequencePair(
                 parent=dicom_tree_pair,
                 attribute_name=ds2_keyword,
@@ -271,7 +312,7 @@ def create_dicom_tree_pair(
 
         # CASE 2b: Sequence ds2_keyword is unique to dataset 2
 
-        if ds2_keyword not in ds1.dir():
+        if ds2_keyword not in ds1_keyword_set:
             match_keyword = ATTRIBUTE_MATCH_DICT[ds2_keyword]
 
             sequence_pair = SequencePair(
@@ -61,6 +61,10 @@ __copyright__ = 'Copyright (C) 2020, University of Wisconsin Board of Regents'
 
 import os
 import sys
+import atexit
+import concurrent.futures
+import hashlib
+import sqlite3
 import xml.etree.ElementTree
 import time
 import tempfile
@@ -71,12 +75,16 @@ import pydicom
 from pynetdicom import AE
 from pynetdicom.sop_class import RTPlanStorage, RTStructureSetStorage, CTImageStorage, RTDoseStorage, Verification
 from pydicom.uid import ImplicitVRLittleEndian
+from pydicom.dataelem import RawDataElement
+import pynetdicom
 import shutil
+from contextlib import closing
 import re
-import math
+import numpy as np
 import random
 import string
 from copy import deepcopy
+from functools import partial
 
 # Parse destination and filters XML files
 dest_xml = xml.etree.ElementTree.parse(os.path.join(os.path.dirname(__file__), 'DicomDestinations.xml'))
@@ -86,6 +94,33 @@ filter_xml = xml.etree.ElementTree.parse(os.path.join(os.path.dirname(__file__),
 local_AET = 'RAYSTATION_SSCP'
 local_port = 105
 
+# Ledger of the files each SCP destination has stored, files found in it are not sent again.
+# Set to None to send every file on every export.
+ledger_file = os.path.join(tempfile.gettempdir(), 'DicomExportLedger.sqlite')
+# Ledger entries older than this are sent again, as destinations purge patients they have stored
+LEDGER_DAYS = 1
+
+# Number of destinations sent to at the same time
+MAX_SEND_WORKERS = 4
+
+# Tags read from each exported file to classify it, RT plans are then read in full
+_HEADER_TAGS = ['SOPClassUID', 'SOPInstanceUID', 'PatientID', 'Modality']
+
+# Bulk data elements skipped by compare(): Pixel Data, Float and Double Float Pixel Data, Waveform Data
+# and Encapsulated Document
+_BULK_TAGS = {0x7fe00010, 0x7fe00008, 0x7fe00009, 0x54001010, 0x00420011}
+
+# Control point elements read into arrays for the RT plan control point filters
+_CP_COLUMNS = {'DoseRateSet': 0x300a0115,
+               'NominalBeamEnergy': 0x300a0114,
+               'TableTopLateralPosition': 0x300a012a,
+               'TableTopLongitudinalPosition': 0x300a0129,
+               'TableTopVerticalPosition': 0x300a0128,
+               'GantryAngle': 0x300a011e}
+
+# pynetdicom 2 and later can send a C-STORE straight from a file path
+_STORE_FROM_PATH = int(pynetdicom.__version__.split('.')[0]) >= 2
+
 # Define personal_tags (for anonymization)
 personal_tags = ['PatientName', 'PatientID', 'OtherPatientIDs', 'OtherPatientIDsSequence', 'PatientBirthDate']
 
@@ -122,24 +157,28 @@ def send(case,
          parent_plan=None,
          prdr_dr=False,
          rpm_gating=False,
-         bar=True):
+         force_resend=False,
+         bar=True,
+         timings=None):
     """DicomExport.send(case=get_current('Case'), destination='MIM', exam=get_current('Examination'),
-                        beamset=get_current('BeamSet'))"""
+                        beamset=get_current('BeamSet'))
+
+    If a timings dictionary is given, the seconds spent connecting, exporting, filtering, sending and in
+    total are stored in it."""
 
     # Start logging and timer
     logging.debug('Executing DICOM send() function, version {}'.format(__version__))
     tic = time.time()
+    lap = tic
     status = True
 
     # Re-cast string destination as list
     if isinstance(destination, str):
         destination = [destination]
 
-    # Create temporary folders to store original and modified exports
+    # Create a temporary folder to store the export, edited RT plans are written back to it once validated
     original = tempfile.mkdtemp()
     logging.debug('Temporary folder created for original files at {}'.format(original))
-    modified = tempfile.mkdtemp()
-    logging.debug('Temporary folder created for modified files at {}'.format(modified))
 
     # Validate destinations
     dest_list = destinations()
@@ -150,6 +189,9 @@ def send(case,
         else:
             logging.debug('Provided destination {} was found'.format(d))
 
+    # Give destinations that could not be reached by an earlier send() a new attempt
+    _association_pool.clear_failures()
+
     # If multiple machine filter options exist, prompt the user to select one
     if machine is None and filters is not None and 'machine' in filters and beamset is not None:
         machine_list = machines(beamset)
@@ -171,6 +213,14 @@ def send(case,
     else:
         energy_list = None
 
+    # Control point filters applied to each RT plan beam
+    cp_edits = control_point_edits(beamset=beamset,
+                                   table=table,
+                                   round_jaws=round_jaws,
+                                   pa_threshold=pa_threshold,
+                                   energy_list=energy_list,
+                                   prdr_dr=prdr_dr)
+
     # Establish connections with all SCP destinations
     if bar:
         bar = UserInterface.ProgressBar(text='Establishing connection to DICOM destinations',
@@ -197,21 +247,12 @@ def send(case,
 
         elif len({'host', 'aet', 'port'}.difference(info.keys())) == 0:
             raygateway_args = None
-            # Open a DICOM AE requestor for RayStation at RayStation_SSCP
-            #   Note that the local port is no longer required.
-            ae = AE(ae_title=local_AET)
-            # Add the requested context (Verification Service Object pair)
-            ae.add_requested_context('1.2.840.10008.1.1')
-            logging.debug('Requesting Association with {}'.format(info['host']))
-            # Associate the requestor AE
-            assoc = ae.associate(info['host'], int(info['port']), ae_title=info['aet'])
+            # Open (or reuse) the pooled association, which is verified with a C-ECHO once
+            assoc = _association_pool.get(d, info)
 
             # Throw errors unless C-ECHO responds
             if assoc.is_established:
-                logging.debug('Association accepted by the peer')
-                response = assoc.send_c_echo()
-                assoc.release()
-                logging.debug('C-ECHO Response: 0x{0:04x}'.format(response.Status))
+                logging.debug('Association with {} is established'.format(info['host']))
 
             elif assoc.is_rejected and not ignore_errors:
                 if isinstance(bar, UserInterface.ProgressBar):
@@ -273,6 +314,8 @@ def send(case,
         args['AnonymizedName'] = rename['name']
         args['AnonymizedId'] = rename['id']
 
+    lap = _lap(timings, 'connect', lap)
+
     # Export data to temp folder
     if isinstance(bar, UserInterface.ProgressBar):
         if raygateway_args is not None and len(destination) == 1:
@@ -393,21 +436,31 @@ def send(case,
                     bar.close()
                 raise
 
-    # Load the DICOM files back in, applying filters
-    edited = {}
+    lap = _lap(timings, 'export', lap)
+
+    # Classify the DICOM files from their headers, applying filters. Only RT plans can be edited, so only
+    # they are read in full. Edited plans are validated and written back once, then every file is sent to
+    # each destination straight from the export folder without decoding their pixel data
+    export_files = []
     if isinstance(bar, UserInterface.ProgressBar):
         bar.update(text='Applying filters')
 
-    for o in os.listdir(original):
+    for o in sorted(os.listdir(original)):
 
         # Try to open as a DICOM file
         try:
-            logging.debug('Reading original file {}'.format(o))
-            ds = pydicom.dcmread(os.path.join(original, o))
+            logging.debug('Reading original file header {}'.format(o))
+            ds = pydicom.dcmread(os.path.join(original, o), stop_before_pixels=True, specific_tags=_HEADER_TAGS)
+            if ds.file_meta.get('MediaStorageSOPClassUID') == RTPlanStorage:
+                ds = pydicom.dcmread(os.path.join(original, o))
 
             # If this is a DICOM RT plan
             expected = _Edits()
+            dso = None
             if ds.file_meta.MediaStorageSOPClassUID == '1.2.840.10008.5.1.4.1.1.481.5':
+                # Keep an unedited copy to validate the edits against
+                if not bypass_export_check:
+                    dso = deepcopy(ds)
                 for b in ds.BeamSequence:
 
                     # If applying a machine filter
@@ -415,31 +468,13 @@ def send(case,
                         b.TreatmentMachineName = machine
                         expected.add(b[0x300a00b2], beam=b)
 
-                    if 'TreatmentDeliveryType' in b and b.TreatmentDeliveryType == 'SETUP':
-                        # Change Dose rate for set-up fields to 100 MU/min
-                        for c in b.ControlPointSequence:
-                            c.DoseRateSet = 100
-                            expected.add(c[0x300a0115], beam=b, cp=c)
-                            # Change the nominal beam energy
-                            if 'NominalBeamEnergy' in c and c.NominalBeamEnergy != 6:
-                                c.NominalBeamEnergy = 6
-                                expected.add(c[0x300a0114], beam=b, cp=c)
-
-                    # If plan is prdr then set the nominal dose rate to 100 MU/min
-                    if prdr_dr and '_PRD_' in beamset.DicomPlanLabel and \
-                            'RadiationType' in b and b.RadiationType == 'PHOTON' and \
-                            'ControlPointSequence' in b:
-                        for c in b.ControlPointSequence:
-                            if 'DoseRateSet' in c and c.DoseRateSet != 100:
-                                c.DoseRateSet = 100
-                                expected.add(c[0x300a0115], beam=b, cp=c)
-
-                    # Change Dose rate for electron fields to 1000 MU/min
-                    if 'RadiationType' in b and b.RadiationType == 'ELECTRON' and 'ControlPointSequence' in b:
-                        for c in b.ControlPointSequence:
-                            c.DoseRateSet = 1000
-                            expected.add(c[0x300a0115], beam=b, cp=c)
+                    # Apply the control point filters in one pass over the control points of the beam
+                    cps = _ControlPoints(b)
+                    for edit in cp_edits:
+                        edit(cps, expected)
+                    cps.write(expected)
 
+                    if 'RadiationType' in b and b.RadiationType == 'ELECTRON' and 'ControlPointSequence' in b:
                         # The following lines add a new accessory for the electron block which is unnecessary in ARIA
                         # If converting electron block into accessory (note, accessory ID tags are currently hard coded
                         # if block_accessory and 'RadiationType' in b and b.RadiationType == 'ELECTRON' and \
@@ -483,77 +518,6 @@ def send(case,
                                 b.BlockSequence[0].BlockTrayID = tray
                                 expected.add(b.BlockSequence[0][0x300a00f5], beam=b)
 
-                    # If updating table position
-                    if table is not None and 'ControlPointSequence' in b:
-                        for c in b.ControlPointSequence:
-                            if 'TableTopLateralPosition' in c and c.TableTopLateralPosition != table[0]:
-                                c.TableTopLateralPosition = table[0]
-                                expected.add(c[0x300a012a], beam=b, cp=c)
-
-                            if 'TableTopLongitudinalPosition' in c and \
-                                    c.TableTopLongitudinalPosition != table[1]:
-                                c.TableTopLongitudinalPosition = table[1]
-                                expected.add(c[0x300a0129], beam=b, cp=c)
-
-                            if 'TableTopVerticalPosition' in c and c.TableTopVerticalPosition != table[2]:
-                                c.TableTopVerticalPosition = table[2]
-                                expected.add(c[0x300a0128], beam=b, cp=c)
-
-                    # If rounding jaws
-                    if round_jaws and 'ControlPointSequence' in b:
-                        for c in b.ControlPointSequence:
-                            if hasattr(c, 'BeamLimitingDevicePositionSequence'):
-                                for p in c.BeamLimitingDevicePositionSequence:
-                                    if 'LeafJawPositions' in p and len(p.LeafJawPositions) == 2 and \
-                                            (p.LeafJawPositions[0] != math.floor(10 * p.LeafJawPositions[0]) / 10 or
-                                             p.LeafJawPositions[1] != math.ceil(10 * p.LeafJawPositions[1]) / 10):
-                                        p.LeafJawPositions[0] = math.floor(10 * p.LeafJawPositions[0]) / 10
-                                        p.LeafJawPositions[1] = math.ceil(10 * p.LeafJawPositions[1]) / 10
-                                        expected.add(p[0x300a011c], beam=b, cp=c)
-
-                    # If adjusting PA beam angle for right sided targets
-                    if pa_threshold is not None:
-                        right_pa = True
-                        for c in b.ControlPointSequence:
-                            if 'GantryAngle' not in c or c.GantryAngle != 180 or \
-                                    'GantryRotationDirection' not in c or c.GantryRotationDirection != 'NONE' or \
-                                    ('IsocenterPosition' in c and c.IsocenterPosition < pa_threshold):
-                                right_pa = False
-                                break
-
-                        if right_pa:
-                            for c in b.ControlPointSequence:
-                                if 'GantryAngle' in c:
-                                    c.GantryAngle = 180.010
-                                    expected.add(c[0x300a011e], beam=b, cp=c)
-
-                    # If applying an energy filter (note only photon are supported)
-                    if energy_list is not None and 'ControlPointSequence' in b:
-                        for c in b.ControlPointSequence:
-                            if 'NominalBeamEnergy' in c and c.NominalBeamEnergy in energy_list.keys() and \
-                                    'RadiationType' in b and b.RadiationType == 'PHOTON':
-                                e = float(re.sub('\D+', '', energy_list[c.NominalBeamEnergy]))
-                                m = re.sub('\d+', '', energy_list[c.NominalBeamEnergy])
-                                if c.NominalBeamEnergy != e:
-                                    c.NominalBeamEnergy = e
-                                    expected.add(c[0x300a0114], beam=b, cp=c)
-
-                                # If a non-standard fluence, add mode ID and NON_STANDARD flag
-                                if 'FluenceMode' not in b or (b.FluenceMode != 'NON_STANDARD' and m != '') or \
-                                        (b.FluenceMode != 'STANDARD' and m == ''):
-
-                                    if m != '':
-                                        b.FluenceMode = 'NON_STANDARD'
-
-                                    else:
-                                        b.FluenceMode = 'STANDARD'
-
-                                    expected.add(b[0x30020051], beam=b, cp=c)
-
-                                if m != '' and ('FluenceModeID' not in b or b.FluenceModeID != m):
-                                    b.FluenceModeID = m
-                                    expected.add(b[0x30020052], beam=b, cp=c)
-
                     # If adding gantry period to TomoTherapy QA Plans
                     if couch_speed is not None:
                         # format and set tag to change
@@ -742,15 +706,29 @@ def send(case,
                            expected.add(p[0x300a0410])
                            logging.debug('Added gating params')
 
-            # If no edits are needed, copy the file to the modified directory
+            # If no edits are needed, the exported file is sent as is
             if expected.length() == 0:
-                logging.debug('File {} does not require modification, and will be copied directly'.format(o))
-                shutil.copy(os.path.join(original, o), modified)
+                logging.debug('File {} does not require modification, and will be sent unchanged'.format(o))
+                export_files.append(_ExportFile(o, os.path.join(original, o), ds))
 
             else:
-                edited[o] = expected
-                logging.debug('File {} re-saved with {} edits'.format(o, expected.length()))
-                ds.save_as(os.path.join(modified, o))
+                logging.debug('File {} edited with {} edits'.format(o, expected.length()))
+                # Validate changes against original file, recursively searching through sequences
+                if dso is not None:
+                    # The Edits list should match the expected list generated above
+                    if expected.matches(compare(ds, dso)):
+                        logging.debug('File {} edits are consistent with expected'.format(o))
+
+                    else:
+                        status = False
+                        if not ignore_errors:
+                            if isinstance(bar, UserInterface.ProgressBar):
+                                bar.close()
+
+                            raise KeyError('DICOM Export modification inconsistency detected')
+
+                ds.save_as(os.path.join(original, o))
+                export_files.append(_ExportFile(o, os.path.join(original, o), ds, edits=expected))
 
         # If pydicom fails, stop export unless ignore_errors flag is set
         except pydicom.errors.InvalidDicomError:
@@ -764,139 +742,183 @@ def send(case,
 
                 raise
 
-    # Validate and/or send each file
-    for d in destination:
-        info = destination_info(d)
-        if 'anonymize' in info and info['anonymize']:
-            random_name = ''.join(random.choice(string.ascii_uppercase) for _ in range(8))
-            random_id = ''.join(random.choice(string.digits) for _ in range(8))
-            logging.debug('Export destination {} is anonymous, patient will be stored under name {} and ID {}'.
-                          format(d, random_name, random_id))
-
-        # If an AE destination, establish pynetdicom association
-        if 'RayGateway' in info['type'] and qa_plan is None:
-            logging.debug('Multiple destinations, ScriptableDicomExport() to RayGateway {}'.format(raygateway_args))
-            rg_args = args
-            rg_args['RayGatewayTitle'] = raygateway_args
-            del rg_args['ExportFolderPath']
-
-            try:
-                case.ScriptableDicomExport(**args)
-                logging.info('Export to {} success'.format(info['aet']))
+    lap = _lap(timings, 'filter', lap)
+
+    # Send to each destination concurrently, RayStation exports to RayGateway stay on this thread
+    progress = {}
+    # Number of files each destination skipped as already stored
+    skipped = {}
+    # Destinations that failed and the errors raised by them
+    failed = []
+    errors = {}
+    workers = min(MAX_SEND_WORKERS, len(destination))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for d in destination:
+            info = destination_info(d)
+            if 'RayGateway' in info['type'] and qa_plan is None or d in progress:
+                continue
+            progress[d] = 0
+            skipped[d] = 0
+            futures[executor.submit(_send_destination, d, info, export_files, ignore_errors, force_resend,
+                                    progress, skipped)] = d
+
+        for d in destination:
+            info = destination_info(d)
+            if 'RayGateway' in info['type'] and qa_plan is None:
+                logging.debug('Multiple destinations, ScriptableDicomExport() to RayGateway {}'.format(raygateway_args))
+                rg_args = dict(args)
+                rg_args['RayGatewayTitle'] = raygateway_args
+                del rg_args['ExportFolderPath']
 
-            except Exception as error:
-                status = False
-                if hasattr(error, 'message'):
-                    logging.error('DicomExport failed {}'.format(error.message))
-                    UserInterface.MessageBox('DICOM export failed {}'.format(error.message), 'Export Fail')
+                try:
+                    case.ScriptableDicomExport(**rg_args)
+                    logging.info('Export to {} success'.format(info['aet']))
 
-                else:
+                except Exception as error:
+                    if hasattr(error, 'message'):
+                        error = error.message
                     logging.error('DicomExport failed {}'.format(error))
                     UserInterface.MessageBox('DICOM export failed {}'.format(error), 'Export Fail')
+                    failed.append(d)
+                    errors[d] = error
+
+        # Report progress of all destinations until each has finished
+        total = len(export_files)
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(pending, timeout=0.5)
+            for future in done:
+                d = futures[future]
+                try:
+                    if not future.result():
+                        failed.append(d)
 
-                raise
+                except (IOError, pydicom.errors.InvalidDicomError) as error:
+                    logging.error('Export to {} failed: {}'.format(d, error))
+                    failed.append(d)
+                    errors[d] = error
 
-            assoc = None
+            if isinstance(bar, UserInterface.ProgressBar):
+                bar.update(text='Validating and Exporting Files to ' +
+                                ', '.join('{} ({} of {})'.format(k, v, total) for k, v in progress.items()))
 
-        elif len({'host', 'aet', 'port'}.difference(info)) == 0:
-            # Establish an AE
-            ae = AE(ae_title=local_AET)
-            ae.add_requested_context(CTImageStorage, ImplicitVRLittleEndian)
-            ae.add_requested_context(RTStructureSetStorage, ImplicitVRLittleEndian)
-            ae.add_requested_context(RTPlanStorage, ImplicitVRLittleEndian)
-            ae.add_requested_context(RTDoseStorage, ImplicitVRLittleEndian)
-            ae.add_requested_context(Verification)
-            # MIM and Delta4 appear to timeout on a setting called ARTIM
-            ae.network_timeout = 600.
-            assoc = ae.associate(info['host'], int(info['port']), ae_title=info['aet'])
+    if failed:
+        status = False
+        logging.warning('Export to {} completed with errors'.format(', '.join(failed)))
+        if errors and not ignore_errors:
+            if isinstance(bar, UserInterface.ProgressBar):
+                bar.close()
 
-        else:
-            assoc = None
+            raise IOError('DICOM export failed to {}'.format(
+                ', '.join('{} ({})'.format(k, v) for k, v in errors.items())))
 
-        i = 0
-        total = len(os.listdir(modified))
-        for m in os.listdir(modified):
-            i += 1
-            if isinstance(bar, UserInterface.ProgressBar):
-                bar.update(text='Validating and Exporting Files to {} ({} of {})'.format(d, i, total))
+    _lap(timings, 'send', lap)
 
-            # send a message to the ae
-            try:
-                message = assoc.send_c_echo()
-                logging.debug('Echo request returned {}'.format(message))
-            except AttributeError:
-                logging.debug('Selected destination does not have echo properties')
-            try:
-                logging.debug('Reading modified file {}'.format(os.path.join(modified, m)))
-                ds = pydicom.dcmread(os.path.join(modified, m))
+    # Delete temporary folder
+    try:
+        logging.debug('Deleting temporary folder {}'.format(original))
+        shutil.rmtree(original)
+    except IOError:
+        logging.warning('One or more temporary folders could not be removed')
+
+    # Finish up
+    if isinstance(bar, UserInterface.ProgressBar):
+        bar.close()
+
+    _lap(timings, 'total', tic)
+    if status:
+        logging.info('DicomExport completed successfully in {:.3f} seconds'.format(time.time() - tic))
+        message = 'DICOM export was successful'
+        skipped = {k: v for k, v in skipped.items() if v > 0}
+        if skipped:
+            message += '\n\nFiles already stored and not sent again: {}\nUse force_resend to send them'.format(
+                ', '.join('{} ({})'.format(k, v) for k, v in skipped.items()))
+            logging.info('Files already stored and not sent again: {}'.format(skipped))
+        UserInterface.MessageBox(message, 'Export Success')
+
+    else:
+        logging.warning('DicomExport completed with errors in {:.3f} seconds'.format(time.time() - tic))
+        UserInterface.WarningBox('DICOM export finished but with errors', 'Export Warning')
+
+    return status
 
-                # Validate changes against original file, recursively searching through sequences
-                if m in edited and not bypass_export_check:
-                    logging.debug('Validating edits against {}'.format(os.path.join(original, m)))
-                    dso = pydicom.dcmread(os.path.join(original, m))
-                    try:
-                        # The Edits list should match the expected list generated above
-                        if edited[m].matches(compare(ds, dso)):
-                            logging.debug('File {} edits are consistent with expected'.format(m))
 
-                        else:
-                            status = False
-                            if not ignore_errors:
-                                if isinstance(bar, UserInterface.ProgressBar):
-                                    bar.close()
 
-                                raise KeyError('DICOM Export modification inconsistency detected')
+def _send_destination(d, info, export_files, ignore_errors, force_resend, progress, skipped):
+    """status = _send_destination('MIM', destination_info('MIM'), export_files, False, False, progress, skipped)
 
-                    except KeyError:
-                         if ignore_errors:
-                             logging.warning('DICOM validation encountered too many nested sequences')
-                             status = False
+    Sends the export files to one destination, run on a DicomExport.send() worker thread. Errors are
+    raised unless ignore_errors is set, in which case False is returned. Unchanged files that the
+    destination has stored in the last LEDGER_DAYS are skipped unless force_resend is set, and counted
+    in skipped[d]. progress[d] is set to the number of files handled so that the calling thread can
+    report it."""
 
-                         else:
-                             if isinstance(bar, UserInterface.ProgressBar):
-                                 bar.close()
-                             raise
+    status = True
+    anonymize = 'anonymize' in info and info['anonymize']
+    if anonymize:
+        random_name = ''.join(random.choice(string.ascii_uppercase) for _ in range(8))
+        random_id = ''.join(random.choice(string.digits) for _ in range(8))
+        logging.debug('Export destination {} is anonymous, patient will be stored under name {} and ID {}'.
+                      format(d, random_name, random_id))
+
+    # If an AE destination, use the pooled association and export ledger of this destination
+    ledger = None
+    if len({'host', 'aet', 'port'}.difference(info)) == 0:
+        assoc = _association_pool.get(d, info)
+        if ledger_file is not None:
+            ledger = _ExportLedger(ledger_file, info)
+
+    else:
+        assoc = None
 
-                # If destination has a anonymize tag, remove personal info
-                if 'anonymize' in info and info['anonymize']:
+    try:
+        for i, f in enumerate(export_files, start=1):
+            progress[d] = i
+            try:
+                # Anonymized destinations work on their own copy of the dataset
+                if anonymize:
+                    ds = f.read()
                     for t in personal_tags:
                         if hasattr(ds, t):
                             delattr(ds, t)
 
-                    ds.PatientName = ''.join(random.choice(string.ascii_uppercase) for _ in range(8))
-                    ds.PatientID = ''.join(random.choice(string.digits) for _ in range(8))
+                    ds.PatientName = random_name
+                    ds.PatientID = random_id
                     ds.PatientBirthdate = ''
+                    patient_id = random_id
+
+                else:
+                    ds = None
+                    patient_id = f.patient_id
 
                 # Do not send to SCP for RayGateway
                 if 'RAYGATEWAY' in info['type']:
                     logging.debug('{} is a RayGateway, skipping SCP'.format(info['host']))
 
+                # Skip files already stored by this destination
+                elif assoc is not None and ds is None and ledger is not None and not force_resend and \
+                        ledger.contains(f):
+                    logging.info('{} -> {} already stored, skipping'.format(f.name, d))
+                    skipped[d] += 1
+
                 # Send to SCP via pynetdicom
                 elif assoc is not None:
-                    if assoc.is_established:
-                        response = assoc.send_c_store(dataset=ds,
-                                                      msg_id=1,
-                                                      priority=0,
-                                                      originator_aet=None,
-                                                      originator_id=None)
-                        logging.info('{0} -> {1} C-STORE status: 0x{2:04x}'.format(m, d, response.Status))
-                        if response.Status != 0:
+                    assoc, response = _association_pool.store(d, info, ds if ds is not None else f.store_source())
+                    if response is not None:
+                        logging.info('{0} -> {1} C-STORE status: 0x{2:04x}'.format(f.name, d, response.Status))
+                        if response.Status == 0 and ds is None and ledger is not None:
+                            ledger.add(f)
+
+                        elif response.Status != 0:
                             status = False
                             if not ignore_errors:
-                                if isinstance(bar, UserInterface.ProgressBar):
-                                    bar.close()
-
-                                raise IOError('C-STORE ERROR: 0x{2:04x}'.format(m, d, response.Status))
+                                raise IOError('C-STORE ERROR: 0x{0:04x}'.format(response.Status))
 
                     elif assoc.is_rejected and not ignore_errors:
-                        if isinstance(bar, UserInterface.ProgressBar):
-                            bar.close()
-
                         raise IOError('Association to {} was rejected by the peer'.format(info['host']))
 
                     elif assoc.is_aborted and not ignore_errors:
-                        if isinstance(bar, UserInterface.ProgressBar):
-                            bar.close()
                         raise IOError('Received A-ABORT from the peer during association to {}'.format(info['host']))
 
                     else:
@@ -904,64 +926,52 @@ def send(case,
 
                 # Send to folder based on PatientID via file copy
                 elif 'path' in info:
-                    if not os.path.exists(os.path.join(info['path'], ds.PatientID)):
-                        os.mkdir(os.path.join(info['path'], ds.PatientID))
+                    folder = os.path.join(info['path'], patient_id)
+                    os.makedirs(folder, exist_ok=True)
 
                     try:
-                        shutil.copy(os.path.join(modified, m), os.path.join(info['path'], ds.PatientID))
-                        logging.info('{} -> {} copied'.format(m, os.path.join(info['path'], ds.PatientID)))
+                        if ds is None:
+                            shutil.copy(f.path, folder)
+                        else:
+                            ds.save_as(os.path.join(folder, f.name))
+                        logging.info('{} -> {} copied'.format(f.name, folder))
 
                     except IOError:
                         status = False
                         if ignore_errors:
-                            logging.warning('{} -> {} IOError'.format(m, os.path.join(info['path'], ds.PatientID)))
+                            logging.warning('{} -> {} IOError'.format(f.name, folder))
 
                         else:
-                            if isinstance(bar, UserInterface.ProgressBar):
-                                bar.close()
-
                             raise
 
             # If pydicom fails, stop export unless ignore_errors flag is set
             except pydicom.errors.InvalidDicomError as e:
                 if ignore_errors:
-                    logging.warning('File {} could not be read during modification, skipping'.format(m))
+                    logging.warning('File {} could not be read during modification, skipping'.format(f.name))
                     status = False
 
                 else:
-                    if isinstance(bar, UserInterface.ProgressBar):
-                        bar.close()
-                    logging.warning('File {} contains a dicom error {}'.format(m, e))
-
+                    logging.warning('File {} contains a dicom error {}'.format(f.name, e))
                     raise
 
-        if assoc is not None:
-            if assoc.is_established:
-                assoc.release()
-
-    # Delete temporary folders
-    try:
-        logging.debug('Deleting temporary folder {}'.format(original))
-        shutil.rmtree(original)
-        logging.debug('Deleting temporary folder {}'.format(modified))
-        shutil.rmtree(modified)
-    except IOError:
-        logging.warning('One or more temporary folders could not be removed')
+    finally:
+        if ledger is not None:
+            ledger.write()
 
-    # Finish up
-    if isinstance(bar, UserInterface.ProgressBar):
-        bar.close()
+    return status
 
-    if status:
-        logging.info('DicomExport completed successfully in {:.3f} seconds'.format(time.time() - tic))
-        UserInterface.MessageBox('DICOM export was successful', 'Export Success')
 
-    else:
-        logging.warning('DicomExport completed with errors in {:.3f} seconds'.format(time.time() - tic))
-        UserInterface.WarningBox('DICOM export finished but with errors', 'Export Warning')
+def _lap(timings, phase, start):
+    """lap = _lap(timings, 'export', lap) stores the seconds since start in timings, if given"""
+    now = time.time()
+    if timings is not None:
+        timings[phase] = now - start
+    return now
 
-    return status
 
+def release_associations(destination=None):
+    """DicomExport.release_associations() closes the associations kept open by send()"""
+    _association_pool.release(destination)
 
 
 def machines(beamset=None):
@@ -1074,53 +1084,361 @@ def destination_info(destination):
     return info
 
 
-def compare(ds, dso):
-    """edits = DicomExport.compare(dataset1, dataset2)"""
+def control_point_edits(beamset=None, table=None, round_jaws=False, pa_threshold=None, energy_list=None,
+                        prdr_dr=False):
+    """cp_edits = DicomExport.control_point_edits(table=[0, 0, 0], round_jaws=True)
+
+    Returns the control point filters used by send(), in the order they are applied. Each is called as
+    edit(cps, expected) on the _ControlPoints of a beam and updates its value arrays, which are written
+    back to the beam once all filters have run. A new filter is added here rather than as another loop
+    over the control points in send()."""
+
+    cp_edits = [_setup_beam_edit]
+    if prdr_dr and beamset is not None and '_PRD_' in beamset.DicomPlanLabel:
+        cp_edits.append(_prdr_dose_rate_edit)
+
+    cp_edits.append(_electron_dose_rate_edit)
+    if table is not None:
+        cp_edits.append(partial(_table_edit, table=table))
+
+    if round_jaws:
+        cp_edits.append(_round_jaws_edit)
+
+    if pa_threshold is not None:
+        cp_edits.append(partial(_right_pa_edit, pa_threshold=pa_threshold))
+
+    if energy_list is not None:
+        cp_edits.append(partial(_energy_edit, energy_list=energy_list))
+
+    return cp_edits
+
+
+def _setup_beam_edit(cps, expected):
+    # Change dose rate for set-up fields to 100 MU/min and the nominal beam energy to 6
+    if cps.beam.get('TreatmentDeliveryType') == 'SETUP':
+        cps.columns['DoseRateSet'][:] = 100
+        energy = cps.columns['NominalBeamEnergy']
+        energy[~np.isnan(energy)] = 6
+
+
+def _prdr_dose_rate_edit(cps, expected):
+    # If plan is prdr then set the nominal dose rate to 100 MU/min
+    if cps.beam.get('RadiationType') == 'PHOTON':
+        dose_rate = cps.columns['DoseRateSet']
+        dose_rate[~np.isnan(dose_rate)] = 100
+
+
+def _electron_dose_rate_edit(cps, expected):
+    # Change dose rate for electron fields to 1000 MU/min
+    if cps.beam.get('RadiationType') == 'ELECTRON':
+        cps.columns['DoseRateSet'][:] = 1000
+
+
+def _table_edit(cps, expected, table):
+    # Override the table position wherever it is set
+    for k, position in zip(['TableTopLateralPosition', 'TableTopLongitudinalPosition', 'TableTopVerticalPosition'],
+                           table):
+        column = cps.columns[k]
+        column[~np.isnan(column)] = position
+
+
+def _round_jaws_edit(cps, expected):
+    # Round the jaws out to the nearest mm
+    cps.jaws[:, 0] = np.floor(10 * cps.jaws[:, 0]) / 10
+    cps.jaws[:, 1] = np.ceil(10 * cps.jaws[:, 1]) / 10
+
+
+def _right_pa_edit(cps, expected, pa_threshold):
+    # Move static PA beams for right sided targets off 180 degrees. The lateral (x) isocenter coordinate
+    # is compared to the threshold
+    gantry = cps.columns['GantryAngle']
+    if np.all(gantry == 180) and all(r == 'NONE' for r in cps.rotation_directions) and \
+            not np.any(cps.isocenter_x < pa_threshold):
+        gantry[~np.isnan(gantry)] = 180.010
+
+
+def _energy_edit(cps, expected, energy_list):
+    # Apply the energy filter (note only photon are supported), adding the fluence mode of non-standard energies
+    b = cps.beam
+    if b.get('RadiationType') != 'PHOTON':
+        return
+
+    for i, energy in enumerate(cps.values['NominalBeamEnergy']):
+        if energy is None or energy not in energy_list.keys():
+            continue
+
+        cps.columns['NominalBeamEnergy'][i] = float(re.sub(r'\D+', '', energy_list[energy]))
+        m = re.sub(r'\d+', '', energy_list[energy])
+
+        # If a non-standard fluence, add mode ID and NON_STANDARD flag
+        if 'FluenceMode' not in b or (b.FluenceMode != 'NON_STANDARD' and m != '') or \
+                (b.FluenceMode != 'STANDARD' and m == ''):
+            b.FluenceMode = 'NON_STANDARD' if m != '' else 'STANDARD'
+            expected.add(b[0x30020051], beam=b, cp=cps.items[i])
+
+        if m != '' and ('FluenceModeID' not in b or b.FluenceModeID != m):
+            b.FluenceModeID = m
+            expected.add(b[0x30020052], beam=b, cp=cps.items[i])
+
+
+def compare(ds, dso, skip=None):
+    """edits = DicomExport.compare(dataset1, dataset2)
+
+    Returns the elements of dataset1 that are missing from or differ from dataset2, at any sequence
+    depth. Sequence items beyond the end of the dataset2 sequence are returned element by element,
+    elements only found in dataset2 are not returned. Bulk data elements (_BULK_TAGS) are skipped
+    unless another set of tags to skip is given."""
+
+    if skip is None:
+        skip = _BULK_TAGS
 
     edits = _Edits()
-    for k0 in ds.keys():
-        if k0 not in dso:
-            edits.add(ds[k0])
-
-        elif ds[k0].VR == 'SQ':
-            for i0 in range(len(ds[k0].value)):
-                for k1 in ds[k0].value[i0].keys():
-                    if k1 not in dso[k0].value[i0]:
-                        edits.add(ds[k0].value[i0][k1])
-
-                    elif ds[k0].value[i0][k1].VR == 'SQ':
-                        for i1 in range(len(ds[k0].value[i0][k1].value)):
-                            for k2 in ds[k0].value[i0][k1].value[i1].keys():
-                                if k2 not in dso[k0].value[i0][k1].value[i1]:
-                                    edits.add(ds[k0].value[i0][k1].value[i1][k2])
-
-                                elif ds[k0].value[i0][k1].value[i1][k2].VR == 'SQ':
-                                    for i2 in range(len(ds[k0].value[i0][k1].value[i1][k2].value)):
-                                        for k3 in ds[k0].value[i0][k1].value[i1][k2].value[i2].keys():
-                                            if k3 not in dso[k0].value[i0][k1]. \
-                                                    value[i1][k2].value[i2]:
-                                                edits.add(ds[k0].value[i0][k1].value[i1][k2].value[i2][k3])
-
-                                            elif ds[k0].value[i0][k1].value[i1][k2].value[i2][k3].VR == 'SQ':
-                                                raise KeyError('Unsupported number of nested sequences')
-
-                                            elif ds[k0].value[i0][k1].value[i1][k2].value[i2][k3].value != \
-                                                    dso[k0].value[i0][k1].value[i1][k2].value[i2][k3].value:
-                                                edits.add(ds[k0].value[i0][k1].value[i1][k2].value[i2][k3])
-
-                                elif ds[k0].value[i0][k1].value[i1][k2].value != \
-                                        dso[k0].value[i0][k1].value[i1][k2].value:
-                                    edits.add(ds[k0].value[i0][k1].value[i1][k2])
-
-                    elif ds[k0].value[i0][k1].value != dso[k0].value[i0][k1].value:
-                        edits.add(ds[k0].value[i0][k1])
-
-        elif ds[k0].value != dso[k0].value:
-            edits.add(ds[k0])
+    stack = [(ds, dso)]
+    while stack:
+        item, item_o = stack.pop()
+        for tag in item.keys():
+            if tag in skip:
+                continue
+
+            if item_o is None or tag not in item_o:
+                edits.add(item[tag])
+                continue
+
+            # Elements that have not been accessed since they were read are compared as raw bytes
+            raw, raw_o = item.get_item(tag), item_o.get_item(tag)
+            if isinstance(raw, RawDataElement) and isinstance(raw_o, RawDataElement) and raw.value == raw_o.value:
+                continue
+
+            element, element_o = item[tag], item_o[tag]
+            if element.VR == 'SQ':
+                items_o = element_o.value
+                for i, sequence_item in enumerate(element.value):
+                    stack.append((sequence_item, items_o[i] if i < len(items_o) else None))
+
+            elif element.value != element_o.value:
+                edits.add(element)
 
     return edits
 
 
+class _ControlPoints:
+    """_ControlPoints is an internal class that is used by DicomExport.send() to read the control point values
+    of one beam into arrays (nan where an element is absent), let the control point filters edit them, and
+    write back only the elements that changed"""
+
+    def __init__(self, beam):
+        """cps = _ControlPoints(beam)"""
+        self.beam = beam
+        self.items = list(beam.ControlPointSequence) if 'ControlPointSequence' in beam else []
+        self.values = {k: [c.get(k) for c in self.items] for k in _CP_COLUMNS}
+        self.original = {k: np.array([np.nan if v is None else float(v) for v in values], dtype=float)
+                         for k, values in self.values.items()}
+        self.columns = {k: v.copy() for k, v in self.original.items()}
+        self.rotation_directions = [c.get('GantryRotationDirection') for c in self.items]
+        self.isocenter_x = np.array([float(c.IsocenterPosition[0]) if 'IsocenterPosition' in c else np.nan
+                                     for c in self.items], dtype=float)
+
+        # Jaw positions are the two element LeafJawPositions of each control point
+        self.jaw_items = [(c, p) for c in self.items for p in c.get('BeamLimitingDevicePositionSequence', [])
+                          if 'LeafJawPositions' in p and len(p.LeafJawPositions) == 2]
+        self.original_jaws = np.array([[float(v) for v in p.LeafJawPositions] for _, p in self.jaw_items],
+                                      dtype=float).reshape(-1, 2)
+        self.jaws = self.original_jaws.copy()
+
+    def write(self, expected):
+        """cps.write(expected) sets the changed elements on the beam and records them as edits"""
+        for k, tag in _CP_COLUMNS.items():
+            original, column = self.original[k], self.columns[k]
+            for i in np.flatnonzero(~np.isnan(column) & (column != original)):
+                c = self.items[i]
+                setattr(c, k, column[i].item())
+                expected.add(c[tag], beam=self.beam, cp=c)
+
+        for i in np.flatnonzero(np.any(self.jaws != self.original_jaws, axis=1)):
+            c, p = self.jaw_items[i]
+            p.LeafJawPositions = self.jaws[i].tolist()
+            expected.add(p[0x300a011c], beam=self.beam, cp=c)
+
+
+class _AssociationPool:
+    """_AssociationPool is an internal class that is used by DicomExport.send() to keep one storage
+    association per destination open for the rest of the script run. Each association is verified
+    with a single C-ECHO when it is opened, and is re-opened if the peer has released or aborted it.
+    An association that cannot be opened is not requested again until clear_failures() is called, so
+    the remaining files of an unreachable destination fail without waiting for another connection."""
+
+    def __init__(self):
+        """pool = _AssociationPool()"""
+        self.associations = {}
+        # The association that could not be opened, by destination
+        self.failed = {}
+
+    def get(self, destination, info):
+        """assoc = pool.get('MIM', destination_info('MIM'))"""
+        assoc = self.associations.get(destination)
+        if assoc is not None and assoc.is_established:
+            return assoc
+
+        if destination in self.failed:
+            return self.failed[destination]
+
+        # Open a DICOM AE requestor for RayStation at RayStation_SSCP
+        ae = AE(ae_title=local_AET)
+        ae.add_requested_context(CTImageStorage, ImplicitVRLittleEndian)
+        ae.add_requested_context(RTStructureSetStorage, ImplicitVRLittleEndian)
+        ae.add_requested_context(RTPlanStorage, ImplicitVRLittleEndian)
+        ae.add_requested_context(RTDoseStorage, ImplicitVRLittleEndian)
+        ae.add_requested_context(Verification)
+        # MIM and Delta4 appear to timeout on a setting called ARTIM
+        ae.network_timeout = 600.
+        logging.debug('Requesting Association with {}'.format(info['host']))
+        assoc = ae.associate(info['host'], int(info['port']), ae_title=info['aet'])
+        if assoc.is_established:
+            response = assoc.send_c_echo()
+            logging.debug('Association accepted by {}, C-ECHO Response: 0x{:04x}'.format(
+                destination, response.Status if 'Status' in response else 0xffff))
+            self.associations[destination] = assoc
+
+        else:
+            logging.warning('Association with {} could not be opened, remaining files will not be sent'
+                            .format(destination))
+            self.associations.pop(destination, None)
+            self.failed[destination] = assoc
+
+        return assoc
+
+    def store(self, destination, info, dataset):
+        """assoc, response = pool.store('MIM', info, ds) sends one C-STORE, re-opening the association
+        once if it was aborted after being established. The response is None if no status was received."""
+        for attempt in range(2):
+            assoc = self.get(destination, info)
+            if not assoc.is_established:
+                return assoc, None
+
+            response = assoc.send_c_store(dataset=dataset,
+                                          msg_id=1,
+                                          priority=0,
+                                          originator_aet=None,
+                                          originator_id=None)
+            if 'Status' in response:
+                return assoc, response
+
+            logging.warning('No C-STORE response from {}, re-opening the association'.format(destination))
+            if assoc.is_established:
+                assoc.abort()
+
+        return assoc, None
+
+    def clear_failures(self):
+        """pool.clear_failures() lets the next get() request the associations that could not be opened"""
+        self.failed.clear()
+
+    def release(self, destination=None):
+        """pool.release() releases the association to destination, or all of them if None"""
+        names = list(self.associations) if destination is None else [destination]
+        if destination is None:
+            self.failed.clear()
+        else:
+            self.failed.pop(destination, None)
+
+        for d in names:
+            assoc = self.associations.pop(d, None)
+            if assoc is not None and assoc.is_established:
+                assoc.release()
+
+
+def _ledger_oldest():
+    """time = _ledger_oldest() returns the time of the oldest ledger entry that is still trusted"""
+    return time.time() - LEDGER_DAYS * 86400
+
+
+class _ExportLedger:
+    """_ExportLedger is an internal class that is used by DicomExport.send() to record the files that an
+    SCP destination has acknowledged with a successful C-STORE, by SOP Instance UID and content hash. It
+    is read and written by the worker thread of one destination. Entries older than LEDGER_DAYS are
+    ignored and dropped when it is written."""
+
+    def __init__(self, path, info):
+        """ledger = _ExportLedger(ledger_file, destination_info('MIM'))"""
+        self.path = path
+        # Key on the AE title and address, so a destination pointed at a new SCP starts afresh
+        self.destination = '{}@{}:{}'.format(info['aet'], info['host'], info['port'])
+        self.stored = set()
+        self.added = []
+        try:
+            with closing(sqlite3.connect(self.path, timeout=30.)) as connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS stored (destination TEXT, sop_instance_uid TEXT, '
+                                   'content_hash TEXT, time REAL, '
+                                   'PRIMARY KEY (destination, sop_instance_uid, content_hash))')
+                connection.commit()
+                self.stored = set(connection.execute('SELECT sop_instance_uid, content_hash FROM stored '
+                                                     'WHERE destination = ? AND time >= ?',
+                                                     (self.destination, _ledger_oldest())))
+
+        except sqlite3.Error as e:
+            logging.warning('Export ledger {} could not be read, all files will be sent: {}'.format(self.path, e))
+
+    def contains(self, f):
+        """boolean = ledger.contains(export_file)"""
+        return (f.sop_instance_uid, f.content_hash()) in self.stored
+
+    def add(self, f):
+        """ledger.add(export_file) records a successful C-STORE, written by ledger.write()"""
+        self.added.append((self.destination, f.sop_instance_uid, f.content_hash(), time.time()))
+
+    def write(self):
+        """ledger.write()"""
+        if len(self.added) == 0:
+            return
+
+        try:
+            with closing(sqlite3.connect(self.path, timeout=30.)) as connection:
+                connection.executemany('INSERT OR REPLACE INTO stored VALUES (?, ?, ?, ?)', self.added)
+                connection.execute('DELETE FROM stored WHERE time < ?', (_ledger_oldest(),))
+                connection.commit()
+            self.stored.update((a[1], a[2]) for a in self.added)
+            self.added = []
+
+        except sqlite3.Error as e:
+            logging.warning('Export ledger {} could not be updated: {}'.format(self.path, e))
+
+
+class _ExportFile:
+    """_ExportFile is an internal class that is used by DicomExport.send() to hold one exported file"""
+
+    def __init__(self, name, path, header, edits=None):
+        """f = _ExportFile(name, path, header, edits=expected)"""
+        self.name = name
+        self.path = path
+        # The edits written to the file, or None if it is sent as exported
+        self.edits = edits
+        self.patient_id = str(header.get('PatientID', ''))
+        self.sop_instance_uid = str(header.get('SOPInstanceUID', ''))
+        self.transfer_syntax = header.file_meta.get('TransferSyntaxUID')
+        self._content_hash = None
+
+    def read(self):
+        """ds = f.read() returns a copy of the dataset that may be modified for one destination"""
+        return pydicom.dcmread(self.path)
+
+    def content_hash(self):
+        """sha = f.content_hash() returns the SHA-1 of the exported file, computed once"""
+        if self._content_hash is None:
+            sha = hashlib.sha1()
+            with open(self.path, 'rb') as stream:
+                for block in iter(lambda: stream.read(1 << 20), b''):
+                    sha.update(block)
+            self._content_hash = sha.hexdigest()
+        return self._content_hash
+
+    def store_source(self):
+        """source = f.store_source() returns what to pass to C-STORE for the file. Files
+        in the negotiated transfer syntax are streamed from disk without decoding."""
+        if _STORE_FROM_PATH and self.transfer_syntax == ImplicitVRLittleEndian:
+            return self.path
+        return pydicom.dcmread(self.path)
+
+
 class _Edits:
     """_Edits is an internal class that is used by DicomExport.send() to keep track of DICOM tag edits"""
 
@@ -1178,3 +1496,8 @@ class _Edits:
             logging.warning('Expected modification tags: ' + ', '.join(self.tags))
             logging.warning('Observed modification tags: ' + ', '.join(edits.tags))
             return False
+
+
+# Associations are kept open across send() calls in one script run and released at exit
+_association_pool = _AssociationPool()
+atexit.register(release_associations)
@@ -32,6 +32,9 @@ __license__ = "GPLv3"
 __copyright__ = "Copyright (C) 2018, University of Wisconsin Board of Regents"
 
 import logging
+import time
+from collections import namedtuple
+import numpy as np
 import connect
 
 
@@ -39,7 +42,99 @@ class InvalidDataException(Exception):
     pass
 
 
-def find_scope(level=None):
+# Levels of the RayStation scope, from the outermost
+SCOPE_LEVELS = ["ui", "PatientDB", "Patient", "Case", "Examination", "Plan", "BeamSet"]
+
+
+def _get_current(level):
+    # Current RS object at level, None if it is not loaded
+    try:
+        return connect.get_current(level)
+    except Exception as error:
+        if not (hasattr(error, "Message") and "Invalid objectHandle" in error.Message):
+            logging.error("{}".format(error))
+        return None
+
+
+class ScopeSnapshot:
+    """
+    The current scope in RS. Each level is looked up with connect.get_current the first
+    time it is used and reused after that, so one snapshot can be passed down the call chain
+    instead of probing the scope again in each function. Levels that are not loaded are None.
+    Levels known to the caller can be given as keywords, e.g. ScopeSnapshot(Patient=patient)
+    """
+
+    def __init__(self, **levels):
+        self._levels = {}
+        for level, rs_obj in levels.items():
+            if level not in SCOPE_LEVELS:
+                raise KeyError("Unknown scope level {}".format(level))
+            self._levels[level] = rs_obj
+
+    def get(self, level):
+        """
+        :param level: one of SCOPE_LEVELS
+        :return: the RS object at level, or None if it is not loaded
+        """
+        if level not in self._levels:
+            if level not in SCOPE_LEVELS:
+                raise KeyError("Unknown scope level {}".format(level))
+            self._levels[level] = _get_current(level)
+        return self._levels[level]
+
+    __getitem__ = get
+
+    def require(self, level):
+        """
+        :param level: one of SCOPE_LEVELS
+        :return: the RS object at level, IOError if it is not loaded
+        """
+        rs_obj = self.get(level)
+        if rs_obj is None:
+            raise IOError("No {} loaded, load {}".format(level, level))
+        return rs_obj
+
+    def refresh(self, level=None):
+        """Look up level (or all levels if None) again on next use, e.g. after a reload"""
+        if level is None:
+            self._levels.clear()
+        else:
+            self._levels.pop(level, None)
+
+    def as_dict(self):
+        """:return: dict of every level, with None used for those not in the current scope"""
+        return {l: self.get(l) for l in SCOPE_LEVELS}
+
+    @property
+    def ui(self):
+        return self.get("ui")
+
+    @property
+    def db(self):
+        return self.get("PatientDB")
+
+    @property
+    def patient(self):
+        return self.get("Patient")
+
+    @property
+    def case(self):
+        return self.get("Case")
+
+    @property
+    def exam(self):
+        return self.get("Examination")
+
+    @property
+    def plan(self):
+        return self.get("Plan")
+
+    @property
+    def beamset(self):
+        return self.get("BeamSet")
+
+
+def find_scope(level=None, scope=None):
     """
     Find the current available scope in RS at the level of level.
         If level is used, and the level is not in the current scope, produce
@@ -48,35 +143,113 @@ def find_scope(level=None):
             with None used for those not in current scope.
     :param level: if specified, return the RS object at level if it exists
      else if level is not specified return a dict of the available scopes
+    :param scope: ScopeSnapshot to resolve the level from, a new one if None
     :return: if level is specified the RS object is returned.
         If find_scope, then a dict of plan variables is used
     """
-
-    # Find the deepest available scope and return a dict with available names
-    scope = {}
-    scope_levels = ["ui", "PatientDB", "Patient", "Case", "Examination", "Plan", "BeamSet"]
-
-    for l in scope_levels:
-        try:
-            rs_obj = connect.get_current(l)
-        except Exception as error:
-            if hasattr(error, "Message"):
-                no_current = "Invalid objectHandle"
-                if no_current in error.Message:
-                    rs_obj = None
-                else:
-                    logging.error("{}".format(error))
-        if l == level:
-            if rs_obj is None:
-                raise IOError("No {} loaded, load {}".format(l, l))
-            else:
-                return rs_obj
-        else:
-            scope[l] = rs_obj
-    if level is not None:
+    if scope is None:
+        scope = ScopeSnapshot()
+    if level is None:
+        return scope.as_dict()
+    if level not in SCOPE_LEVELS:
         logging.warning("Supplied level {} was not found".format(level))
+        return None
+    return scope.require(level)
+
+
+# Physics of a commissioned treatment machine. Leaf widths and centres are read-only
+# ndarrays [leaf]; the MLC and jaw values are None if the machine does not define them.
+MachinePhysics = namedtuple('MachinePhysics', [
+    'machine_name', 'commission_time', 'machine', 'leaf_widths', 'leaf_centers',
+    'min_gap_moving', 'leaf_jaw_overlap', 'max_tip', 'max_leaf_carriage', 'min_bottom_jaw_pos',
+    'is_tomo', 'is_arc'])
+# Machine physics by machine name, shared by every caller in this process
+_MACHINE_PHYSICS_CACHE = {}
+# Commission times of all machines by name, re-queried when older than MACHINE_INFO_MAX_AGE [s]
+_MACHINE_COMMISSION_TIMES = {'queried': None, 'times': {}}
+MACHINE_INFO_MAX_AGE = 300.
+
+
+def _get_attribute(obj, path):
+    # Follow a dotted attribute path, None if any level is missing
+    try:
+        for a in path.split('.'):
+            obj = getattr(obj, a)
+    except AttributeError:
+        return None
+    return obj
+
+
+def _read_only_array(values):
+    if values is None:
+        return None
+    array = np.array(list(values), dtype=float)
+    array.setflags(write=False)
+    return array
+
+
+def get_commission_times(refresh=False):
+    """Commission time of each machine in the machine database, queried at most once every
+    MACHINE_INFO_MAX_AGE seconds
+    :param refresh: query the machine database regardless of age
+    return: dict of {machine name: commission time}"""
+    queried = _MACHINE_COMMISSION_TIMES['queried']
+    if refresh or queried is None or time.monotonic() - queried > MACHINE_INFO_MAX_AGE:
+        machine_db = connect.get_current("MachineDB")
+        mm = machine_db.QueryCommissionedMachineInfo(Filter={})
+        times = {}
+        for m in mm:
+            try:
+                times[m['Name']] = m['CommissionTime']
+            except KeyError:
+                times[m['Name']] = None
+        _MACHINE_COMMISSION_TIMES['times'] = times
+        _MACHINE_COMMISSION_TIMES['queried'] = time.monotonic()
+    return _MACHINE_COMMISSION_TIMES['times']
+
+
+def get_machine_physics(machine_name, refresh=False):
+    """Load the physics of a treatment machine once per process. The cached entry is
+    reloaded if the machine has been recommissioned since it was read.
+    :param machine_name: name of the machine in raystation,
+        usually machine_name = beamset.MachineReference.MachineName
+    :param refresh: reload the machine from the machine database
+    return: MachinePhysics"""
+    commission_time = get_commission_times().get(machine_name)
+    physics = _MACHINE_PHYSICS_CACHE.get(machine_name)
+    if physics is not None and not refresh and physics.commission_time == commission_time:
+        return physics
+    if physics is not None and physics.commission_time != commission_time:
+        logging.info('Machine {} recommissioned {}, reloading physics'.format(
+            machine_name, commission_time))
+    machine_db = connect.get_current("MachineDB")
+    machine = machine_db.GetTreatmentMachine(machineName=machine_name, lockMode=None)
+    mlc_physics = _get_attribute(machine, 'Physics.MlcPhysics')
+    physics = MachinePhysics(
+        machine_name=machine_name,
+        commission_time=commission_time,
+        machine=machine,
+        leaf_widths=_read_only_array(_get_attribute(mlc_physics, 'UpperLayer.LeafWidths')),
+        leaf_centers=_read_only_array(
+            _get_attribute(mlc_physics, 'UpperLayer.LeafCenterPositions')),
+        min_gap_moving=_get_attribute(mlc_physics, 'MinGapMoving'),
+        leaf_jaw_overlap=_get_attribute(mlc_physics, 'LeafJawOverlap'),
+        max_tip=_get_attribute(mlc_physics, 'MaxTipDifference'),
+        max_leaf_carriage=_get_attribute(mlc_physics, 'Carriage.MaxLeafOutOfCarriageDistance'),
+        min_bottom_jaw_pos=_get_attribute(machine, 'Physics.JawPhysics.MinBottomJawPos'),
+        is_tomo=_get_attribute(machine, 'TomoBeamQualities._0') is not None,
+        is_arc=_get_attribute(machine, 'ArcProperties.MaxGantryAngleSpeed') is not None)
+    _MACHINE_PHYSICS_CACHE[machine_name] = physics
+    return physics
+
+
+def clear_machine_cache(machine_name=None):
+    """Drop the cached physics of machine_name, or of all machines if None"""
+    if machine_name is None:
+        _MACHINE_PHYSICS_CACHE.clear()
+        _MACHINE_COMMISSION_TIMES['queried'] = None
     else:
-        return scope
+        _MACHINE_PHYSICS_CACHE.pop(machine_name, None)
 
 
 def get_machine(machine_name):
@@ -84,9 +257,8 @@ def get_machine(machine_name):
     :param: machine_name (name of the machine in raystation,
     usually this is machine_name = beamset.MachineReference.MachineName
     return: machine (RS object)"""
-    machine_db = connect.get_current("MachineDB")
-    machine = machine_db.GetTreatmentMachine(machineName=machine_name, lockMode=None)
-    return machine
+    return get_machine_physics(machine_name).machine
+
 
 def get_all_commissioned(machine_type=None):
     """Find all machines that have the status commissioned and are not deprecated.
@@ -96,28 +268,20 @@ def get_all_commissioned(machine_type=None):
     machine_names = []
     if machine_type:
         for m in mm:
-            test_machine = get_machine(machine_name = m['Name'])
-            if machine_type == 'Tomo':
-                try:
-                    test_machine.TomoBeamQualities._0
-                    machine_names.append(m['Name'])
-                except AttributeError:
-                    pass
-            elif machine_type == 'VMAT':
-                try:
-                    test_machine.ArcProperties.MaxGantryAngleSpeed
-                    machine_names.append(m['Name'])
-                except AttributeError:
-                    pass
+            physics = get_machine_physics(machine_name=m['Name'])
+            if machine_type == 'Tomo' and physics.is_tomo:
+                machine_names.append(m['Name'])
+            elif machine_type == 'VMAT' and physics.is_arc:
+                machine_names.append(m['Name'])
     else:
         machine_names = [m['Name'] for m in mm]
 
     return machine_names
 
 
-def logcrit(message):
+def logcrit(message, scope=None):
     # Determine deepest scope
-    current_scope = find_scope()
+    current_scope = scope if scope is not None else ScopeSnapshot()
     level = ""
     # if current_scope['Patient'] is not None:
     #    level += 'PatientID: ' + current_scope['Patient'].PatientID + ':'
@@ -108,6 +108,9 @@ import datetime
 import sys
 import os
 import math
+import json
+import time
+import contextlib
 import pandas as pd
 import numpy as np
 import PlanOperations
@@ -792,6 +795,17 @@ def optimization_report(fluence_only, vary_grid, reduce_oar, segment_weight, **r
                     time_reduceoar.total_seconds())
             except KeyError:
                 logging.debug("No reduce OAR Dose time available")
+    # Output the time spent in each stage, and outside the stages nested in it
+    timer = report_inputs.get('timer')
+    if timer:
+        for name, (seconds, self_seconds, count) in timer.totals().items():
+            logging.info("Time: Stage {} x{} (seconds): {:.1f}, outside nested stages {:.1f}"
+                         .format(name, count, seconds, self_seconds))
+    # Output the reason the warm starts stopped
+    stop_reason = report_inputs.get('stop_reason')
+    if stop_reason:
+        logging.info("optimization report: Warm starts stopped: {}".format(stop_reason))
+        on_screen_message += "Warm starts stopped: {}\n".format(stop_reason)
     # Generate output - the onscreen message
     on_screen_message += 'Close this screen when complete'
     return on_screen_message
@@ -902,8 +916,46 @@ def get_current_objective_value(plan, beamset):
         return function_value
 
 
-def filename_iteration_output(iteration_number, beamset, patient, iteration_dir):
-    # Construct the output filename string
+def objective_converged(objective_values, window, tolerance):
+    """
+    Test whether the warm starts have converged: the relative improvement of the
+    objective value over the last window warm starts is below tolerance
+
+    :param objective_values: list of the objective value at the end of each warm start
+    :param window: number of warm starts over which the improvement is measured
+    :param tolerance: relative improvement below which the optimization is converged
+    :return: converged: True if the improvement is below tolerance
+    :return: improvement: relative improvement over the window, None if not yet available
+    """
+    if window < 1 or len(objective_values) <= window:
+        return False, None
+    reference = objective_values[-1 - window]
+    current = objective_values[-1]
+    if reference is None or current is None or reference == 0:
+        return False, None
+    improvement = (reference - current) / abs(reference)
+    return improvement < tolerance, improvement
+
+
+# Columns of the iteration log store, one row per objective per iteration
+ITERATION_STR_COLUMNS = ['Roi', 'FunctionType']
+ITERATION_INT_COLUMNS = ['WarmStart', 'ObjectiveIndex', 'Iteration']
+ITERATION_FLOAT_COLUMNS = ['Weight', 'DoseLevel', 'PercentVolume', 'EudParameterA', 'HighDose',
+                           'LowDose', 'Distance', 'Value', 'FinalValue', 'IterationTime']
+# Per warm start tomo parameters, repeated on each row
+ITERATION_TOMO_COLUMNS = ['time', 'rp', 'proj_time', 'total_travel', 'couch_speed',
+                          'mod_factor']
+ITERATION_CHUNK_PREFIX = 'warmstart_'
+
+
+def iteration_run_directory(beamset, patient, iteration_dir):
+    """
+    Create the directory holding the iteration log store of one beamset optimization run
+    :param beamset: RS beamset
+    :param patient: RS patient
+    :param iteration_dir: parent directory of all runs
+    :return: path to the run directory
+    """
     # Get the time
     now = datetime.datetime.now()
     dt_string = now.strftime("%m%d%Y_%H%M%S")
@@ -912,84 +964,139 @@ def filename_iteration_output(iteration_number, beamset, patient, iteration_dir)
     patient_string = patient.PatientID + "_" + beamset.DicomPlanLabel
     #
     # Join Strings
-    filename = patient_string + "_" + dt_string
+    run_dir = os.path.normpath(os.path.join(iteration_dir, patient_string + "_" + dt_string))
     #
     # Resolve dir
     try:
-        if not os.path.isdir(iteration_dir):
-            os.mkdir(iteration_dir)
+        os.makedirs(run_dir, exist_ok=True)
     except Exception as e:
         sys.exit('{}'.format(e))
-    return os.path.normpath('{}/{}.pkl'.format(iteration_dir, filename))
+    return run_dir
 
 
 def output_iteration_data(poo, warmstart_number,
-                          iteration_output_file,
+                          iteration_output_run,
                           beamset,
                           beam_params,
                           iteration_time):
     """
+    Append one warm start to the columnar iteration log store of this run. Each warm start
+    is written once as a compressed chunk of column arrays with a row per objective per
+    iteration. For tomo, the sinogram is stored once in the chunk, not on each row.
     poo: objective function object from RS
     warmstart_number: the iteration count
+    iteration_output_run: run directory from iteration_run_directory
+    beam_params: BeamOperations.TomoBeamParams for tomo, otherwise ignored
+    iteration_time: datetime.timedelta of the warm start
     """
     try:
         logging.debug('Beam params are {}'.format(beam_params))
-        iterations = poo.Iterations
-        objective_values = poo.ObjectiveValues
-        rtp_functions = poo.ForRtpFunctions
-        # Columns of Objective information
-        cols = ['Roi', 'FunctionType', 'Weight', 'DoseLevel',
-                'PercentVolume', 'EudA', 'HighDose', 'LowDose', 'Distance']
-        #
-        # Determine treatment technique
-        if beamset.DeliveryTechnique == 'TomoHelical':
-            cols = cols + ['time', 'rp', 'proj_time', 'total_travel', 'couch_speed', 'mod_factor']
-            beam_dict = {'time': float(beam_params.iloc[0].time),
-                         'proj_time': float(beam_params.iloc[0].proj_time),
-                         'rp': float(beam_params.iloc[0].rp),
-                         'total_travel': float(beam_params.iloc[0].total_travel),
-                         'couch_speed': float(beam_params.iloc[0].couch_speed),
-                         'mod_factor': float(beam_params.iloc[0].mod_factor),
-                         'sinogram': beam_params.iloc[0].sinogram,
-                         'WarmStart': int(warmstart_number),
-                         'IterationTime': float(iteration_time.total_seconds()),
-                         }
-            for k, v in beam_dict.items():
-                logging.debug('Adding the following to the output file {}, {}'.format(k, v))
-        else:
-            cols = cols + ['IterationTime']
-            beam_dict = {'IterationTime': float(iteration_time.total_seconds())}
-        # Columns of iteration number for each function
-        its_list = []
-        for i in iterations.tolist():
-            its_list.append(int(i))
-        cols = cols + iterations.tolist() + ['FinalValue']
-        logging.debug('Headers are {}'.format(cols))
-        # df_1 = pd.DataFrame(columns=cols)
-        # objective_index = 0
-        # for rf in rtp_functions:
-        #     row = parse_evaluation_function(poo, rf, rf_i=objective_index)
-        #     row.update(beam_dict)
-        #     df_1 = df_1.append(row, ignore_index=True)
-        #     objective_index += 1
-        objective_index = 0
-        rows = []  # Create an empty list to store rows
-        for rf in rtp_functions:
-            row = parse_evaluation_function(poo, rf, rf_i=objective_index)
-            row.update(beam_dict)
-            rows.append(row)  # Add the row to the list
-            objective_index += 1
-        # Create DataFrame from the list of dictionaries
-        df_1 = pd.DataFrame(rows, columns=cols)
-
-        # Output
-        df_1.to_pickle(iteration_output_file)
-        # Read back in with df_2 = rso.read_pickle(iteration_output_file)
+        is_tomo = beamset.DeliveryTechnique == 'TomoHelical'
+        rows = []
+        for objective_index, rf in enumerate(poo.ForRtpFunctions):
+            data = parse_evaluation_function(poo, rf, rf_i=objective_index)
+            # Integer keys are the function values at each iteration
+            values = {k: v for k, v in data.items() if isinstance(k, int)}
+            for iteration, value in values.items():
+                row = {k: v for k, v in data.items() if not isinstance(k, int)}
+                row.update({'ObjectiveIndex': objective_index,
+                            'Iteration': iteration,
+                            'Value': value})
+                rows.append(row)
+        columns = {'WarmStart': np.full(len(rows), int(warmstart_number), dtype=np.int32),
+                   'IterationTime': np.full(len(rows), iteration_time.total_seconds())}
+        for c in ITERATION_STR_COLUMNS:
+            columns[c] = np.array(['' if r.get(c) is None else str(r.get(c)) for r in rows],
+                                  dtype=str)
+        for c in ITERATION_INT_COLUMNS:
+            if c not in columns:
+                columns[c] = np.array([r[c] for r in rows], dtype=np.int32)
+        for c in ITERATION_FLOAT_COLUMNS:
+            if c not in columns:
+                columns[c] = np.array([np.nan if r.get(c) is None else r.get(c) for r in rows],
+                                      dtype=float)
+        if is_tomo:
+            for c in ITERATION_TOMO_COLUMNS:
+                columns[c] = np.full(len(rows), float(getattr(beam_params, c)))
+            if beam_params.sinogram is not None:
+                columns['sinogram'] = beam_params.sinogram
+        chunk_file = os.path.join(iteration_output_run, '{}{:03d}.npz'.format(
+            ITERATION_CHUNK_PREFIX, int(warmstart_number)))
+        # Write to a temporary name first so readers never see a partial chunk
+        temp_file = chunk_file + '.tmp.npz'
+        np.savez_compressed(temp_file, **columns)
+        os.replace(temp_file, chunk_file)
+        logging.debug('Warm start {} written to {}: {} rows'.format(
+            warmstart_number, chunk_file, len(rows)))
     except Exception as e:
         logging.debug('Error in setting output objective data {}'.format(e))
         sys.exit("{}".format(e))
 
 
+def iteration_chunk_files(run_dir):
+    # Warm start chunks of a run in warm start order
+    return sorted(os.path.join(run_dir, f) for f in os.listdir(run_dir)
+                  if f.startswith(ITERATION_CHUNK_PREFIX) and f.endswith('.npz')
+                  and not f.endswith('.tmp.npz'))
+
+
+def read_iteration_run(run_dir, columns=None):
+    """
+    Read the iteration log store of one run
+    :param run_dir: run directory from iteration_run_directory
+    :param columns: list of column names to read, all row columns if None
+    :return: pd.DataFrame with a row per objective per iteration of every warm start
+    """
+    frames = []
+    for f in iteration_chunk_files(run_dir):
+        with np.load(f, allow_pickle=False) as chunk:
+            names = columns if columns else [k for k in chunk.files if k != 'sinogram']
+            frames.append(pd.DataFrame({k: chunk[k] for k in names if k in chunk.files}))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_iteration_column(iteration_dir, column):
+    """
+    Read a single column across every run in an iteration directory. Only that column is
+    decompressed from each chunk.
+    :param iteration_dir: parent directory of the runs
+    :param column: column name, e.g. 'Value' or 'mod_factor'
+    :return: pd.DataFrame with Run, WarmStart and column
+    """
+    frames = []
+    for run in sorted(os.listdir(iteration_dir)):
+        run_dir = os.path.join(iteration_dir, run)
+        if not os.path.isdir(run_dir):
+            continue
+        for f in iteration_chunk_files(run_dir):
+            with np.load(f, allow_pickle=False) as chunk:
+                if column not in chunk.files:
+                    continue
+                values = chunk[column]
+                frames.append(pd.DataFrame({'Run': run,
+                                            'WarmStart': chunk['WarmStart'],
+                                            column: values}))
+    if not frames:
+        return pd.DataFrame(columns=['Run', 'WarmStart', column])
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_iteration_sinograms(run_dir):
+    """
+    Read the sinogram stored with each tomo warm start of a run
+    :param run_dir: run directory from iteration_run_directory
+    :return: dict of {warm start number: numpy array [projection, leaf]}
+    """
+    sinograms = {}
+    for f in iteration_chunk_files(run_dir):
+        with np.load(f, allow_pickle=False) as chunk:
+            if 'sinogram' in chunk.files:
+                sinograms[int(chunk['WarmStart'][0])] = chunk['sinogram']
+    return sinograms
+
+
 def reload_patient(patient_db, patient_info, case, plan, beamset):
     case_name = case.CaseName
     plan_name = plan.Name
@@ -1144,6 +1251,90 @@ def run_optimization(plan_optimization):
         return None, None, success, message
 
 
+class OptimizationTimer:
+    """
+    Nested timing spans of the stages of an optimization. Spans are opened with start (or
+    the span context manager) and closed with stop; a span opened while another is open
+    becomes its child. The time a span spends outside its children (self_seconds) is the
+    scripting and API overhead of that stage.
+    """
+
+    def __init__(self, **attributes):
+        self.attributes = attributes
+        self.spans = []
+        self._open = []
+
+    def start(self, name, **attributes):
+        """
+        Open a span, nested under the innermost open span
+        :param name: stage name, e.g. 'warm_start' or 'run_optimization'
+        :param attributes: json serializable values recorded with the span
+        """
+        span = {'id': len(self.spans),
+                'parent': self._open[-1]['id'] if self._open else None,
+                'depth': len(self._open),
+                'name': name,
+                'start': datetime.datetime.now().isoformat(),
+                'seconds': None,
+                'self_seconds': None,
+                '_t0': time.perf_counter(),
+                '_children': 0.}
+        span.update(attributes)
+        self.spans.append(span)
+        self._open.append(span)
+
+    def stop(self, name=None):
+        """
+        Close the innermost open span
+        :param name: if given, the name of the span expected to be closed
+        :return: duration of the span in seconds
+        """
+        span = self._open.pop()
+        if name is not None and span['name'] != name:
+            logging.warning('Timing span {} closed while {} was open'.format(name, span['name']))
+        span['seconds'] = time.perf_counter() - span.pop('_t0')
+        span['self_seconds'] = span['seconds'] - span.pop('_children')
+        if self._open:
+            self._open[-1]['_children'] += span['seconds']
+        return span['seconds']
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        self.start(name, **attributes)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def totals(self):
+        """
+        :return: dict of {stage name: [total seconds, self seconds, count]} of closed spans
+        """
+        totals = {}
+        for span in self.spans:
+            if span['seconds'] is None:
+                continue
+            total = totals.setdefault(span['name'], [0., 0., 0])
+            total[0] += span['seconds']
+            total[1] += span['self_seconds']
+            total[2] += 1
+        return totals
+
+    def write(self, file_name):
+        """
+        Write the closed spans and stage totals as json
+        :param file_name: path of the output file
+        """
+        spans = [{k: v for k, v in span.items() if not k.startswith('_')}
+                 for span in self.spans if span['seconds'] is not None]
+        with open(file_name, 'w') as f:
+            json.dump({'attributes': self.attributes,
+                       'spans': spans,
+                       'totals': {name: {'seconds': t[0], 'self_seconds': t[1], 'count': t[2]}
+                                  for name, t in self.totals().items()}},
+                      f, indent=1, default=str)
+
+
 def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
     """
     This function will optimize a plan
@@ -1215,9 +1406,8 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
     if reduce_mod:
         mod_target = optimization_inputs.get('mod_target', None)
     reduce_time = optimization_inputs.get('reduce_time', False)
-    # TODO: Make this a user configurable option
     if reduce_time:
-        max_reduce_time_iterations = 6
+        max_reduce_time_iterations = optimization_inputs.get('max_reduce_time_iterations', 6)
         patient_db = optimization_inputs.get('patient_db', None)
         name = patient.GetAlphabeticPatientName()
         # get the patient filters ready.
@@ -1247,12 +1437,20 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
         robust_posterior = optimization_inputs.get('robust_post', None)
         robust_right = optimization_inputs.get('robust_right', None)
         robust_left = optimization_inputs.get('robust_left', None)
+    # Convergence monitor: stop the warm starts once the relative objective improvement
+    # over convergence_window warm starts falls below convergence_tolerance
+    convergence_window = optimization_inputs.get('convergence_window', None)
+    convergence_tolerance = optimization_inputs.get('convergence_tolerance', 0.01)
     # Output of iteration during optimization specifications
     iteration_output_dir = optimization_inputs.get('output_data_dir', None)
     if iteration_output_dir:
         output_progress = True
     else:
         output_progress = False
+    iteration_output_run = None
+    # Stage timing spans are written to the run directory of the iteration output, or to a
+    # run directory of their own under timing_output_dir
+    timing_output_dir = optimization_inputs.get('timing_output_dir', iteration_output_dir)
 
     # Reporting
     report_inputs = {
@@ -1281,6 +1479,11 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
     # Start the clock on the script at this time
     # Timing
     report_inputs['time_total_initial'] = datetime.datetime.now()
+    timer = OptimizationTimer(patient_id=patient.PatientID,
+                              beamset=beamset.DicomPlanLabel,
+                              technique=beamset.DeliveryTechnique)
+    report_inputs['timer'] = timer
+    timer.start('optimize_plan')
 
     if fluence_only:
         logging.info('Fluence only: {}'.format(fluence_only))
@@ -1376,6 +1579,8 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
     i = 0
     beamsinrange = True
     optimization_iteration = 0
+    # Objective value at the end of each warm start on the current dose grid
+    warm_start_objective_values = []
 
     # SNS Properties
     maximum_segments_per_beam = 10  # type: int
@@ -1453,6 +1658,7 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
     # it is clear than when co-optimization occurs, we have more than one entry in here...
 
     # If not set yet, the dose grid needs setting.
+    timer.start('dose_grid_setup')
     current_grid = beamset.GetDoseGrid()
     if current_grid:
         current_voxelsize = np.array([current_grid.VoxelSize.x,
@@ -1482,10 +1688,12 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
         logging.debug(
             f'Dose grid initialized with voxel size {dose_dim_initial}')
         patient.Save()
+    timer.stop('dose_grid_setup')
 
     # Reset
     if reset_beams:
-        plan.PlanOptimizations[rs_opt_key].ResetOptimization()
+        with timer.span('reset_optimization'):
+            plan.PlanOptimizations[rs_opt_key].ResetOptimization()
         status.next_step("Resetting Optimization")
 
     if plan_optimization.ProgressOfOptimization:
@@ -1517,7 +1725,8 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
         # Start the clock for the fluence only optimization
         report_inputs.setdefault('time_iteration_initial', []).append(datetime.datetime.now())
         try:
-            plan.PlanOptimizations[rs_opt_key].RunOptimization()
+            with timer.span('run_optimization', fluence_only=True):
+                plan.PlanOptimizations[rs_opt_key].RunOptimization()
         except Exception as e:
             return False, 'Exception occurred during optimization: {}'.format(e)
         # Stop the clock
@@ -1535,6 +1744,7 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
             optimization_iteration, current_objective_function))
         reduce_oar_success = False
     else:
+        timer.start('beam_setup')
         for ts in treatment_setup_settings:
             # Set properties of the beam optimization
             if ts.ForTreatmentSetup.DeliveryTechnique == 'TomoHelical':
@@ -1550,9 +1760,12 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                                 'This beamset is already optimized. Not applying treat settings '
                                 'to targets')
                         else:
-                            treat_rois = select_rois_for_treat(plan, beamset=ts.ForTreatmentSetup,
-                                                               rois=None)
-                            set_treat_margins(beam=beams.ForBeam, rois=treat_rois, margins=margins)
+                            with timer.span('treat_margins', beam=beams.ForBeam.Name):
+                                treat_rois = select_rois_for_treat(plan,
+                                                                   beamset=ts.ForTreatmentSetup,
+                                                                   rois=None)
+                                set_treat_margins(beam=beams.ForBeam, rois=treat_rois,
+                                                  margins=margins)
                 #
                 # Set beam splitting preferences
                 for beams in ts.BeamSettings:
@@ -1591,12 +1804,14 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                         limit = [-20, 20, -10.8, 10.8]
                         for beams in ts.BeamSettings:
                             # Reference the beamset by the subobject in ForTreatmentSetup
-                            success = BeamOperations.check_beam_limits(beams.ForBeam.Name,
-                                                                       plan=plan,
-                                                                       beamset=ts.ForTreatmentSetup,
-                                                                       limit=limit,
-                                                                       change=True,
-                                                                       verbose_logging=True)
+                            with timer.span('jaw_limits', beam=beams.ForBeam.Name):
+                                success = BeamOperations.check_beam_limits(
+                                    beams.ForBeam.Name,
+                                    plan=plan,
+                                    beamset=ts.ForTreatmentSetup,
+                                    limit=limit,
+                                    change=True,
+                                    verbose_logging=True)
                             if not success:
                                 # If there are MU then this field has already been optimized with
                                 # the wrong jaw limits
@@ -1622,9 +1837,12 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                                           ' Not applying treat settings to Beam {}'.format(
                                               beams.ForBeam.Name))
                         else:
-                            treat_rois = select_rois_for_treat(plan, beamset=ts.ForTreatmentSetup,
-                                                               rois=None)
-                            set_treat_margins(beam=beams.ForBeam, rois=treat_rois, margins=margins)
+                            with timer.span('treat_margins', beam=beams.ForBeam.Name):
+                                treat_rois = select_rois_for_treat(plan,
+                                                                   beamset=ts.ForTreatmentSetup,
+                                                                   rois=None)
+                                set_treat_margins(beam=beams.ForBeam, rois=treat_rois,
+                                                  margins=margins)
                 #
                 # Check the control point spacing on arcs
                 for beams in ts.BeamSettings:
@@ -1656,12 +1874,14 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                         limit = [-20, 20, -10.8, 10.8]
                         for beams in ts.BeamSettings:
                             # Reference the beamset by the subobject in ForTreatmentSetup
-                            success = BeamOperations.check_beam_limits(beams.ForBeam.Name,
-                                                                       plan=plan,
-                                                                       beamset=ts.ForTreatmentSetup,
-                                                                       limit=limit,
-                                                                       change=True,
-                                                                       verbose_logging=True)
+                            with timer.span('jaw_limits', beam=beams.ForBeam.Name):
+                                success = BeamOperations.check_beam_limits(
+                                    beams.ForBeam.Name,
+                                    plan=plan,
+                                    beamset=ts.ForTreatmentSetup,
+                                    limit=limit,
+                                    change=True,
+                                    verbose_logging=True)
                             if not success:
                                 # If there are MU then this field has already been optimized with
                                 # the wrong jaw limits
@@ -1676,14 +1896,20 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                                 status.finish('Restart required')
                                 return False, 'Restart Required: Select reset beams on next run ' \
                                               'of script.'
+        timer.stop('beam_setup')
         if output_progress:
             time_0 = datetime.datetime.now()
             time_1 = time_0
+            # All warm starts of this run are appended to one iteration log store
+            iteration_output_run = iteration_run_directory(beamset=beamset,
+                                                           patient=patient,
+                                                           iteration_dir=iteration_output_dir)
 
         while optimization_iteration != maximum_iteration:
             #
             # ITERATION INITIALIZATION
             #
+            timer.start('warm_start', warm_start=optimization_iteration)
             # OBJECTIVE VALUE UPDATE
             # Update the primary objective value
             if plan_optimization.ProgressOfOptimization:
@@ -1710,15 +1936,18 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                     logging.info(
                         'Running current value of change_dose_grid is {}'.format(change_dose_grid))
                     dose_dim = change_dose_grid[optimization_iteration]
+                    # Objective values on different grids are not comparable
+                    warm_start_objective_values = []
                     # Start Clock on the dose grid change
                     report_inputs.setdefault('time_dose_grid_initial', []).append(
                         datetime.datetime.now())
-                    beamset.SetDefaultDoseGrid(
-                        VoxelSize={
-                            'x': dose_dim,
-                            'y': dose_dim,
-                            'z': dose_dim})
-                    plan.TreatmentCourse.TotalDose.UpdateDoseGridStructures()
+                    with timer.span('dose_grid_change', voxel_size=dose_dim):
+                        beamset.SetDefaultDoseGrid(
+                            VoxelSize={
+                                'x': dose_dim,
+                                'y': dose_dim,
+                                'z': dose_dim})
+                        plan.TreatmentCourse.TotalDose.UpdateDoseGridStructures()
                     # Stop the clock for the dose grid change
                     report_inputs.setdefault('time_dose_grid_final', []).append(
                         datetime.datetime.now())
@@ -1731,12 +1960,13 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                 old_delivery_time = beam_settings.TomoPropertiesPerBeam.MaxDeliveryTime
             if reduce_mod and optimization_iteration > 0:
                 if ts.ForTreatmentSetup.DeliveryTechnique == 'TomoHelical':
-                    tomo_params = BeamOperations.gather_tomo_beam_params(beamset)
+                    with timer.span('tomo_beam_params'):
+                        tomo_params = BeamOperations.gather_tomo_beam_params(beamset, lazy=True)
                     logging.debug('Tomo params are {}'.format(tomo_params))
                     for b in ts.BeamSettings:
-                        mod_ratio = mod_target / tomo_params.mod_factor[0]
+                        mod_ratio = mod_target / tomo_params.mod_factor
                         logging.debug('Delivery time currently {}'.format(old_delivery_time))
-                        logging.debug('Current MF={}, Target={}'.format(tomo_params.mod_factor[0],
+                        logging.debug('Current MF={}, Target={}'.format(tomo_params.mod_factor,
                                                                         mod_target))
                         if mod_ratio < 1.0:
                             new_delivery_time = old_delivery_time * mod_ratio * 0.9  # No
@@ -1746,7 +1976,7 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                                                                        b.ForBeam)
                             logging.info(
                                 'Target mod factor exceeded ({} > {}):'.format(
-                                    tomo_params.mod_factor[0], mod_target)
+                                    tomo_params.mod_factor, mod_target)
                                 + 'Max delivery time updated from {} to {}'.format(
                                     old_delivery_time,
                                     new_delivery_time))
@@ -1767,24 +1997,28 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
             logging.info(
                 'Current iteration = {} of {}'.format(optimization_iteration + 1,
                                                       maximum_iteration))
-            update_background_dose(plan, plan_optimization)
+            with timer.span('background_dose'):
+                update_background_dose(plan, plan_optimization)
             #
             # OPTIMIZATION
             # Run the optimization
-            time_0, time_1, success, message = run_optimization(plan_optimization)
+            with timer.span('run_optimization'):
+                time_0, time_1, success, message = run_optimization(plan_optimization)
             if not success:
                 sys.exit(message)
             #
             # Rescale to primary prescription if needed.
             if rescale:
-                beamset.ScaleToPrimaryPrescriptionDoseReference(
-                    LockedBeamNames=None,
-                    EvaluateOptimizationFunctionsAfterScaling=True)
+                with timer.span('rescale'):
+                    beamset.ScaleToPrimaryPrescriptionDoseReference(
+                        LockedBeamNames=None,
+                        EvaluateOptimizationFunctionsAfterScaling=True)
             #
             # POST OPTIMIZATION
             #
             # Output optmization data to file
             if output_progress:
+                timer.start('output_iteration_data')
                 poo = plan_optimization.ProgressOfOptimization
                 time_total = time_1 - time_0
                 logging.info("Time: Optimization (seconds): {}".format(
@@ -1795,18 +2029,13 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                     # TODO: Figure out what we want for VMAT
                     # Phys. Med. Biol. 60 (2015) 2587 - SAS 1 and 10
                     beam_params = {}
-                iteration_output_file = filename_iteration_output(
-                    iteration_number=optimization_iteration,
-                    beamset=beamset,
-                    patient=patient,
-                    iteration_dir=iteration_output_dir,
-                )
                 output_iteration_data(poo=poo,  # No matter what you call it
                                       warmstart_number=optimization_iteration,
-                                      iteration_output_file=iteration_output_file,
+                                      iteration_output_run=iteration_output_run,
                                       beamset=beamset,
                                       beam_params=beam_params,
                                       iteration_time=time_total)
+                timer.stop('output_iteration_data')
             # GET-TIME KEEPING DATA
             # Stop the clock
             report_inputs.setdefault('time_iteration_final', []).append(datetime.datetime.now())
@@ -1830,12 +2059,40 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                     previous_objective_function))
             # Start the clock
             previous_objective_function = current_objective_function
+            timer.stop('warm_start')
+            #
+            # CONVERGENCE
+            # Stop the warm starts if the objective has stopped improving. Not used with
+            # modulation reduction, where the objective is traded for a lower mod factor, or
+            # while a dose grid change is still to come.
+            if convergence_window and not reduce_mod:
+                warm_start_objective_values.append(get_current_objective_value(plan, beamset))
+                pending_grid_change = vary_grid and any(
+                    change_dose_grid[optimization_iteration:])
+                converged, improvement = objective_converged(warm_start_objective_values,
+                                                             window=convergence_window,
+                                                             tolerance=convergence_tolerance)
+                if improvement is not None:
+                    logging.info('Relative objective improvement over last {} warm starts is {}'
+                                 .format(convergence_window, improvement))
+                if converged and not pending_grid_change \
+                        and optimization_iteration != maximum_iteration:
+                    report_inputs['stop_reason'] = \
+                        'Converged after {} of {} warm starts: relative improvement {:.4g} over ' \
+                        'the last {} below tolerance {}'.format(
+                            optimization_iteration, maximum_iteration, improvement,
+                            convergence_window, convergence_tolerance)
+                    logging.info(report_inputs['stop_reason'])
+                    break
+        report_inputs.setdefault(
+            'stop_reason', 'Completed {} warm starts'.format(optimization_iteration))
 
         if reduce_time:
             patient.Save()
             logging.debug('Reduce time for beamset: {}'.format(
                 beamset.DicomPlanLabel))
             status.next_step(text='Running reduce time')
+            timer.start('reduce_time')
             reduce_time_iteration = 0
             plan_optimization_parameters.Algorithm.MaxNumberOfIterations = 30
             plan_optimization_parameters.DoseCalculation.IterationsInPreparationsPhase = 5
@@ -1854,16 +2111,19 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
 
             while reduce_time_iteration <= max_reduce_time_iterations:
                 # Run the optimization
-                time_0, time_1, success, message = run_optimization(plan_optimization)
+                with timer.span('run_optimization', reduce_time=reduce_time_iteration):
+                    time_0, time_1, success, message = run_optimization(plan_optimization)
                 if not success:
                     sys.exit(message)
                 # Determine if a delivery time reduction is possible based on current iteration
                 # results
+                timer.start('update_delivery_time', reduce_time=reduce_time_iteration)
                 beam_settings = get_beam_settings(plan, beamset, beam_name)
                 old_delivery_time = beam_settings.TomoPropertiesPerBeam.MaxDeliveryTime
                 delivery_time, message, continue_reduction = update_delivery_time(plan, beamset,
                                                                                   previous_objective_value=previous_objective_function,
                                                                                   old_delivery_time=old_delivery_time)
+                timer.stop('update_delivery_time')
                 logging.info(message)
                 if continue_reduction:
                     patient.Save()
@@ -1875,6 +2135,7 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                     status.update_text(text=status_message)
                 else:
                     # Reload patient and reset optimization to previous iteration
+                    timer.start('reload_patient')
                     patient, case, plan, beamset = reload_patient(patient_db,
                                                                   patient_info,
                                                                   case, plan, beamset)
@@ -1886,8 +2147,10 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                         previous_objective_value=previous_objective_function,
                         old_delivery_time=old_delivery_time,
                         reset_time=True)
+                    timer.stop('reload_patient')
                     logging.info(message)
                     reduce_time_iteration = max_reduce_time_iterations + 1
+            timer.stop('reduce_time')
             status_message = f"Time reduced from {initial_time} to {old_delivery_time} s"
             logging.info(status_message)
             status.update_text(text=status_message)
@@ -1924,7 +2187,8 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
                                     OptimizationTypes=["SegmentMU"]
                                 )
                     try:
-                        plan.PlanOptimizations[rs_opt_key].RunOptimization()
+                        with timer.span('run_optimization', segment_weight=True):
+                            plan.PlanOptimizations[rs_opt_key].RunOptimization()
                     except Exception as e:
                         if "Maximum leaf out of carriage" in str(e):
                             connect.await_user_input(
@@ -1956,7 +2220,8 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
             else:
                 status.next_step('Running ReduceOar Dose')
                 report_inputs['time_reduceoar_initial'] = datetime.datetime.now()
-                reduce_oar_success = reduce_oar_dose(plan_optimization=plan_optimization)
+                with timer.span('reduce_oar_dose'):
+                    reduce_oar_success = reduce_oar_dose(plan_optimization=plan_optimization)
                 report_inputs['time_reduceoar_final'] = datetime.datetime.now()
                 if reduce_oar_success:
                     logging.info('ReduceOAR successfully completed')
@@ -1972,10 +2237,18 @@ def optimize_plan(patient, case, exam, plan, beamset, **optimization_inputs):
     report_inputs['time_total_final'] = datetime.datetime.now()
     if save_at_complete:
         try:
-            patient.Save()
+            with timer.span('save'):
+                patient.Save()
             status.next_step('Save Complete')
         except Exception as e:
             return False, 'Exception occurred during optimization: {}'.format(e)
+    timer.stop('optimize_plan')
+    if timing_output_dir:
+        if iteration_output_run is None:
+            iteration_output_run = iteration_run_directory(beamset=beamset,
+                                                           patient=patient,
+                                                           iteration_dir=timing_output_dir)
+        timer.write(os.path.join(iteration_output_run, 'timing.json'))
 
     on_screen_message = optimization_report(
         fluence_only=fluence_only,
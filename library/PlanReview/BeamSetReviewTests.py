@@ -4,7 +4,10 @@ import logging
 from dateutil import parser
 from collections import namedtuple
 from math import isclose
-import connect
+import GeneralOperations
+from GeneralOperations import get_machine_physics
+from BeamOperations import get_beam_segment_data
+from PlanReview.utils.beam_complexity import compute_complexity_batch
 from ReviewDefinitions import *
 import ExamTests
 
@@ -149,17 +152,11 @@ def couch_type_correct(rso):
     return pass_result, message_str
 
 
-def pass_control_point_spacing(s, s0, spacing):
-    if not s0:
-        if s.DeltaGantryAngle <= spacing:
-            return True
-        else:
-            return False
-    else:
-        if s.DeltaGantryAngle - s0.DeltaGantryAngle <= spacing:
-            return True
-        else:
-            return False
+def control_point_spacing_failures(delta_gantry_angles, spacing):
+    # Control point numbers (1-based) whose gantry step from the previous control point
+    # (or from the beam start for the first) exceeds spacing
+    steps = np.diff(delta_gantry_angles, prepend=0.)
+    return (np.flatnonzero(~(steps <= spacing)) + 1).tolist()
 
 
 def message_format_control_point_spacing(beam_spacing_failures, spacing):
@@ -186,12 +183,11 @@ def check_control_point_spacing(rso, **kwargs):
     child_key = 'Control Point Spacing'
     beam_result = {}
     for b in rso.beamset.Beams:
-        s0 = None
-        fails = []
-        for s in b.Segments:
-            if not pass_control_point_spacing(s, s0, spacing=expected):
-                fails.append(s.SegmentNumber + 1)
-            s0 = s
+        segment_data = get_beam_segment_data(b)
+        if segment_data is None:
+            continue
+        fails = control_point_spacing_failures(segment_data.delta_gantry_angles,
+                                               spacing=expected)
         if fails:
             beam_result[b.Name] = fails
     message_str, pass_result = message_format_control_point_spacing(beam_spacing_failures=beam_result,
@@ -882,52 +878,31 @@ def closed_leaf_gaps(banks, min_gap_moving):
 
 def get_segment_number(beam):
     # Get total number of segments in the beam
-    try:
-        seg_num = 0
-        # Find the number of leaves in the first segment to initialize the array
-        for s in beam.Segments:
-            seg_num += 1
-    except:
+    segment_data = get_beam_segment_data(beam)
+    if segment_data is None:
         return None
-    return seg_num
+    return segment_data.banks.shape[2]
 
 
 def get_relative_weight(beam):
     # Get each segment weight
-    weights = []
-    for s in beam.Segments:
-        weights.append(s.RelativeWeight)
-    return weights
+    return get_beam_segment_data(beam).weights
 
 
 def get_mlc_bank_array(beam):
-    # Find the number of segments
-    segment_number = get_segment_number(beam)
-    if not segment_number:
-        return None
-    else:
-        s0 = beam.Segments[0]
-    #
-    # Get the number of leaves
-    num_leaves_per_bank = int(s0.LeafPositions[0].shape[0])
-    # Bank array declaration
-    banks = np.empty((num_leaves_per_bank, 2, segment_number))
-    # Combine the segments into a single ndarray of size:
+    # Leaf positions shared with the other beam checks, a read-only ndarray of size:
     # number of MLCs x number of banks x number of segments
-    s_i = 0
-    for s in beam.Segments:
-        # Take the bank positions on X1-bank, and X2 Bank and put them in column 0, 1 respectively
-        banks[:, 0, s_i] = s.LeafPositions[0]  # np.dstack((banks, bank))
-        banks[:, 1, s_i] = s.LeafPositions[1]
-        s_i += 1
-    return banks
+    segment_data = get_beam_segment_data(beam)
+    if segment_data is None:
+        return None
+    return segment_data.banks
 
 
 def filter_banks(beam, banks):
     # MLCs x number of banks x number of segments
-    current_machine = get_machine(machine_name=beam.MachineReference.MachineName)
+    physics = get_machine_physics(beam.MachineReference.MachineName)
     # Min gap
-    min_gap_moving = current_machine.Physics.MlcPhysics.MinGapMoving
+    min_gap_moving = physics.min_gap_moving
     # Find all closed leaf gaps and zero them
     closed = closed_leaf_gaps(banks, min_gap_moving)
     # Filtered banks is dimension [N_MLC,Bank Index, Control Points]
@@ -936,18 +911,16 @@ def filter_banks(beam, banks):
     return filtered_banks
 
 
-def compute_mcs(beam, override_square=False):
-    # Step and Shoot
+def beam_complexity(beam, vmat, override_square=False):
+    # Score one beam with the batch complexity engine
     #
     # Get the beam mlc banks
     banks = get_mlc_bank_array(beam)
     weights = get_relative_weight(beam)
-    current_machine = get_machine(machine_name=beam.MachineReference.MachineName)
+    physics = get_machine_physics(beam.MachineReference.MachineName)
     # Leaf Widths
-    leaf_widths = current_machine.Physics.MlcPhysics.UpperLayer.LeafWidths
-    #
-    # Segment weights
-    segment_weights = np.array(weights)
+    leaf_widths = physics.leaf_widths
+    min_gap_moving = physics.min_gap_moving
     #
     # Filter the banks
     filtered_banks = filter_banks(beam, banks)
@@ -958,105 +931,19 @@ def compute_mcs(beam, override_square=False):
         filtered_banks[:, 1, :] = np.nan
         filtered_banks[32:38, 0, :] = -2.
         filtered_banks[32:38, 1, :] = 2.
-    # Mask out the closed mlcs
-    mask_banks = np.ma.masked_invalid(filtered_banks)
-    #
-    # Jm Number of active leaves in both banks in each control point
-    jm = np.count_nonzero(mask_banks, axis=0) - 1.  # Subtract for n+1 leaf without next in mask
-    # Max position
-    pos_max = np.amax(mask_banks, axis=0) - np.amin(mask_banks, axis=0)  # Checked
-    # Handle amax = amin (rectangles)
-    if np.amax(mask_banks[:, 0, :]) == np.amin(mask_banks[:, 0, :]):
-        pos_max[0, :] = np.amax(mask_banks[:, 0, :])
-    if np.amax(mask_banks[:, 1, :]) == np.amin(mask_banks[:, 1, :]):
-        pos_max[1, :] = np.amax(mask_banks[:, 1, :])
-    #
-    # Absolute value of difference in single bank leaf movement
-    pos_max = np.abs(pos_max)
-    #
-    # Difference in leaf positions for each segment on each bank
-    # Absolute value since the relative difference between leaves on the same
-    # bank is used
-    banks_diff = np.abs(mask_banks[:-1, :, :] - mask_banks[1:, :, :])
-    separated_lsv = np.divide(np.sum(pos_max - banks_diff, axis=0), (jm * pos_max))
-    # Compute the leaf sequence variability
-    lsv = separated_lsv[0, :] * separated_lsv[1, :]
-    weighted_lsv = np.sum(lsv * segment_weights)
-    #
-    # AAV calculation
-    apertures = mask_banks * leaf_widths[:, None, None]
-    mlc_diff = apertures[:, 1, :] - apertures[:, 0, :]
-    segment_aperture_area = np.sum(mlc_diff, axis=0)
-    #
-    # CIAO
-    beam_ciao = np.amax(mlc_diff, axis=1)
-    aav = segment_aperture_area / np.sum(beam_ciao)
-    weighted_aav = np.sum(aav * segment_weights)
-    #
-    # MCS calc
-    mcsv = np.sum(lsv * aav * segment_weights)
-    return weighted_lsv, weighted_aav, mcsv
+    scores = compute_complexity_batch(filtered_banks[np.newaxis], np.asarray(weights)[np.newaxis],
+                                      leaf_widths, min_gap_moving, vmat)
+    return scores['LSV'][0], scores['AAV'][0], scores['MCS'][0]
+
+
+def compute_mcs(beam, override_square=False):
+    # Step and Shoot
+    return beam_complexity(beam, vmat=False, override_square=override_square)
 
 
 def compute_mcs_masi(beam, override_square=False):
-    #
-    # Get the beam mlc banks
-    banks = get_mlc_bank_array(beam)
-    weights = get_relative_weight(beam)
-    current_machine = get_machine(machine_name=beam.MachineReference.MachineName)
-    # Leaf Widths
-    leaf_widths = current_machine.Physics.MlcPhysics.UpperLayer.LeafWidths
-    #
-    # Segment weights
-    segment_weights = np.array(weights)
-    averaged_segment_weights = segment_weights[0:-1]  # Last control point is zero MU
-    #
-    # Filter the banks
-    filtered_banks = filter_banks(beam, banks)
-    #
-    # Square field test
-    if override_square:
-        filtered_banks[:, 0, :] = np.nan
-        filtered_banks[:, 1, :] = np.nan
-        filtered_banks[32:38, 0, :] = -2.
-        filtered_banks[32:38, 1, :] = 2.
-    # Mask out the closed mlcs
-    mask_banks = np.ma.masked_invalid(filtered_banks)
-    #
-    # Jm Number of active leaves in both banks in each control point
-    jm = np.count_nonzero(mask_banks, axis=0) - 1.  # Subtract for n+1 leaf without next in mask
-    # Max position
-    pos_max = np.amax(mask_banks, axis=0) - np.amin(mask_banks, axis=0)  # Checked
-    # Handle amax = amin (rectangles)
-    if np.amax(mask_banks[:, 0, :]) == np.amin(mask_banks[:, 0, :]):
-        pos_max[0, :] = np.amax(mask_banks[:, 0, :])
-    if np.amax(mask_banks[:, 1, :]) == np.amin(mask_banks[:, 1, :]):
-        pos_max[1, :] = np.amax(mask_banks[:, 1, :])
-    # Absolute value of difference in single bank leaf movement
-    pos_max = np.abs(pos_max)
-    #
-    # Difference in leaf positions for each segment on each bank
-    banks_diff = np.abs(mask_banks[:-1, :, :] - mask_banks[1:, :, :])
-    separated_lsv = np.divide(np.sum(pos_max - banks_diff, axis=0), (jm * pos_max))
-    # Compute the leaf sequence variability
-    lsv = separated_lsv[0, :] * separated_lsv[1, :]
-    vmat_lsv = (lsv[:-1] + lsv[1:]) / 2.
-    weighted_vmat_lsv = np.sum(vmat_lsv * segment_weights[:-1])
-    #
-    # AAV calculation
-    apertures = mask_banks * leaf_widths[:, None, None]
-    mlc_diff = apertures[:, 1, :] - apertures[:, 0, :]
-    segment_aperature_area = np.sum(mlc_diff, axis=0)
-    #
-    # CIAO
-    beam_ciao = np.amax(mlc_diff, axis=1)
-    aav = segment_aperature_area / np.sum(beam_ciao)
-    vmat_aav = (aav[:-1] + aav[1:]) / 2.
-    weighted_vmat_aav = np.sum(vmat_aav * segment_weights[:-1])
-    #
-    # MCS calc
-    mcsv = np.sum(vmat_lsv * vmat_aav * averaged_segment_weights)
-    return weighted_vmat_lsv, weighted_vmat_aav, mcsv
+    # VMAT: adjacent control points averaged, last control point is zero MU
+    return beam_complexity(beam, vmat=True, override_square=override_square)
 
 
 def get_machine(machine_name):
@@ -1064,9 +951,7 @@ def get_machine(machine_name):
     :param: machine_name (name of the machine in raystation,
     usually this is machine_name = beamset.MachineReference.MachineName
     return: machine (RS object)"""
-    machine_db = connect.get_current("MachineDB")
-    machine = machine_db.GetTreatmentMachine(machineName=machine_name, lockMode=None)
-    return machine
+    return GeneralOperations.get_machine(machine_name)
 
 
 def compute_beam_properties(rso):
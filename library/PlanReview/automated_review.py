@@ -48,7 +48,7 @@ __credits__ = ['']
 import logging
 import PySimpleGUI as Sg
 import connect
-from GeneralOperations import find_scope
+from GeneralOperations import find_scope, ScopeSnapshot
 from collections import namedtuple
 from System import Environment
 from PlanReview.utils import comment_to_clipboard, perform_automated_checks
@@ -63,14 +63,15 @@ def automated_tests():
 
     # Initialize return variable
     Pd = namedtuple('Pd', ['error', 'db', 'case', 'patient', 'exam', 'plan', 'beamset'])
+    scope = ScopeSnapshot()
     # Get current patient, case, exam
     rso = Pd(error=[],
-             patient=find_scope(level='Patient'),
-             case=find_scope(level='Case'),
-             exam=find_scope(level='Examination'),
-             db=find_scope(level='PatientDB'),
-             plan=find_scope(level='Plan'),
-             beamset=find_scope(level='BeamSet'))
+             patient=find_scope(level='Patient', scope=scope),
+             case=find_scope(level='Case', scope=scope),
+             exam=find_scope(level='Examination', scope=scope),
+             db=find_scope(level='PatientDB', scope=scope),
+             plan=find_scope(level='Plan', scope=scope),
+             beamset=find_scope(level='BeamSet', scope=scope))
     r = comment_to_clipboard(rso)
 
     beamsets = [b.Name for b in rso.plan.BeamSets]
@@ -83,12 +84,13 @@ def automated_tests():
     #
     # Gui
     Sg.theme('Topanga')
-    col_widths = [20]
+    col_widths = [20, 40]
     col1 = Sg.Column([[Sg.Frame('ReviewChecks:',
                                 [[
                                     Sg.Tree(
                                         data=tree_data,
-                                        headings=['Checks', ],
+                                        headings=['Checks', 'Profile'],
+                                        visible_column_map=[True, False],
                                         auto_size_columns=False,
                                         num_rows=40,
                                         col0_width=120,
@@ -6,7 +6,7 @@ from PlanReview.review_definitions import YELLOW_CIRCLE, ALERT, BLUE_CIRCLE, DOM
 
 
 def build_tree_element(parent_key: str, child_key: str, pass_result: str,
-                       message_str: str) -> tuple:
+                       message_str: str, profile=None) -> tuple:
     """
     Builds an element for insertion in a PySimpleGui tree.
 
@@ -16,12 +16,15 @@ def build_tree_element(parent_key: str, child_key: str, pass_result: str,
         pass_result (str): The result of the test, either "Pass", "Fail",
         "Alert", or "".
         message_str (str): The user message.
+        profile (CheckProfile): The cost of running the test, shown in the
+        hidden profile column. None for tests that did not run a check.
 
     Returns:
         A tuple containing two lists.
         Parent list contains the node for the node and child
         list is the sub_node. Each list contains the following elements:
-        [key, value, text, pass/fail result, icon]
+        [key, value, text, pass/fail result, icon], followed by the profile
+        when one is given
     """
 
     # Determine the appropriate icon based on the pass result
@@ -41,6 +44,10 @@ def build_tree_element(parent_key: str, child_key: str, pass_result: str,
     child = [child_key, parent_key + '.' + child_key, message_str,
              pass_result, icon]
 
+    if profile is not None:
+        parent_node.append(profile)
+        child.append(profile)
+
     return parent_node, child
 
 
@@ -69,7 +76,7 @@ def insert_tests_return_fails(test_data, treedata, fails):
         test_data (list): A list of test data to be inserted into the tree.
         Each element should be
             a tuple in the format (test_name, test_key, test_description,
-            test_result, test_icon).
+            test_result, test_icon), optionally followed by the test profile.
         treedata (PySimpleGUI.TreeData): The PySimpleGUI TreeData object to
         insert the test data into.
         fails (list): An empty list that will be populated with any test
@@ -80,11 +87,12 @@ def insert_tests_return_fails(test_data, treedata, fails):
     """
     if test_data:
         for test in test_data:
-            test_name, test_key, test_description, test_result, test_icon = test
+            test_name, test_key, test_description, test_result, test_icon = test[:5]
+            profile = str(test[5]) if len(test) > 5 else ""
             logging.debug(f'test_name: {test_name}, test_key: {test_key},'
                           f'test_description: {test_description}')
             treedata.Insert(test_name, test_key, test_description,
-                            [test_result, ""], icon=test_icon)
+                            [test_result, profile], icon=test_icon)
             if (test_key == FAIL or test_key == ALERT) and test_result:
                 fails.append(
                     f"TEST: {test_name}: {test_key}: {test_description}")
@@ -508,7 +508,8 @@ def get_tests_from_tree(tree_children):
     """
     passing_tests = []
     failed_tests = []
-    for domain_type, domain_name, comment, child_key, result, pass_fail, icon in tree_children:
+    for domain_type, domain_name, comment, child_key, result, pass_fail, icon, \
+            *profile in tree_children:
         review_tab, comment = search_string(comment)
         child = {
             KEY_OUT_DOMAIN_TYPE: domain_type,
@@ -517,7 +518,8 @@ def get_tests_from_tree(tree_children):
             KEY_OUT_MESSAGE: str(result),
             KEY_OUT_ICON: str(icon),
             KEY_OUT_RESULT: pass_fail,
-            KEY_OUT_TAB: review_tab}
+            KEY_OUT_TAB: review_tab,
+            KEY_OUT_PROFILE: profile[0]._asdict() if profile else None}
         if pass_fail != PASS:
             child[KEY_OUT_COMMENT] = "Script Fail: Comment Needed"
             failed_tests.append(child)
@@ -607,7 +609,7 @@ def process_auto_tests(window, tests):
             KEY_OUT_DOMAIN_NAME: domain_name,
             KEY_OUT_TAB: test[KEY_OUT_TAB],
             KEY_OUT_TEST_SOURCE: SOURCE_AUTO,
-
+            KEY_OUT_PROFILE: test.get(KEY_OUT_PROFILE),
         }
         if test[KEY_OUT_RESULT] == FAIL:
             parsed_item[KEY_OUT_ICON] = RED_CIRCLE
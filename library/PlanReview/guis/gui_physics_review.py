@@ -343,11 +343,12 @@ def on_submit_build_tree(tree_data, tab_width, tab_height, pix_per_char_width, p
     tree_layout = [[Sg.Frame('Automated Review:',
                              [[Sg.Tree(
                                  data=tree_data,
-                                 headings=['Result'],
+                                 headings=['Result', 'Profile'],
+                                 visible_column_map=[True, False],
                                  auto_size_columns=False,
                                  num_rows=num_rows,
                                  col0_width=left_width,
-                                 col_widths=[right_width],
+                                 col_widths=[right_width, 4 * right_width],
                                  key='-TREE-',
                                  show_expanded=True,
                                  justification="left",
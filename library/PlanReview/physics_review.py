@@ -50,7 +50,7 @@ import os
 import PySimpleGUI as sg
 import logging
 from collections import namedtuple
-from GeneralOperations import find_scope
+from GeneralOperations import find_scope, ScopeSnapshot
 
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), '.'))
 from PlanReview.guis import (build_tree_element, build_review_tree,
@@ -253,14 +253,15 @@ def physics_review(do_physics_review=True, rso=None):
     # Initialize return variable
     Pd = namedtuple('Pd', ['error', 'db', 'case', 'patient', 'exam', 'plan',
                            'beamset'])
+    scope = ScopeSnapshot()
     # Get current patient, case, exam
     rso = Pd(error=[],
-             patient=find_scope(level='Patient'),
-             case=find_scope(level='Case'),
-             exam=find_scope(level='Examination'),
-             db=find_scope(level='PatientDB'),
-             plan=find_scope(level='Plan'),
-             beamset=find_scope(level='BeamSet'))
+             patient=find_scope(level='Patient', scope=scope),
+             case=find_scope(level='Case', scope=scope),
+             exam=find_scope(level='Examination', scope=scope),
+             db=find_scope(level='PatientDB', scope=scope),
+             plan=find_scope(level='Plan', scope=scope),
+             beamset=find_scope(level='BeamSet', scope=scope))
     #
     user_name = get_user_name()
     logging.info(f'Physics review script launched by {user_name}')
@@ -273,12 +274,12 @@ def physics_review(do_physics_review=True, rso=None):
                                'beamset'])
         # Get current patient, case, exam
         rso = Pd(error=[],
-                 patient=find_scope(level='Patient'),
-                 case=find_scope(level='Case'),
-                 exam=find_scope(level='Examination'),
-                 db=find_scope(level='PatientDB'),
-                 plan=find_scope(level='Plan'),
-                 beamset=find_scope(level='BeamSet'))
+                 patient=find_scope(level='Patient', scope=scope),
+                 case=find_scope(level='Case', scope=scope),
+                 exam=find_scope(level='Examination', scope=scope),
+                 db=find_scope(level='PatientDB', scope=scope),
+                 plan=find_scope(level='Plan', scope=scope),
+                 beamset=find_scope(level='BeamSet', scope=scope))
     # r = comment_to_clipboard(rso)
     #
     doc_only = True
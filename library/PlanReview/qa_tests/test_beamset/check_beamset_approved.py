@@ -1,7 +1,9 @@
 from PlanReview.review_definitions import PASS, FAIL, ALERT
 from PlanReview.utils import get_approval_info
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_beamset_approved(rso, **kwargs):
     """
     Check if a plan is approved
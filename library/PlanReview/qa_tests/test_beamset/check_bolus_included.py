@@ -1,7 +1,9 @@
 from PlanReview.review_definitions import BOLUS_NAMES, PASS, FAIL
 from PlanReview.utils import get_roi_list, match_roi_name
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_bolus_included(rso):
     """
 
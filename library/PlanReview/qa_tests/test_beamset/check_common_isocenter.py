@@ -1,7 +1,9 @@
 from math import isclose
 from PlanReview.review_definitions import FAIL, PASS
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_common_isocenter(rso, **kwargs):
     """
     Checks all beams in beamset for shared isocenter
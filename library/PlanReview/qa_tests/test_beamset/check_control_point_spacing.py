@@ -1,4 +1,8 @@
+import numpy as np
+from BeamOperations import get_beam_segment_data
 from PlanReview.review_definitions import PASS, FAIL
+from PlanReview.utils.check_runner import read_only
+from PlanReview.utils.check_cache import fingerprint, beamset_state
 
 
 def message_format_control_point_spacing(beam_spacing_failures, spacing):
@@ -14,19 +18,15 @@ def message_format_control_point_spacing(beam_spacing_failures, spacing):
     return message_str, message_result
 
 
-def pass_control_point_spacing(s, s0, spacing):
-    if not s0:
-        if s.DeltaGantryAngle <= spacing:
-            return True
-        else:
-            return False
-    else:
-        if s.DeltaGantryAngle - s0.DeltaGantryAngle <= spacing:
-            return True
-        else:
-            return False
+def control_point_spacing_failures(delta_gantry_angles, spacing):
+    # Control point numbers (1-based) whose gantry step from the previous control point
+    # (or from the beam start for the first) exceeds spacing
+    steps = np.diff(delta_gantry_angles, prepend=0.)
+    return (np.flatnonzero(~(steps <= spacing)) + 1).tolist()
 
 
+@read_only
+@fingerprint(beamset_state)
 def check_control_point_spacing(rso, **kwargs):
     """
     bs: RayStation beamset
@@ -37,12 +37,11 @@ def check_control_point_spacing(rso, **kwargs):
     expected = kwargs.get('expected')
     beam_result = {}
     for b in rso.beamset.Beams:
-        s0 = None
-        fails = []
-        for s in b.Segments:
-            if not pass_control_point_spacing(s, s0, spacing=expected):
-                fails.append(s.SegmentNumber + 1)
-            s0 = s
+        segment_data = get_beam_segment_data(b)
+        if segment_data is None:
+            continue
+        fails = control_point_spacing_failures(segment_data.delta_gantry_angles,
+                                               spacing=expected)
         if fails:
             beam_result[b.Name] = fails
     message_str, pass_result = message_format_control_point_spacing(
@@ -1,8 +1,10 @@
 from PlanReview.review_definitions import TOMO_DATA, TRUEBEAM_DATA, FAIL, \
     PASS, ALERT
 from PlanReview.utils.get_machine import get_machine
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_couch_type(rso):
     # Abbreviate geometries
     rg = rso.case.PatientModel.StructureSets[rso.exam.Name].RoiGeometries
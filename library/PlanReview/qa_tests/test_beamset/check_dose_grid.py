@@ -1,7 +1,9 @@
 from PlanReview.review_definitions import GRID_PREFERENCES, \
     PASS, FAIL, DOSE_GRID_DEFAULT
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_dose_grid(rso):
     """
     Based on plan name and dose per fraction, determines size of appropriate grid.
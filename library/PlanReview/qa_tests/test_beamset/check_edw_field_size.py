@@ -1,6 +1,8 @@
 from PlanReview.review_definitions import TRUEBEAM_DATA, PASS, FAIL
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_edw_field_size(rso):
     """
     Checks to see if all Y jaws  are greater than the EDW limit
@@ -1,7 +1,9 @@
 from PlanReview.review_definitions import (
     PASS, ALERT, FAIL, DOSE_FRACTION_PAIRS)
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_fraction_size(rso):
     """
     Check the fraction size for common errors
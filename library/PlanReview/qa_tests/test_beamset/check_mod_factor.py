@@ -1,6 +1,7 @@
 import re
-import numpy as np
+from BeamOperations import iter_tomo_sinogram, tomo_mod_factor
 from PlanReview.review_definitions import TOMO_PREFERENCES, ALERT, FAIL, PASS
+from PlanReview.utils.check_runner import read_only
 
 
 def compute_mod_factor(beam):
@@ -10,24 +11,11 @@ def compute_mod_factor(beam):
     :param beam:
     :return:
     """
-    sinogram = []
-    number_segments = 0
-    for s in beam.Segments:
-        number_segments += 1
-        leaf_pos = []
-        for l in s.LeafOpenFraction:
-            leaf_pos.append(l)
-        sinogram.append(leaf_pos)
-    # Convert sinogram to numpy array
-    sino_array = np.array(sinogram)
-    # Find non-zero elements
-    non_zero = np.where(sino_array != 0)
-    sino_non_zero = sino_array[non_zero]
-    # Mod Factor = Average / Max LOT
-    mod_factor = np.max(sino_non_zero) / np.mean(sino_non_zero)
-    return mod_factor
+    # Stream the sinogram, Mod Factor = Max LOT / Average of NonZero LOT
+    return tomo_mod_factor(iter_tomo_sinogram(beam))
 
 
+@read_only
 def check_mod_factor(rso):
     """
 
@@ -1,5 +1,9 @@
 from PlanReview.review_definitions import (
     PASS, ALERT, FAIL, NO_FLY_DOSE, NO_FLY_NAME)
+from PlanReview.utils.check_runner import read_only
+
+
+@read_only
 def check_no_fly(rso):
     """
 
@@ -2,6 +2,7 @@ from PlanReview.review_definitions import (
     PACEMAKER_NAME, PACEMAKER_DOSE, PACEMAKER_PRV_NAME, PASS, ALERT, FAIL,
     PACEMAKER_DISTANCE_TOLERANCE, PACEMAKER_SEARCH_DISTANCE)
 from PlanReview.utils import get_roi_list, match_roi_name
+from PlanReview.utils.check_runner import mutating
 
 
 def make_unsubtracted_dose_structure(pdata, dose_value):
@@ -133,6 +134,7 @@ def evaluate_pacer_safe_distance(rso):
     return safe_distance, message_str
 
 
+@mutating
 def check_pacemaker(rso):
     """
         Check pacemaker dose is less than 2. Alert if PRV exceeds dose
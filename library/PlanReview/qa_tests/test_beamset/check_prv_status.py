@@ -1,7 +1,9 @@
 import re
 from PlanReview.review_definitions import PASS, FAIL
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_prv_status(rso):
     """
     If priority 0 constraints (or undefined priority) constraints are used on a non-target,
@@ -1,7 +1,9 @@
 import numpy as np
 from PlanReview.review_definitions import GRID_PREFERENCES, PASS, FAIL, ALERT
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_slice_thickness(rso):
     """
     Checks the current exam used in this case for appropriate slice thickness
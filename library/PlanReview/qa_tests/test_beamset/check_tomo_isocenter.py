@@ -1,7 +1,9 @@
 import numpy as np
 from PlanReview.review_definitions import PASS, FAIL, TOMO_DATA
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_tomo_isocenter(rso):
     """
     Checks isocenter for lateral less than 2 cm.
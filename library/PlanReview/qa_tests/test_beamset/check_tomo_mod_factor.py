@@ -1,8 +1,9 @@
 import re
 from collections import namedtuple
-import numpy as np
+from BeamOperations import iter_tomo_sinogram, tomo_mod_factor
 from PlanReview.review_definitions import (
     PASS, ALERT, FAIL, TOMO_PREFERENCES,)
+from PlanReview.utils.check_runner import read_only
 
 # Declare the named tuple for storing computed TomoTherapy parameters
 TomoParams = namedtuple('TomoParams', ['gantry_period', 'time', 'couch_speed',
@@ -70,22 +71,8 @@ def compute_mod_factor(beam):
     :param beam:
     :return:
     """
-    sinogram = []
-    number_segments = 0
-    for s in beam.Segments:
-        number_segments += 1
-        leaf_pos = []
-        for l in s.LeafOpenFraction:
-            leaf_pos.append(l)
-        sinogram.append(leaf_pos)
-    # Convert sinogram to numpy array
-    sino_array = np.array(sinogram)
-    # Find non-zero elements
-    non_zero = np.where(sino_array != 0)
-    sino_non_zero = sino_array[non_zero]
-    # Mod Factor = Average / Max LOT
-    mod_factor = np.max(sino_non_zero) / np.mean(sino_non_zero)
-    return mod_factor
+    # Stream the sinogram, Mod Factor = Max LOT / Average of NonZero LOT
+    return tomo_mod_factor(iter_tomo_sinogram(beam))
 
 
 # TODO: Need better plan classification, a tool that looks at dose per fraction
@@ -111,6 +98,7 @@ def compute_mod_factor(beam):
 #                             dose_per_fx=dose_per_fraction)
 
 
+@read_only
 def check_tomo_mod_factor(rso):
     """
 
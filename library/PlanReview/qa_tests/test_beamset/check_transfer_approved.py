@@ -1,5 +1,6 @@
 from PlanReview.review_definitions import TOMO_DATA, PASS, FAIL
 from PlanReview.utils import get_approval_info
+from PlanReview.utils.check_runner import read_only
 
 
 def old_check_transfer_approved(rso, ):
@@ -49,6 +50,7 @@ def old_check_transfer_approved(rso, ):
     return pass_result, message_str
 
 
+@read_only
 def check_transfer_approved(rso, ):
     """
     Check if the transfer beamset is approved for the given beamset.
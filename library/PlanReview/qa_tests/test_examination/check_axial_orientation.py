@@ -1,6 +1,8 @@
 from PlanReview.review_definitions import PASS, FAIL
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_axial_orientation(rso):
     # Match the directions that a correctly oriented image should have
     patient_position = str(rso.exam.PatientPosition)
@@ -1,6 +1,10 @@
 import numpy as np
-import math
 from PlanReview.review_definitions import PASS, FAIL
+from PlanReview.utils.check_runner import read_only
+from PlanReview.utils.check_cache import fingerprint, structure_set_state
+
+# In-plane voxel size [cm] of the grid the rois are resampled onto
+GAP_VOXEL_SIZE = 0.2
 
 
 def get_slice_positions(rso):
@@ -15,64 +19,99 @@ def get_slice_positions(rso):
     return dicom_slice_positions
 
 
-def find_nearest(array, values):
-    # Finds the nearest values of the numpy array values in the array, array
-    array = np.asarray(array)
-    idx = [(np.abs(array - v)).argmin() for v in values]
-    return array[idx]
+def nearest_slices(slice_positions, z):
+    """
+    Finds the index of the CT slice nearest to each z position
+    :param slice_positions: sorted array of CT slice positions in z
+    :param z: array of z positions
+    :return: array of slice indices, the lower slice on a tie
+    """
+    idx = np.clip(np.searchsorted(slice_positions, z), 1, len(slice_positions) - 1)
+    below = z - slice_positions[idx - 1] <= slice_positions[idx] - z
+    return idx - below
 
 
-def extract_grid(rg, bb, voxel_size, slice_positions):
+def slice_aligned_grids(bounding_boxes, voxel_size, slice_positions):
     """
-    Resample the roi geometry (rg) of an roi onto a grid defined by that roi's bounding box
-    Returns a 3D array of the roi resampled onto a grid,
-    the values of the returned array are 0-255 depending on how much of that voxel is covered by
-    the roi
-    The 3D form is [z, y*x] for faster sorting by axial position
-    :param rg: rso geometry (case.PatientModel.StructureSets[exam].RoiGeometries[roi])
-    :param bb: bounding box
-    :param voxel_size: dict {'x','y','z'}: desired voxel size
-    :param slice_positions: array of CT slice positions in z
-    :return: an array resampled on the grid: [z, x*y]
+    Builds the resampling grid of each roi: its bounding box in x and y, and in z
+    one voxel per CT slice, starting on the CT slice nearest to the bottom of the
+    bounding box and ending one slice before the slice nearest to its top.
+    :param bounding_boxes: array [roi, (min, max), (x, y, z)] of the roi bounding boxes
+    :param voxel_size: dict {'x','y','z'}: voxel size, z the CT slice thickness
+    :param slice_positions: sorted array of CT slice positions in z
+    :return: (first slice index [roi], corners [roi, (x, y, z)], NrVoxels [roi, (x, y, z)])
     """
-    # Find nearest CT slices to the bounding box of the geometry
-    z0 = find_nearest(slice_positions, [bb[0]['z']])[0]
-    z1 = find_nearest(slice_positions, [bb[1]['z']])[0]
-    new_grid = {'Corner': {'x': bb[0]['x'], 'y': bb[0]['y'], 'z': bb[0]['z']},
-                'NrVoxels': {
-                    'x': int(math.ceil(bb[1]['x'] - bb[0]['x']) / voxel_size['x']),
-                    'y': int(math.ceil(bb[1]['y'] - bb[0]['y']) / voxel_size['y']),
-                    'z': int((z1 - z0) / voxel_size['z'])},
-                'VoxelSize': voxel_size}
-    resampled = rg.GetRoiGeometryAsVoxels(Corner=new_grid['Corner'],
-                                          VoxelSize=new_grid['VoxelSize'],
-                                          NrVoxels=new_grid['NrVoxels'])
-    return resampled.reshape(new_grid['NrVoxels']['z'],
-                             new_grid['NrVoxels']['y'] * new_grid['NrVoxels']['x'])
-
-
-def find_gaps(rg, voxel_size, slice_positions):
+    first_slice, last_slice = nearest_slices(
+        slice_positions, bounding_boxes[:, :, 2].T)
+    corners = bounding_boxes[:, 0, :].copy()
+    corners[:, 2] = slice_positions[first_slice]
+    nr_voxels = np.empty((len(bounding_boxes), 3), dtype=int)
+    for i, axis in enumerate(['x', 'y']):
+        nr_voxels[:, i] = np.maximum(1, np.ceil(
+            (bounding_boxes[:, 1, i] - bounding_boxes[:, 0, i]) / voxel_size[axis]))
+    nr_voxels[:, 2] = last_slice - first_slice
+    return first_slice, corners, nr_voxels
+
+
+def gap_ranges(empty):
     """
-    Find discontinuities in the supplied geometry in the sup/inf direction
-    :param rg: rso geometry (case.PatientModel.StructureSets[exam].RoiGeometries[roi])
-    :param voxel_size: dict {'x','y','z'}: desired voxel size
-    :param slice_positions: array of CT slice positions in z
-    :return: a list of slice positions which are missing contours
+    Run-length encodes the empty slices of an roi
+    :param empty: boolean array, True for each slice without contours
+    :return: array [gap, (first, last)] of the slice indices bounding each gap
     """
-    # Determine a bounding box for the contour
-    bb = rg.GetBoundingBox()
-    roi_voxels = extract_grid(rg, bb, voxel_size, slice_positions)
-    empty_slices = np.where(~np.any(roi_voxels[:-1], axis=1))[0]
-    if empty_slices.size > 0:
-        return empty_slices * voxel_size['z'] + bb[0]['z']
-    else:
-        return None
+    edges = np.diff(np.concatenate(([0], empty.astype(np.int8), [0])))
+    return np.column_stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1))
 
 
-def consecutive(data, stepsize=1):
-    return np.split(data, np.where(np.diff(data) >= stepsize)[0] + 1)
+def find_contour_gaps(roi_geometries, slice_positions, voxel_size):
+    """
+    Find discontinuities in the supplied geometries in the sup/inf direction.
+    All bounding boxes are read first and mapped onto the CT slices at once, then
+    each roi is resampled onto its slice aligned grid and its empty slices found
+    from the resampled voxels.
+    :param roi_geometries: list of rso geometries with contours
+        (case.PatientModel.StructureSets[exam].RoiGeometries[roi])
+    :param slice_positions: sorted array of CT slice positions in z
+    :param voxel_size: dict {'x','y','z'}: voxel size, z the CT slice thickness
+    :return: dict {roi name: array [gap, (first, last)] of the slice positions
+        bounding each gap} of the rois with gaps
+    """
+    if not roi_geometries:
+        return {}
+    bounding_boxes = np.array([[[p['x'], p['y'], p['z']] for p in rg.GetBoundingBox()]
+                               for rg in roi_geometries])
+    first_slices, corners, nr_voxels = slice_aligned_grids(
+        bounding_boxes, voxel_size, slice_positions)
+    gaps = {}
+    for rg, first_slice, corner, nr in zip(roi_geometries, first_slices, corners, nr_voxels):
+        # A roi on fewer than three slices leaves no slice to check
+        if nr[2] < 2:
+            continue
+        nr = {'x': int(nr[0]), 'y': int(nr[1]), 'z': int(nr[2])}
+        resampled = rg.GetRoiGeometryAsVoxels(
+            Corner={'x': float(corner[0]), 'y': float(corner[1]), 'z': float(corner[2])},
+            VoxelSize=voxel_size,
+            NrVoxels=nr)
+        roi_voxels = np.asarray(resampled).reshape(nr['z'], nr['y'] * nr['x'])
+        # The top slice of the grid borders the end of the roi and is not checked
+        empty = ~np.any(roi_voxels[:-1], axis=1)
+        if empty.any():
+            gaps[rg.OfRoi.Name] = slice_positions[first_slice + gap_ranges(empty)]
+    return gaps
+
+
+def is_derived(roi_geometry):
+    """
+    Derived rois are rebuilt from their sources, so they are not searched for gaps
+    """
+    try:
+        return roi_geometry.OfRoi.DerivedRoiExpression is not None
+    except AttributeError:
+        return False
 
 
+@read_only
+@fingerprint(structure_set_state)
 def check_contour_gaps(rso):
     """
     Look for S/I discontinuties in all rois that have contours and are not
@@ -88,37 +127,27 @@ def check_contour_gaps(rso):
         Tomo Leg: ZZUWQA_14Mar2023_01: GTV_Combo has the kinds of gaps I can think of
 
     """
-    # Look through all available rois that have contours for gaps
-    message_str = ""
-    # All Rois with contours
-    rois_with_contours = [rg.OfRoi.Name for rg in
-                          rso.case.PatientModel.StructureSets[rso.exam.Name].RoiGeometries if
-                          rg.HasContours()]
+    # All non-derived rois with contours
+    roi_geometries = [rg for rg in
+                      rso.case.PatientModel.StructureSets[rso.exam.Name].RoiGeometries
+                      if rg.HasContours() and not is_derived(rg)]
     # Get slice positions
-    slices = get_slice_positions(rso)
+    slices = np.sort(get_slice_positions(rso))
     # Get the slice thickness of the CT
     delta_z = slices[1] - slices[0]
-    voxel_size = {'x': 0.2, 'y': 0.2, 'z': delta_z}
+    voxel_size = {'x': GAP_VOXEL_SIZE, 'y': GAP_VOXEL_SIZE, 'z': delta_z}
     # Build a dictionary with key = roi name, and values
     # of the gap strings
     gaps = {}
-    for roi in rois_with_contours:
-        # Get the roi geometry
-        roi_geometry = rso.case.PatientModel.StructureSets[rso.exam.Name].RoiGeometries[roi]
-        # Find any gaps
-        roi_gaps = find_gaps(roi_geometry, voxel_size, slice_positions=slices)
-        if roi_gaps is not None:
-            # Create an array of the sorted list of unique gap positions
-            slices_with_gaps = np.array(sorted(list(set(roi_gaps))))
-            gap_positions = []
-            gap_groups = consecutive(slices_with_gaps, delta_z + 1e-6)
-            for g in gap_groups:
-                if g.shape[0] > 1:
-                    gap_positions.append("({0:0.1f}-{1:0.1f})"
-                                         .format(round(g[0], 1), round(g[-1], 1)))
-                else:
-                    gap_positions.append("{0:0.1f}".format(round(g[0], 1)))
-            gaps[roi] = gap_positions
+    for roi, roi_gaps in find_contour_gaps(roi_geometries, slices, voxel_size).items():
+        gap_positions = []
+        for first, last in roi_gaps:
+            if first != last:
+                gap_positions.append("({0:0.1f}-{1:0.1f})"
+                                     .format(round(first, 1), round(last, 1)))
+            else:
+                gap_positions.append("{0:0.1f}".format(round(first, 1)))
+        gaps[roi] = gap_positions
 
     if gaps:
         pass_result = FAIL
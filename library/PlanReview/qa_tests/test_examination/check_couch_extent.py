@@ -1,8 +1,10 @@
 from PlanReview.review_definitions import (
     FIELD_OF_VIEW_PREFERENCES, TOMO_DATA, TRUEBEAM_DATA, PASS, FAIL)
 from .get_si_extent import get_si_extent
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_couch_extent(rso, **kwargs):
     """
        Check PTV volume extent have supports under them
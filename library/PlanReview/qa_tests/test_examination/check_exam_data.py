@@ -2,6 +2,7 @@ import re
 from dateutil import parser
 
 from PlanReview.review_definitions import PASS,FAIL
+from PlanReview.utils.check_runner import read_only
 
 
 def match_date(date1, date2):
@@ -63,6 +64,7 @@ def match_exactly(value1, value2):
         return False, value1, value2
 
 
+@read_only
 def check_exam_data(rso):
     """
     Checks the RayStation plan information versus the native CT DICOM header.
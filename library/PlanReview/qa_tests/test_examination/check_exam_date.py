@@ -2,8 +2,10 @@ from dateutil import parser
 import datetime
 from PlanReview.review_definitions import DAYS_SINCE_SIM, PASS,FAIL, ALERT
 from PlanReview.utils import get_approval_info
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_exam_date(rso):
     """
     Check if examination date occurred within tolerance set by DAYS_SINCE_SIM
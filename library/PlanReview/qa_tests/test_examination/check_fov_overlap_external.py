@@ -4,6 +4,8 @@ from PlanReview.review_definitions import (FIELD_OF_VIEW_PREFERENCES,
 PASS, FAIL, )
 from .get_targets_si_extent import get_targets_si_extent
 from .get_roi_list import get_roi_list
+from PlanReview.utils.check_runner import mutating
+from PlanReview.utils.check_cache import fingerprint, structure_set_state
 
 
 def match_roi_name(roi_names, roi_list):
@@ -212,6 +214,8 @@ def get_external(rso):
     return None
 
 
+@mutating
+@fingerprint(structure_set_state)
 def check_fov_overlap_external(rso, **kwargs):
     """
            Check if the field of view overlaps on slices where the target is close by
@@ -1,6 +1,8 @@
 from PlanReview.review_definitions import FIELD_OF_VIEW_PREFERENCES,PASS,FAIL
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_image_extent(rso, **kwargs):
     """
     Check if the image extent is long enough to cover the image set and a buffer
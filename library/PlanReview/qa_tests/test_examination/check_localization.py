@@ -1,6 +1,8 @@
 from PlanReview.review_definitions import PASS, FAIL
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_localization(rso):
     poi_coord = {}
     localization_found = False
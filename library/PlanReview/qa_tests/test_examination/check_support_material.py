@@ -1,8 +1,10 @@
 
 from PlanReview.review_definitions import MATERIALS, FAIL, PASS
 from .get_roi_list import get_roi_list
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_support_material(rso):
     """
     For the list of accepted supports defined in ReviewDefinitions.py->Materials
@@ -2,6 +2,7 @@ from dateutil import parser
 import datetime
 from PlanReview.review_definitions import *
 from PlanReview.utils.constants import KEY_SIM_DATE, KEY_SLICES
+from PlanReview.utils.check_runner import read_only
 
 
 def get_dicom_date_and_slices(rso):
@@ -55,6 +56,7 @@ def match_date(date1, date2):
         return False, parsed_date1, parsed_date2
 
 
+@read_only
 def check_exam_date_and_slices(rso, **kwargs):
     """
     Check if the exam date and slice count from the user match the DICOM data.
@@ -1,8 +1,10 @@
 # Plan Checks
 from PlanReview.utils import get_approval_info
 from PlanReview.review_definitions import PASS, FAIL, ALERT
+from PlanReview.utils.check_runner import read_only
 
 
+@read_only
 def check_plan_approved(rso, **kwargs):
     """
     Check if a plan is approved
@@ -1,6 +1,9 @@
 from PlanReview.review_definitions import (
     HDA_MAX_DIAMETER, ALERT, SUPPORT_TOLERANCE, TRUEBEAM_MAX_DIAMETER, PASS, FAIL)
 from PlanReview.utils import subtract_roi_sources,get_roi_names_from_type
+from PlanReview.utils.check_runner import mutating
+from PlanReview.utils.check_cache import (
+    fingerprint, structure_set_state, dose_grid_state)
 
 # TODO: Function that finds all possible angles in coplanar fields
 #       and returns as a list rounded to ints
@@ -64,6 +67,17 @@ def make_clearance_diameter(rso, clearance_name, diameter, tolerance):
         return None
 
 
+def isocenter_clearance_inputs(rso):
+    # The first beam's isocenter and technique, the dose grid, and the
+    # External and Support geometries (with the rest of the structure set)
+    beam = rso.beamset.Beams[0]
+    iso_pos = beam.Isocenter.Position
+    return (str(beam.DeliveryTechnique), (iso_pos.x, iso_pos.y, iso_pos.z),
+            dose_grid_state(rso.beamset), structure_set_state(rso))
+
+
+@mutating
+@fingerprint(isocenter_clearance_inputs)
 def check_isocenter_clearance(rso):
     """
     Using the Bore diameters and assuming only centered couch fields check for overlap with supports
@@ -9,4 +9,6 @@ from PlanReview.utils.constants import *
 from PlanReview.utils.comment_to_clipboard import comment_to_clipboard
 from PlanReview.utils.get_user_display_parameters import (
     get_user_display_parameters)
+from PlanReview.utils.beam_complexity import (
+    build_complexity_table, write_complexity_table, complexity_tolerances)
 from PlanReview.utils.perform_automated_checks import perform_automated_checks
@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+
+# Columns of the complexity table
+COMPLEXITY_COLUMNS = ['LSV', 'AAV', 'MCS']
+
+
+def stack_beam_arrays(banks_list, weights_list, leaf_widths_list):
+    """
+    Stack the leaf arrays of many beams into padded batch arrays. Beams with fewer
+    leaves or control points are padded with nan leaf positions and widths and zero
+    weights, which the batch reductions ignore.
+
+    Args:
+        banks_list: [ndarray [leaf, bank, cp], ...]: leaf positions of each beam
+        weights_list: [ndarray [cp], ...]: segment relative weights of each beam
+        leaf_widths_list: [ndarray [leaf], ...]: leaf widths of each beam
+
+    Returns:
+        banks: ndarray [beam, leaf, bank, cp]
+        weights: ndarray [beam, cp]
+        leaf_widths: ndarray [beam, leaf]
+    """
+    n_beams = len(banks_list)
+    n_leaves = max(b.shape[0] for b in banks_list)
+    n_cp = max(b.shape[2] for b in banks_list)
+    banks = np.full((n_beams, n_leaves, 2, n_cp), np.nan)
+    weights = np.zeros((n_beams, n_cp))
+    leaf_widths = np.full((n_beams, n_leaves), np.nan)
+    for i, (b, w, lw) in enumerate(zip(banks_list, weights_list, leaf_widths_list)):
+        banks[i, :b.shape[0], :, :b.shape[2]] = b
+        weights[i, :len(w)] = w
+        leaf_widths[i, :len(lw)] = lw
+    return banks, weights, leaf_widths
+
+
+def _nan_divide(numerator, denominator):
+    # Division with nan (not inf) where the denominator is zero
+    numerator, denominator = np.broadcast_arrays(numerator, denominator)
+    quotient = np.full(numerator.shape, np.nan)
+    np.divide(numerator, denominator, out=quotient, where=denominator != 0)
+    return quotient
+
+
+def _nan_reduce(function, a, axis):
+    # nanmax/nanmin returning nan for all-nan slices without a RuntimeWarning
+    valid = np.any(~np.isnan(a), axis=axis)
+    fill = -np.inf if function is np.nanmax else np.inf
+    result = function(np.where(np.isnan(a), fill, a), axis=axis)
+    return np.where(valid, result, np.nan)
+
+
+def compute_complexity_batch(banks, weights, leaf_widths, min_gap_moving, vmat):
+    """
+    Compute the leaf sequence variability (LSV), aperture area variability (AAV) and
+    modulation complexity score (MCS) of a batch of beams. Closed leaf pairs (within
+    the minimum moving gap) and padding are carried as nan and dropped by the
+    reductions. For VMAT beams each quantity is averaged over adjacent control points
+    and weighted by the leading control point, the last control point carrying no MU.
+
+    Args:
+        banks: ndarray [beam, leaf, bank, cp]: leaf positions
+        weights: ndarray [beam, cp]: segment relative weights
+        leaf_widths: ndarray [beam, leaf] or [leaf]: leaf widths
+        min_gap_moving: float or ndarray [beam]: minimum moving leaf gap
+        vmat: bool or ndarray [beam]: True for arc beams
+
+    Returns:
+        dict: {'LSV': ndarray [beam], 'AAV': ndarray [beam], 'MCS': ndarray [beam]}
+    """
+    banks = np.array(banks, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    n_beams = banks.shape[0]
+    leaf_widths = np.broadcast_to(np.asarray(leaf_widths, dtype=float),
+                                  (n_beams, banks.shape[1]))
+    min_gap_moving = np.broadcast_to(np.asarray(min_gap_moving, dtype=float), (n_beams,))
+    vmat = np.broadcast_to(np.asarray(vmat, dtype=bool), (n_beams,))
+    #
+    # Drop the closed leaf pairs on both banks
+    threshold = 1e-6
+    closed = np.abs(banks[:, :, 0, :] - banks[:, :, 1, :]) < \
+        (1 + threshold) * min_gap_moving[:, None, None]
+    banks[np.repeat(closed[:, :, None, :], 2, axis=2)] = np.nan
+    valid = ~np.isnan(banks)
+    #
+    # Jm Number of active (non-zero) leaves in each bank in each control point, less the
+    # n+1 leaf without a neighbour
+    jm = np.count_nonzero(valid & (banks != 0), axis=1) - 1.
+    # Max position [beam, bank, cp]
+    pos_max = _nan_reduce(np.nanmax, banks, axis=1) - _nan_reduce(np.nanmin, banks, axis=1)
+    # Handle amax = amin over the whole beam (rectangles)
+    bank_positions = np.moveaxis(banks, 2, 1).reshape(n_beams, 2, -1)
+    bank_max = _nan_reduce(np.nanmax, bank_positions, axis=2)
+    bank_min = _nan_reduce(np.nanmin, bank_positions, axis=2)
+    rectangle = bank_max == bank_min
+    pos_max = np.where(rectangle[:, :, None], bank_max[:, :, None], pos_max)
+    pos_max = np.abs(pos_max)
+    #
+    # Difference in leaf positions of adjacent leaves on each bank
+    banks_diff = np.abs(banks[:, :-1, :, :] - banks[:, 1:, :, :])
+    lsv_sum = pos_max[:, None, :, :] - banks_diff
+    all_invalid = np.all(np.isnan(lsv_sum), axis=1)
+    lsv_sum = np.where(all_invalid, np.nan, np.nansum(lsv_sum, axis=1))
+    separated_lsv = _nan_divide(lsv_sum, jm * pos_max)
+    # Leaf sequence variability [beam, cp]
+    lsv = separated_lsv[:, 0, :] * separated_lsv[:, 1, :]
+    #
+    # AAV calculation
+    apertures = banks * leaf_widths[:, :, None, None]
+    mlc_diff = apertures[:, :, 1, :] - apertures[:, :, 0, :]
+    segment_aperture_area = np.where(np.all(np.isnan(mlc_diff), axis=1), np.nan,
+                                     np.nansum(mlc_diff, axis=1))
+    # CIAO
+    beam_ciao = _nan_reduce(np.nanmax, mlc_diff, axis=2)
+    aav = _nan_divide(segment_aperture_area, np.nansum(beam_ciao, axis=1)[:, None])
+    #
+    # VMAT beams average adjacent control points, the last carries no weight
+    vmat_lsv = (lsv[:, :-1] + lsv[:, 1:]) / 2.
+    vmat_aav = (aav[:, :-1] + aav[:, 1:]) / 2.
+    vmat_weights = weights[:, :-1]
+    result = {'LSV': np.empty(n_beams), 'AAV': np.empty(n_beams), 'MCS': np.empty(n_beams)}
+    if np.any(vmat):
+        result['LSV'][vmat] = np.nansum(vmat_lsv * vmat_weights, axis=1)[vmat]
+        result['AAV'][vmat] = np.nansum(vmat_aav * vmat_weights, axis=1)[vmat]
+        result['MCS'][vmat] = np.nansum(vmat_lsv * vmat_aav * vmat_weights, axis=1)[vmat]
+    if not np.all(vmat):
+        step = ~vmat
+        result['LSV'][step] = np.nansum(lsv * weights, axis=1)[step]
+        result['AAV'][step] = np.nansum(aav * weights, axis=1)[step]
+        result['MCS'][step] = np.nansum(lsv * aav * weights, axis=1)[step]
+    return result
+
+
+def build_complexity_table(banks_list, weights_list, leaf_widths_list, min_gap_moving, vmat,
+                           labels=None):
+    """
+    Score a cohort of beams in one batch and return a columnar table
+
+    Args:
+        banks_list: [ndarray [leaf, bank, cp], ...]: leaf positions of each beam
+        weights_list: [ndarray [cp], ...]: segment relative weights of each beam
+        leaf_widths_list: [ndarray [leaf], ...]: leaf widths of each beam
+        min_gap_moving: float or [float, ...]: minimum moving leaf gap of each beam
+        vmat: bool or [bool, ...]: True for arc beams
+        labels: dict of {column name: [value, ...]} identifying each beam, e.g.
+            {'PatientID': [...], 'BeamSet': [...], 'Beam': [...]}
+
+    Returns:
+        pd.DataFrame: one row per beam, the label columns followed by LSV, AAV and MCS
+    """
+    banks, weights, leaf_widths = stack_beam_arrays(banks_list, weights_list,
+                                                    leaf_widths_list)
+    scores = compute_complexity_batch(banks, weights, leaf_widths, min_gap_moving, vmat)
+    table = pd.DataFrame(labels if labels else {})
+    table['VMAT'] = np.broadcast_to(np.asarray(vmat, dtype=bool), (len(banks_list),))
+    for c in COMPLEXITY_COLUMNS:
+        table[c] = scores[c]
+    return table
+
+
+def write_complexity_table(table, file_name):
+    """
+    Write a complexity table as comma separated columns, appending to an existing file
+
+    Args:
+        table: pd.DataFrame: from build_complexity_table
+        file_name: str: path of the output file
+    """
+    header = True
+    try:
+        with open(file_name, 'r'):
+            header = False
+    except FileNotFoundError:
+        pass
+    table.to_csv(file_name, mode='a', header=header, index=False)
+
+
+def complexity_tolerances(table, vmat=None):
+    """
+    Rebuild the mean and standard deviation of each complexity metric from a table, in
+    the form of review_definitions.MCS_TOLERANCES
+
+    Args:
+        table: pd.DataFrame: with LSV, AAV and MCS columns (and VMAT if vmat is given)
+        vmat: bool or None: restrict to arc (True) or static (False) beams
+
+    Returns:
+        dict: {'MCS': {'MEAN': float, 'SIGMA': float}, 'LSV': {...}, 'AAV': {...}}
+    """
+    if vmat is not None:
+        table = table[table['VMAT'] == vmat]
+    return {c: {'MEAN': float(np.nanmean(table[c])),
+                'SIGMA': float(np.nanstd(table[c]))}
+            for c in COMPLEXITY_COLUMNS}
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from BeamOperations import get_beam_segment_data
+from PlanReview import review_definitions
+
+# Results are kept in memory and in this file, so a review run again in a new
+# script reuses them. None keeps them in memory only.
+check_cache_file = os.path.join(tempfile.gettempdir(), 'PlanReviewCheckCache.json')
+# Cached results older than this are dropped when the cache file is written
+CHECK_CACHE_DAYS = 7
+
+# {key: [pass_result, message, time stored]}
+_results = None
+# {module name: hash of the module source and review_definitions}
+_code_versions = {}
+
+
+def fingerprint(inputs):
+    """
+    Declares the inputs a check reads, so its result is reused while they are
+    unchanged. Checks without a fingerprint always run.
+
+    Args:
+        inputs: A function called as inputs(rso, **kwargs) with the arguments of
+        the check. It returns a value whose repr changes whenever the result of
+        the check could change, or None if the result should not be reused.
+
+    Returns:
+        A decorator tagging the check.
+    """
+    def tag(check):
+        check.fingerprint = inputs
+        return check
+    return tag
+
+
+def roi_geometry_state(roi_geometry):
+    """
+    Describes an roi geometry well enough to notice when it is edited.
+
+    Args:
+        roi_geometry: case.PatientModel.StructureSets[exam].RoiGeometries[roi]
+
+    Returns:
+        (roi name, has contours, bounding box, volume)
+    """
+    if not roi_geometry.HasContours():
+        return roi_geometry.OfRoi.Name, False, None, None
+    bb = roi_geometry.GetBoundingBox()
+    bounds = tuple((p['x'], p['y'], p['z']) for p in bb)
+    return roi_geometry.OfRoi.Name, True, bounds, roi_geometry.GetRoiVolume()
+
+
+def image_stack_state(exam):
+    """
+    Describes the image grid of an exam.
+
+    Args:
+        exam: RS exam object
+
+    Returns:
+        (exam name, corner, pixel size, slice positions)
+    """
+    stack = exam.Series[0].ImageStack
+    corner = stack.Corner
+    pixel_size = stack.PixelSize
+    return (exam.Name, (corner.x, corner.y, corner.z), (pixel_size.x, pixel_size.y),
+            tuple(stack.SlicePositions))
+
+
+def structure_set_state(rso, **kwargs):
+    """
+    Fingerprint of checks reading the image grid and the contoured rois of
+    the current exam.
+
+    Args:
+        rso: NamedTuple of ScriptObjects in Raystation [case,exam,plan,beamset,db]
+
+    Returns:
+        (image stack state, [roi geometry state of each contoured roi])
+    """
+    roi_geometries = rso.case.PatientModel.StructureSets[rso.exam.Name].RoiGeometries
+    return (image_stack_state(rso.exam),
+            tuple(roi_geometry_state(rg) for rg in roi_geometries if rg.HasContours()))
+
+
+def dose_grid_state(beamset):
+    """
+    Describes the dose grid of a beamset.
+
+    Args:
+        beamset: RS beamset object
+
+    Returns:
+        (corner, voxel size, number of voxels), or None without a dose grid
+    """
+    try:
+        idg = beamset.FractionDose.InDoseGrid
+    except AttributeError:
+        return None
+    return tuple((v.x, v.y, v.z) for v in [idg.Corner, idg.VoxelSize, idg.NrVoxels])
+
+
+def segment_hash(beam):
+    """
+    Hashes the leaf positions, weights, jaw positions and gantry angles of the
+    segments of a beam. They are read through get_beam_segment_data, so inside
+    a review the checks reuse the arrays instead of reading them again.
+
+    Args:
+        beam: RS beam object
+
+    Returns:
+        The hex digest, or None if the beam has no segments
+    """
+    segment_data = get_beam_segment_data(beam)
+    if segment_data is None:
+        return None
+    digest = hashlib.sha1()
+    for a in [segment_data.banks, segment_data.weights, segment_data.jaw_positions,
+              segment_data.delta_gantry_angles]:
+        digest.update(np.ascontiguousarray(a).tobytes())
+    return digest.hexdigest()
+
+
+def beamset_state(rso, **kwargs):
+    """
+    Fingerprint of checks reading the beams of the current beamset: its last
+    modification, and the name, MU and segment hash of each beam, so unsaved
+    segment edits are noticed too.
+
+    Args:
+        rso: NamedTuple of ScriptObjects in Raystation [case,exam,plan,beamset,db]
+
+    Returns:
+        (label, modification time, [(beam name, MU, segment hash)]), or None if
+        the beamset has no modification time to compare against
+    """
+    beamset = rso.beamset
+    modification = beamset.ModificationInfo
+    if modification is None:
+        return None
+    return (beamset.DicomPlanLabel, str(modification.ModificationTime),
+            tuple((b.Name, b.BeamMU, segment_hash(b)) for b in beamset.Beams))
+
+
+def _load():
+    global _results
+    if _results is not None:
+        return _results
+    _results = {}
+    if check_cache_file and os.path.isfile(check_cache_file):
+        try:
+            with open(check_cache_file, 'r') as infile:
+                _results = json.load(infile)
+        except (OSError, ValueError) as e:
+            logging.debug(f'Ignoring unreadable check cache {check_cache_file}: {e}')
+    return _results
+
+
+def code_version(check):
+    """
+    Hashes the source of the module of a check and of review_definitions, so a
+    result is not reused once the check or its tolerances are edited.
+
+    Args:
+        check: The check function.
+
+    Returns:
+        The hex digest, or None if a source file cannot be read
+    """
+    module_name = check.__module__
+    if module_name not in _code_versions:
+        digest = hashlib.sha1()
+        try:
+            for module in [sys.modules[module_name], review_definitions]:
+                with open(module.__file__, 'rb') as infile:
+                    digest.update(infile.read())
+            _code_versions[module_name] = digest.hexdigest()
+        except (KeyError, AttributeError, TypeError, OSError) as e:
+            logging.debug(f'No code version for {module_name}: {e}')
+            _code_versions[module_name] = None
+    return _code_versions[module_name]
+
+
+def cache_key(check, rso, kwargs):
+    """
+    Returns the key of the cached result of a check for its current inputs
+    and code, or None if the check has no fingerprint or either cannot be read.
+    """
+    inputs = getattr(check, 'fingerprint', None)
+    version = code_version(check) if inputs is not None else None
+    if version is None:
+        return None
+    try:
+        state = inputs(rso, **kwargs)
+    except Exception as e:
+        logging.debug(f'No fingerprint for {check.__name__}: {e}')
+        return None
+    if state is None:
+        return None
+    digest = hashlib.sha1(
+        repr((version, rso.patient.PatientID, state, sorted(kwargs.items()))).encode('utf-8'))
+    return f'{check.__module__}.{check.__qualname__}:{digest.hexdigest()}'
+
+
+def get_cached_result(key):
+    """
+    Returns the cached (pass_result, message) for a cache key, or None.
+    """
+    if key is None:
+        return None
+    entry = _load().get(key)
+    if entry is None:
+        return None
+    return entry[0], entry[1]
+
+
+def store_result(key, result):
+    """
+    Caches the (pass_result, message) of a check under its cache key. Only
+    text results are cached, so they can be written to check_cache_file.
+    """
+    if key is None or not all(v is None or isinstance(v, str) for v in result):
+        return
+    _load()[key] = [result[0], result[1], time.time()]
+
+
+def write_cache():
+    """
+    Writes the cached results to check_cache_file, dropping stale ones.
+    """
+    results = _load()
+    oldest = time.time() - CHECK_CACHE_DAYS * 86400
+    for key in [k for k, v in results.items() if v[2] < oldest]:
+        del results[key]
+    if not check_cache_file:
+        return
+    partial_file = check_cache_file + '.part'
+    try:
+        with open(partial_file, 'w') as outfile:
+            json.dump(results, outfile)
+        os.replace(partial_file, check_cache_file)
+    except (OSError, TypeError) as e:
+        logging.debug(f'Unable to write check cache {check_cache_file}: {e}')
+
+
+def clear_cache():
+    """
+    Forgets all cached results, in memory and on disk.
+    """
+    global _results
+    _results = {}
+    if check_cache_file and os.path.isfile(check_cache_file):
+        os.remove(check_cache_file)
@@ -0,0 +1,196 @@
+import numbers
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+
+import numpy as np
+
+# Count the RayStation API calls made by each check. The rso objects the checks
+# receive are then wrapped in counting proxies (see ApiCallCounter).
+COUNT_API_CALLS = True
+# Record the peak python memory of each check. tracemalloc follows the whole
+# process, so while this is on every check runs on its own (see run_checks).
+TRACE_CHECK_MEMORY = False
+
+# Values returned by RayStation that are not wrapped in the counting proxy
+_PLAIN_TYPES = (str, bytes, numbers.Number, type(None), list, tuple, dict, set,
+                np.ndarray, np.generic)
+# The API calls of the check running on each thread
+_thread_calls = threading.local()
+
+
+class CheckProfile(namedtuple('CheckProfile', ['wall_time', 'api_calls', 'peak_memory'])):
+    """
+    The cost of running one check: wall_time in seconds, api_calls through the
+    rso objects (None when not counted) and peak_memory in MB of python
+    allocations (None when not traced).
+    """
+
+    def __str__(self):
+        summary = [f'{self.wall_time:.2f} s']
+        if self.api_calls is not None:
+            summary.append(f'{self.api_calls} API calls')
+        if self.peak_memory is not None:
+            summary.append(f'{self.peak_memory:.1f} MB peak')
+        return ', '.join(summary)
+
+
+class ApiCallCounter:
+    """
+    Hands out counting proxies of RayStation objects for one run of checks.
+    Each attribute read or write, item access, length, membership test, call
+    and iterated item through a proxy crosses into RayStation and counts as one
+    call of the check running on the calling thread.
+
+    An object keeps a single proxy for the whole run, so identity comparisons
+    between objects RayStation returned still work across checks.
+    """
+
+    def __init__(self):
+        # {id(object): (object, proxy)}. The object is kept to pin its id.
+        self._proxies = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, obj):
+        """
+        Returns the counting proxy of a RayStation object, or the value itself
+        when it is a plain python value.
+        """
+        if isinstance(obj, (_PLAIN_TYPES, _CountingProxy, type)):
+            return obj
+        with self._lock:
+            entry = self._proxies.get(id(obj))
+            if entry is None:
+                entry = (obj, _CountingProxy(obj, self))
+                self._proxies[id(obj)] = entry
+        return entry[1]
+
+    def wrap_rso(self, rso):
+        """
+        Returns a copy of the rso NamedTuple with each RayStation object wrapped.
+        Anything else is returned as is, and its calls are not counted.
+        """
+        if not hasattr(rso, '_replace'):
+            return rso
+        return rso._replace(**{f: self.wrap(getattr(rso, f)) for f in rso._fields})
+
+
+def _unwrap(value):
+    """
+    Returns the RayStation object behind a proxy, also inside a list, tuple or
+    dict, so only real objects are passed to RayStation.
+    """
+    if isinstance(value, _CountingProxy):
+        return object.__getattribute__(value, '_obj')
+    if isinstance(value, (list, tuple)) and any(isinstance(v, _CountingProxy) for v in value):
+        return type(value)(_unwrap(v) for v in value)
+    if isinstance(value, dict) and any(isinstance(v, _CountingProxy) for v in value.values()):
+        return {k: _unwrap(v) for k, v in value.items()}
+    return value
+
+
+class _CountingProxy:
+    __slots__ = ('_obj', '_counter')
+
+    def __init__(self, obj, counter):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_counter', counter)
+
+    def _count(self):
+        _thread_calls.count = getattr(_thread_calls, 'count', 0) + 1
+        return object.__getattribute__(self, '_obj')
+
+    def _wrap(self, value):
+        return object.__getattribute__(self, '_counter').wrap(value)
+
+    def __getattr__(self, name):
+        return self._wrap(getattr(self._count(), name))
+
+    def __setattr__(self, name, value):
+        setattr(self._count(), name, _unwrap(value))
+
+    def __call__(self, *args, **kwargs):
+        return self._wrap(self._count()(*_unwrap(args), **_unwrap(kwargs)))
+
+    def __getitem__(self, key):
+        return self._wrap(self._count()[_unwrap(key)])
+
+    def __setitem__(self, key, value):
+        self._count()[_unwrap(key)] = _unwrap(value)
+
+    def __len__(self):
+        return len(self._count())
+
+    def __contains__(self, item):
+        return _unwrap(item) in self._count()
+
+    def __iter__(self):
+        for item in object.__getattribute__(self, '_obj'):
+            self._count()
+            yield self._wrap(item)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self._count(), dtype=dtype)
+
+    def __eq__(self, other):
+        return object.__getattribute__(self, '_obj') == _unwrap(other)
+
+    def __ne__(self, other):
+        return object.__getattribute__(self, '_obj') != _unwrap(other)
+
+    def __hash__(self):
+        return hash(object.__getattribute__(self, '_obj'))
+
+    def __bool__(self):
+        return bool(object.__getattribute__(self, '_obj'))
+
+    def __str__(self):
+        return str(object.__getattribute__(self, '_obj'))
+
+    def __repr__(self):
+        return repr(object.__getattribute__(self, '_obj'))
+
+    def __format__(self, format_spec):
+        return format(object.__getattribute__(self, '_obj'), format_spec)
+
+    def __float__(self):
+        return float(object.__getattribute__(self, '_obj'))
+
+    def __int__(self):
+        return int(object.__getattribute__(self, '_obj'))
+
+    def __index__(self):
+        return object.__getattribute__(self, '_obj').__index__()
+
+
+def profile_check(check, rso, kwargs, counter=None):
+    """
+    Runs a check, measuring its wall time, RayStation API calls and peak memory.
+
+    Args:
+        check: The check function.
+        rso: NamedTuple of ScriptObjects in Raystation [case,exam,plan,beamset,db]
+        kwargs: The keyword arguments of the check.
+        counter: The ApiCallCounter of the run, or None to not count API calls.
+
+    Returns:
+        (the result of the check, CheckProfile)
+    """
+    if counter is not None:
+        rso = counter.wrap_rso(rso)
+        _thread_calls.count = 0
+    trace_memory = TRACE_CHECK_MEMORY and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = check(rso=rso, **kwargs)
+    finally:
+        wall_time = time.perf_counter() - start
+        peak_memory = None
+        if trace_memory:
+            peak_memory = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+    api_calls = _thread_calls.count if counter is not None else None
+    return result, CheckProfile(wall_time, api_calls, peak_memory)
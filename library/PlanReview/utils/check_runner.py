@@ -0,0 +1,150 @@
+import concurrent.futures
+import logging
+from collections import namedtuple
+from BeamOperations import beam_segment_pass
+from PlanReview.utils import check_cache, check_profiler
+
+# Worker threads used for read-only checks. With 1 or fewer every check runs
+# in order on the calling thread.
+MAX_CHECK_WORKERS = 4
+
+
+def read_only(check):
+    """
+    Tags a check that only reads from RayStation, so it may run alongside
+    other read-only checks.
+
+    Args:
+        check: The check function.
+
+    Returns:
+        The same function, tagged.
+    """
+    check.read_only = True
+    return check
+
+
+def mutating(check):
+    """
+    Tags a check that changes the patient (e.g. creates and deletes ROIs),
+    so it runs on its own, in order, after the read-only checks.
+
+    Args:
+        check: The check function.
+
+    Returns:
+        The same function, tagged.
+    """
+    check.read_only = False
+    return check
+
+
+class CheckResult(namedtuple('CheckResult',
+                             ['pass_result', 'message', 'cached', 'profile'],
+                             defaults=[None])):
+    """
+    The outcome of a check. cached is True when the result was reused
+    because the inputs of the check are unchanged. profile is the
+    check_profiler.CheckProfile of the run, None for a cached result.
+    """
+
+    def tree_result(self):
+        """
+        The (pass_result, message) shown in the review tree, with reused
+        results marked as cached.
+        """
+        if not self.cached:
+            return self.pass_result, self.message
+        message = f'{self.message} (cached)' if self.message else '(cached)'
+        return self.pass_result, message
+
+
+def is_read_only(check):
+    """
+    Untagged checks are treated as mutating.
+    """
+    return getattr(check, 'read_only', False)
+
+
+@beam_segment_pass()
+def run_checks(checks, progress=None, max_workers=MAX_CHECK_WORKERS,
+               use_cache=True):
+    """
+    Runs a list of checks. Read-only checks run concurrently in a worker pool,
+    then the mutating checks run one at a time, in list order, on the
+    calling thread. The two lanes never overlap, so no read-only check sees the
+    temporary ROIs of a mutating one.
+
+    Checks tagged with a fingerprint (see check_cache.fingerprint) whose
+    inputs are unchanged since an earlier run return that run's result instead.
+
+    The checks share one BeamOperations.beam_segment_pass, so the segments
+    of a beam are read once per run and released when it ends.
+
+    Every check that runs is profiled (see check_profiler.profile_check). While
+    check_profiler.TRACE_CHECK_MEMORY is on, all checks run on the calling
+    thread, so each memory peak belongs to one check.
+
+    Args:
+        checks: A list of (check function, rso, kwargs).
+        progress: Called with no arguments on the calling thread each time a
+        check finishes, e.g. to advance a progress bar.
+        max_workers: The number of worker threads for the read-only checks.
+        use_cache: Whether to reuse and store fingerprinted results.
+
+    Returns:
+        A list of CheckResult, in the order of checks. An exception
+        raised by a check is raised here, after the read-only lane finishes.
+    """
+    results = [None] * len(checks)
+    counter = check_profiler.ApiCallCounter() if check_profiler.COUNT_API_CALLS else None
+    # Fingerprints are read on the calling thread, before any check runs, through
+    # the same proxies as the checks so both share the cached beam segments
+    keys = [check_cache.cache_key(check, counter.wrap_rso(rso) if counter else rso, kwargs)
+            if use_cache else None for check, rso, kwargs in checks]
+    to_run = []
+    for i, key in enumerate(keys):
+        cached = check_cache.get_cached_result(key)
+        if cached is None:
+            to_run.append(i)
+        else:
+            results[i] = CheckResult(*cached, cached=True)
+            if progress is not None:
+                progress()
+    if max_workers > 1 and not check_profiler.TRACE_CHECK_MEMORY:
+        parallel = [i for i in to_run if is_read_only(checks[i][0])]
+    else:
+        parallel = []
+    if parallel:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(max_workers, len(parallel))) as executor:
+            futures = {executor.submit(check_profiler.profile_check, *checks[i], counter): i
+                       for i in parallel}
+            pending = set(futures)
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for _ in done:
+                    if progress is not None:
+                        progress()
+        for f, i in futures.items():
+            result, profile = f.result()
+            results[i] = CheckResult(*result, cached=False, profile=profile)
+        logging.debug(f'Ran {len(parallel)} read-only checks on '
+                      f'{min(max_workers, len(parallel))} workers')
+
+    parallel = set(parallel)
+    serial = [i for i in to_run if i not in parallel]
+    for i in serial:
+        result, profile = check_profiler.profile_check(*checks[i], counter)
+        results[i] = CheckResult(*result, cached=False, profile=profile)
+        if progress is not None:
+            progress()
+
+    for i in to_run:
+        logging.debug(f'{checks[i][0].__name__}: {results[i].profile}')
+    if use_cache:
+        for i in to_run:
+            check_cache.store_result(keys[i], results[i][:2])
+        check_cache.write_cache()
+    return results
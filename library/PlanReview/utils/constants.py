@@ -51,3 +51,4 @@ SOURCE_USER = 'Human Test'
 SOURCE_AUTO = 'Automated Test'
 KEY_OUT_DOMAIN_TYPE = '-DOMAIN_TYPE-'
 KEY_OUT_DOMAIN_NAME = '-DOMAIN_NAME-'
+KEY_OUT_PROFILE = '-PROFILE-'
@@ -1,4 +1,4 @@
-import connect
+import GeneralOperations
 
 
 def get_machine(machine_name):
@@ -6,6 +6,4 @@ def get_machine(machine_name):
     :param: machine_name (name of the machine in raystation,
     usually this is machine_name = beamset.MachineReference.MachineName
     return: machine (RS object)"""
-    machine_db = connect.get_current("MachineDB")
-    machine = machine_db.GetTreatmentMachine(machineName=machine_name, lockMode=None)
-    return machine
+    return GeneralOperations.get_machine(machine_name)
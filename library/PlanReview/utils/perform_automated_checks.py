@@ -6,6 +6,7 @@ from PlanReview.qa_tests.test_sandbox import get_sandbox_level_tests
 from PlanReview.qa_tests.test_beamset import parse_beamset_selection
 from PlanReview.qa_tests.test_plan import parse_order_selection
 from PlanReview.qa_tests.analyze_logs import retrieve_logs
+from PlanReview.utils.check_runner import run_checks
 from PlanReview.guis import build_tree_element, build_review_tree, \
     display_progress_bar, load_rsos
 
@@ -69,32 +70,49 @@ def perform_automated_checks(rso, do_physics_review,
 
     progress_total = len(patient_checks_dict.keys()) \
                      + len(plan_checks_dict.keys()) \
-                     + sum([len(v) for v in beamset_checks.values()]) + 1
+                     + sum([len(v) for v in beamset_checks.values()]) \
+                     + len(sandbox_checks_dict.keys()) + 1
     """
     Parse logs
     """
     message_logs = retrieve_logs(rso, log_key)
     tests_performed = 1
+
+    def advance_progress():
+        nonlocal tests_performed
+        tests_performed += 1
+        if progress_bar is not None:
+            progress_bar.update(
+                current_count=int(100 * tests_performed / progress_total))
+
     if progress_bar is not None:
         progress_bar.update(
             current_count=int(100 * tests_performed / progress_total))
 
-    # Execute qa_tests
+    # Execute qa_tests: read-only checks run concurrently, the checks that
+    # create and delete ROIs run afterwards, one at a time. Results come back
+    # in the order below, which is the order they are placed in the tree.
+    checks = [(f[0], rso, f[1]) for f in patient_checks_dict.values()]
+    checks += [(f[0], rso, f[1]) for f in plan_checks_dict.values()]
+    for r in rsos:
+        checks += [(f[0], r, f[1])
+                   for f in beamset_checks[r.beamset.DicomPlanLabel].values()]
+    checks += [(f[0], rso, f[1]) for f in sandbox_checks_dict.values()]
+    check_results = iter(run_checks(checks, progress=advance_progress))
+
     exam_level_tests = []
     for key, p_func in patient_checks_dict.items():
-        pass_result, message = p_func[0](rso=rso, **p_func[1])
+        check_result = next(check_results)
+        pass_result, message = check_result.tree_result()
         node, child = build_tree_element(parent_key=exam_key[0],
                                          child_key=key,
                                          pass_result=pass_result,
-                                         message_str=message)
+                                         message_str=message,
+                                         profile=check_result.profile)
         exam_level_tests.extend([node, child])
         exam_children = [DOMAIN_TYPE['EXAM_KEY'], rso.exam.Name]
         exam_children.extend(child)
         tree_children.append(exam_children)
-        tests_performed += 1
-        if progress_bar is not None:
-            progress_bar.update(
-                current_count=int(100 * tests_performed / progress_total))
 
     """
     Execute Plan Level Checks
@@ -124,18 +142,17 @@ def perform_automated_checks(rso, do_physics_review,
             tree_children.append(plan_children)
     # FINISH PLAN LEVEL CHECKS DEFINED IN plan_checks_dict
     for key, pl_func in plan_checks_dict.items():
-        pass_result, message = pl_func[0](rso=rso, **pl_func[1])
+        check_result = next(check_results)
+        pass_result, message = check_result.tree_result()
         node, child = build_tree_element(parent_key=plan_key[0],
                                          child_key=key,
                                          pass_result=pass_result,
-                                         message_str=message)
+                                         message_str=message,
+                                         profile=check_result.profile)
         plan_level_tests.extend([node, child])
         plan_children = [DOMAIN_TYPE['PLAN_KEY'], rso.plan.Name]
         plan_children.extend(child)
         tree_children.append(plan_children)
-        if progress_bar is not None:
-            progress_bar.update(
-                current_count=int(100 * tests_performed / progress_total))
 
     #
     # BEAMSET LEVEL CHECKS
@@ -167,28 +184,29 @@ def perform_automated_checks(rso, do_physics_review,
 
         # Run others
         for key, b_func in beamset_checks[bs_name].items():
-            pass_result, message = b_func[0](rso=r, **b_func[1])
+            check_result = next(check_results)
+            pass_result, message = check_result.tree_result()
             node, child = build_tree_element(
                 parent_key=DOMAIN_TYPE['BEAMSET_KEY'],
-                child_key=key, pass_result=pass_result, message_str=message)
+                child_key=key, pass_result=pass_result, message_str=message,
+                profile=check_result.profile)
             beamset_level_tests.extend([node, child])
             beamset_children = [DOMAIN_TYPE['BEAMSET_KEY'], bs_name]
             beamset_children.extend(child)
             tree_children.append(beamset_children)
-            if progress_bar is not None:
-                progress_bar.update(
-                    current_count=int(100 * tests_performed / progress_total))
         beamset_levels[bs_name] = beamset_level_tests
 
     #
     # SANDBOX LEVEL CHECKS
     sandbox_level_tests = []
     for key, s_func in sandbox_checks_dict.items():
-        pass_result, message = s_func[0](rso=rso, **s_func[1])
+        check_result = next(check_results)
+        pass_result, message = check_result.tree_result()
         node, child = build_tree_element(parent_key=sandbox_key[0],
                                          child_key=key,
                                          pass_result=pass_result,
-                                         message_str=message)
+                                         message_str=message,
+                                         profile=check_result.profile)
         sandbox_level_tests.extend([node, child])
         sandbox_children = [DOMAIN_TYPE['SANDBOX_KEY'], 'SANDBOX']
         sandbox_children.extend(child)
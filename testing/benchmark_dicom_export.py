@@ -0,0 +1,336 @@
+""" Benchmark DICOM Export
+
+    Time DicomExport.send() without a RayStation session. A stand-in case writes a
+    synthetic export (CT slices, structure set, RT plan and RT dose) from
+    ScriptableDicomExport(), which is sent to local pynetdicom storage SCPs and a
+    folder destination. The number of files and bytes delivered, files/s, MB/s,
+    peak memory and the time of each phase of send() are logged.
+
+    python benchmark_dicom_export.py --slices 200 --beams 2 --control-points 178
+
+    This program is free software: you can redistribute it and/or modify it under
+    the terms of the GNU General Public License as published by the Free Software
+    Foundation, either version 3 of the License, or (at your option) any later
+    version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+    FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program. If not, see <http://www.gnu.org/licenses/>.
+    """
+
+__author__ = 'Adam Bayliss'
+__contact__ = 'rabayliss@wisc.edu'
+__date__ = '2026-10-18'
+__version__ = '1.0.0'
+__status__ = 'Development'
+__deprecated__ = False
+__reviewer__ = ''
+__reviewed__ = ''
+__raystation__ = '12A'
+__maintainer__ = 'Adam Bayliss'
+__email__ = 'rabayliss@wisc.edu'
+__license__ = 'GPLv3'
+__copyright__ = 'Copyright (C) 2018, University of Wisconsin Board of Regents'
+__credits__ = []
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import types
+import xml.etree.ElementTree
+import numpy as np
+import pydicom
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ImplicitVRLittleEndian, generate_uid
+from pynetdicom import AE, evt, AllStoragePresentationContexts
+from pynetdicom.sop_class import Verification
+
+CT_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+RTSTRUCT_STORAGE = '1.2.840.10008.5.1.4.1.1.481.3'
+RTPLAN_STORAGE = '1.2.840.10008.5.1.4.1.1.481.5'
+RTDOSE_STORAGE = '1.2.840.10008.5.1.4.1.1.481.2'
+PHASES = ['connect', 'export', 'filter', 'send', 'total']
+
+
+class StandInUserInterface(types.ModuleType):
+    """ A UserInterface module without dialogs, DicomExport only needs these names """
+
+    class ProgressBar:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def update(self, text=''):
+            pass
+
+        def close(self):
+            pass
+
+    def __init__(self):
+        super().__init__('UserInterface')
+        self.MessageBox = self.WarningBox = lambda *args, **kwargs: None
+        self.ButtonList = None
+
+
+def _write(file_name, ds):
+    try:
+        pydicom.dcmwrite(file_name, ds, enforce_file_format=True)
+    except TypeError:
+        # pydicom before 3.0
+        pydicom.dcmwrite(file_name, ds, write_like_original=False)
+
+
+def _uid(seed, *names):
+    # UIDs are repeated between exports with the same seed, as they are for the same patient data
+    return generate_uid(entropy_srcs=[str(seed)] + [str(n) for n in names])
+
+
+def _dataset(sop_class, study_uid, series_uid, modality, sop_instance_uid):
+    ds = Dataset()
+    ds.file_meta = FileMetaDataset()
+    ds.file_meta.MediaStorageSOPClassUID = sop_class
+    ds.file_meta.MediaStorageSOPInstanceUID = sop_instance_uid
+    ds.file_meta.TransferSyntaxUID = ImplicitVRLittleEndian
+    ds.SOPClassUID = sop_class
+    ds.SOPInstanceUID = ds.file_meta.MediaStorageSOPInstanceUID
+    ds.PatientName = 'Benchmark^Patient'
+    ds.PatientID = '00000000'
+    ds.PatientBirthDate = '19700101'
+    ds.StudyInstanceUID = study_uid
+    ds.SeriesInstanceUID = series_uid
+    ds.Modality = modality
+    return ds
+
+
+def write_synthetic_export(folder, slices=100, rows=512, beams=2, control_points=178, leaf_pairs=60,
+                           seed=0):
+    """
+    Write a CT series, structure set, RT plan and RT dose, as ScriptableDicomExport would
+
+    Returns:
+        (int, int): number of files and bytes written
+    """
+    rng = np.random.default_rng(seed)
+    study_uid = _uid(seed, 'study')
+    series_uid = _uid(seed, 'CT')
+    for i in range(slices):
+        ds = _dataset(CT_STORAGE, study_uid, series_uid, 'CT', _uid(seed, 'CT', i))
+        ds.Rows = ds.Columns = rows
+        ds.BitsAllocated = ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.ImagePositionPatient = [0., 0., 2. * i]
+        ds.PixelData = rng.integers(-1000, 1000, size=(rows, rows), dtype=np.int16).tobytes()
+        _write(os.path.join(folder, 'CT{:04d}.dcm'.format(i)), ds)
+
+    ds = _dataset(RTSTRUCT_STORAGE, study_uid, _uid(seed, 'RTSTRUCT'), 'RTSTRUCT',
+                  _uid(seed, 'RTSTRUCT', 0))
+    roi = Dataset()
+    roi.ROINumber = 1
+    roi.ROIName = 'PTV'
+    ds.StructureSetROISequence = Sequence([roi])
+    _write(os.path.join(folder, 'RS.dcm'), ds)
+
+    ds = _dataset(RTPLAN_STORAGE, study_uid, _uid(seed, 'RTPLAN'), 'RTPLAN', _uid(seed, 'RTPLAN', 0))
+    beam_sequence = []
+    for b in range(beams):
+        beam = Dataset()
+        beam.BeamNumber = b + 1
+        beam.BeamName = 'A{}'.format(b + 1)
+        beam.TreatmentMachineName = 'TrueBeam'
+        beam.RadiationType = 'PHOTON'
+        beam.TreatmentDeliveryType = 'TREATMENT'
+        cp_sequence = []
+        for c in range(control_points):
+            cp = Dataset()
+            cp.ControlPointIndex = c
+            cp.GantryAngle = (181. + 356. * c / max(control_points - 1, 1)) % 360.
+            if c == 0:
+                cp.NominalBeamEnergy = 6
+                cp.DoseRateSet = 600
+                cp.GantryRotationDirection = 'CW'
+                cp.TableTopLateralPosition = 0
+                cp.TableTopLongitudinalPosition = 0
+                cp.TableTopVerticalPosition = 0
+            devices = []
+            for name, n in [('ASYMX', 2), ('ASYMY', 2), ('MLCX', 2 * leaf_pairs)]:
+                device = Dataset()
+                device.RTBeamLimitingDeviceType = name
+                device.LeafJawPositions = [round(float(v), 3) for v in np.sort(rng.normal(0., 30., n))]
+                devices.append(device)
+            cp.BeamLimitingDevicePositionSequence = Sequence(devices)
+            cp_sequence.append(cp)
+        beam.ControlPointSequence = Sequence(cp_sequence)
+        beam_sequence.append(beam)
+    ds.BeamSequence = Sequence(beam_sequence)
+    fraction_group = Dataset()
+    fraction_group.NumberOfFractionsPlanned = 10
+    fraction_group.ReferencedBeamSequence = Sequence([Dataset() for _ in beam_sequence])
+    for i, referenced_beam in enumerate(fraction_group.ReferencedBeamSequence):
+        referenced_beam.ReferencedBeamNumber = i + 1
+        referenced_beam.BeamDose = 1.
+    ds.FractionGroupSequence = Sequence([fraction_group])
+    _write(os.path.join(folder, 'RP.dcm'), ds)
+
+    ds = _dataset(RTDOSE_STORAGE, study_uid, _uid(seed, 'RTDOSE'), 'RTDOSE', _uid(seed, 'RTDOSE', 0))
+    ds.Rows = ds.Columns = 128
+    ds.NumberOfFrames = slices
+    ds.BitsAllocated = ds.BitsStored = 32
+    ds.HighBit = 31
+    ds.PixelRepresentation = 0
+    ds.SamplesPerPixel = 1
+    ds.PhotometricInterpretation = 'MONOCHROME2'
+    ds.PixelData = rng.integers(0, 1000, size=(slices, 128, 128), dtype=np.uint32).tobytes()
+    _write(os.path.join(folder, 'RD.dcm'), ds)
+
+    files = os.listdir(folder)
+    return len(files), sum(os.path.getsize(os.path.join(folder, f)) for f in files)
+
+
+class StandInCase:
+    """ A case whose ScriptableDicomExport() writes a synthetic export """
+
+    def __init__(self, **sizes):
+        self.sizes = sizes
+        self.files = 0
+        self.bytes = 0
+
+    def ScriptableDicomExport(self, **args):
+        self.files, self.bytes = write_synthetic_export(args['ExportFolderPath'], **self.sizes)
+
+
+class StandInBeamSet:
+    DicomPlanLabel = 'Benchmark'
+
+    def BeamSetIdentifier(self):
+        return 'Benchmark:1'
+
+
+class StandInExamination:
+    Name = 'CT 1'
+
+
+def start_storage_scp(port, received, delay=0.):
+    """ Start a storage SCP on localhost, appending the size of each dataset received """
+
+    def handle_store(event):
+        if delay:
+            time.sleep(delay)
+        received.append(len(event.request.DataSet.getvalue()))
+        return 0x0000
+
+    ae = AE(ae_title='BENCHMARK_SCP')
+    ae.supported_contexts = AllStoragePresentationContexts
+    ae.add_supported_context(Verification)
+    return ae.start_server(('127.0.0.1', port), block=False, evt_handlers=[(evt.EVT_C_STORE, handle_store)])
+
+
+def destinations_xml(ports, folder):
+    """ A DicomDestinations.xml tree with one SCP per port and a folder destination """
+    root = xml.etree.ElementTree.Element('destinations')
+    entries = [('scp', {'name': 'SCP{}'.format(i + 1), 'host': '127.0.0.1', 'aet': 'BENCHMARK_SCP',
+                        'port': p}) for i, p in enumerate(ports)]
+    entries.append(('folder', {'name': 'Folder', 'path': folder}))
+    for destination_type, fields in entries:
+        destination = xml.etree.ElementTree.SubElement(root, 'destination', type=destination_type)
+        for k, v in fields.items():
+            e = xml.etree.ElementTree.SubElement(destination, k, type='int' if isinstance(v, int) else 'text')
+            e.text = str(v)
+    return xml.etree.ElementTree.ElementTree(root)
+
+
+def peak_rss_mb():
+    """ Peak resident memory of this process in MB, or None where it cannot be read """
+    try:
+        import resource
+        # Reported in kB on Linux and bytes on macOS
+        scale = 1. if sys.platform == 'darwin' else 1024.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    except ImportError:
+        try:
+            import psutil
+            info = psutil.Process().memory_info()
+            return getattr(info, 'peak_wset', info.rss) / 1e6
+        except ImportError:
+            return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DicomExport.send() with synthetic data')
+    parser.add_argument('--slices', type=int, default=100)
+    parser.add_argument('--rows', type=int, default=512)
+    parser.add_argument('--beams', type=int, default=2)
+    parser.add_argument('--control-points', type=int, default=178)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--ports', type=int, nargs='*', default=[11112, 11113])
+    parser.add_argument('--scp-delay', type=float, default=0., help='seconds each SCP waits per C-STORE')
+    parser.add_argument('--ledger', action='store_true', help='skip files already stored on repeats')
+    args = parser.parse_args()
+
+    sys.modules['UserInterface'] = StandInUserInterface()
+    import DicomExport
+    logging.disable(logging.WARNING)
+
+    received = {p: [] for p in args.ports}
+    servers = [start_storage_scp(p, received[p], args.scp_delay) for p in args.ports]
+    folder = tempfile.mkdtemp()
+    DicomExport.dest_xml = destinations_xml(args.ports, folder)
+    ledger = tempfile.mkdtemp()
+    DicomExport.ledger_file = os.path.join(ledger, 'ledger.sqlite') if args.ledger else None
+    destination = ['SCP{}'.format(i + 1) for i in range(len(args.ports))] + ['Folder']
+    case = StandInCase(slices=args.slices, rows=args.rows, beams=args.beams,
+                       control_points=args.control_points)
+
+    results = []
+    try:
+        for _ in range(args.repeats):
+            for r in received.values():
+                del r[:]
+            timings = {}
+            status = DicomExport.send(case=case,
+                                      destination=destination,
+                                      exam=StandInExamination(),
+                                      beamset=StandInBeamSet(),
+                                      machine='TrueBeam2',
+                                      table=[0., 0., 0.],
+                                      round_jaws=True,
+                                      bar=False,
+                                      timings=timings)
+            stored = sum(len(r) for r in received.values())
+            stored_bytes = sum(sum(r) for r in received.values())
+            results.append((status, stored, stored_bytes, timings))
+    finally:
+        DicomExport.release_associations()
+        for s in servers:
+            s.shutdown()
+        shutil.rmtree(folder, ignore_errors=True)
+        shutil.rmtree(ledger, ignore_errors=True)
+        logging.disable(logging.NOTSET)
+
+    rss = peak_rss_mb()
+    print('Export of {} files ({:.1f} MB) to {} SCPs and a folder, {} beams x {} control points'
+          .format(case.files, case.bytes / 1e6, len(args.ports), args.beams, args.control_points))
+    for i, (status, stored, stored_bytes, timings) in enumerate(results, start=1):
+        delivered = stored + case.files
+        message = ('Run {}: status {}, {} C-STOREs, {:.0f} files/s, {:.1f} MB/s. '
+                   .format(i, status, stored, delivered / timings['total'],
+                           (stored_bytes + case.bytes) / 1e6 / timings['total'])
+                   + ', '.join('{} {:.3f} s'.format(p, timings[p]) for p in PHASES if p in timings))
+        logging.info(message)
+        print(message)
+    message = 'Peak RSS {}'.format('{:.0f} MB'.format(rss) if rss is not None else 'not available')
+    logging.info(message)
+    print(message)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+""" Benchmark Leaf Filtering
+
+    Compare the original per-leaf, per-control point loops of
+    mlc_properties.stationary_leaf_gaps and filter_leaves with the whole-array
+    versions in BeamOperations on synthetic bank arrays. The closed-gap masks and
+    the filtered leaf positions are checked for equality and the timing of each
+    is logged. No patient needs to be open.
+
+    This program is free software: you can redistribute it and/or modify it under
+    the terms of the GNU General Public License as published by the Free Software
+    Foundation, either version 3 of the License, or (at your option) any later
+    version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+    FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program. If not, see <http://www.gnu.org/licenses/>.
+    """
+
+__author__ = 'Adam Bayliss'
+__contact__ = 'rabayliss@wisc.edu'
+__date__ = '2026-10-18'
+__version__ = '1.0.0'
+__status__ = 'Development'
+__deprecated__ = False
+__reviewer__ = ''
+__reviewed__ = ''
+__raystation__ = '12A'
+__maintainer__ = 'Adam Bayliss'
+__email__ = 'rabayliss@wisc.edu'
+__license__ = 'GPLv3'
+__copyright__ = 'Copyright (C) 2018, University of Wisconsin Board of Regents'
+__credits__ = []
+
+import logging
+import timeit
+import numpy as np
+import BeamOperations
+
+# Synthetic arc: 60 leaf pairs, 178 control points
+NUMBER_LEAVES = 60
+NUMBER_CONTROL_POINTS = 178
+MIN_GAP_MOVING = 0.05
+LEAF_JAW_OVERLAP = 0.0
+REPEATS = 5
+
+
+def synthetic_banks(n_leaves=NUMBER_LEAVES, n_cp=NUMBER_CONTROL_POINTS,
+                    min_gap=MIN_GAP_MOVING, seed=0):
+    """
+    Build a [leaf, bank, cp] array with a mix of open, parked (0, 0), closed-moving and
+    closed-stationary leaf pairs
+    """
+    rng = np.random.default_rng(seed)
+    centre = np.cumsum(rng.normal(0., 0.2, size=(n_leaves, n_cp)), axis=1)
+    width = np.abs(rng.normal(2., 1., size=(n_leaves, n_cp)))
+    # Close about a third of the pairs to the minimum gap
+    closed = rng.random(size=(n_leaves, n_cp)) < 0.3
+    width[closed] = min_gap
+    # Hold some of the closed pairs stationary over runs of control points
+    hold = rng.random(size=(n_leaves, n_cp)) < 0.5
+    for cp in range(1, n_cp):
+        keep = closed[:, cp] & closed[:, cp - 1] & hold[:, cp]
+        centre[keep, cp] = centre[keep, cp - 1]
+    banks = np.empty((n_leaves, 2, n_cp))
+    banks[:, 0, :] = centre - width / 2.
+    banks[:, 1, :] = centre + width / 2.
+    # Park some pairs at the origin
+    parked = rng.random(size=n_leaves) < 0.1
+    banks[parked, :, :] = 0.
+    return banks
+
+
+def legacy_stationary_leaf_gaps(banks, min_gap_moving):
+    """ The per-leaf loop previously used by mlc_properties.stationary_leaf_gaps """
+    threshold = 1e-6
+    leaf_gaps = np.empty_like(banks, dtype=bool)
+    number_of_control_points = leaf_gaps.shape[2]
+    for cp in range(number_of_control_points):
+        for l in range(leaf_gaps.shape[0]):
+            diff = abs(banks[l, 0, cp] - banks[l, 1, cp])
+            if banks[l, 0, cp] == 0 and banks[l, 1, cp] == 0:
+                ignore_leaf_pair = True
+            elif diff > (1 + threshold) * min_gap_moving:
+                ignore_leaf_pair = True
+            else:
+                ignore_leaf_pair = False
+            if ignore_leaf_pair:
+                leaf_gaps[l, :, cp] = False
+            else:
+                if cp == 0:
+                    x1_diff_0 = abs(banks[l, 0, cp + 1] - banks[l, 0, cp])
+                    x1_diff_1 = abs(banks[l, 0, cp + 2] - banks[l, 0, cp + 1])
+                    x2_diff_0 = abs(banks[l, 1, cp + 1] - banks[l, 1, cp])
+                    x2_diff_1 = abs(banks[l, 1, cp + 2] - banks[l, 1, cp + 1])
+                elif cp == number_of_control_points - 1:
+                    x1_diff_0 = abs(banks[l, 0, cp] - banks[l, 0, cp - 1])
+                    x1_diff_1 = abs(banks[l, 0, cp - 1] - banks[l, 0, cp - 2])
+                    x2_diff_0 = abs(banks[l, 1, cp] - banks[l, 1, cp - 1])
+                    x2_diff_1 = abs(banks[l, 1, cp - 1] - banks[l, 1, cp - 2])
+                else:
+                    x1_diff_0 = abs(banks[l, 0, cp] - banks[l, 0, cp - 1])
+                    x1_diff_1 = abs(banks[l, 0, cp + 1] - banks[l, 0, cp])
+                    x2_diff_0 = abs(banks[l, 1, cp] - banks[l, 1, cp - 1])
+                    x2_diff_1 = abs(banks[l, 1, cp + 1] - banks[l, 1, cp])
+                x1_diff = [x1_diff_0, x1_diff_1]
+                x2_diff = [x2_diff_0, x2_diff_1]
+                if all(x1 <= threshold for x1 in x1_diff) and all(
+                        x2 <= threshold for x2 in x2_diff):
+                    leaf_gaps[l, :, cp] = True
+                else:
+                    leaf_gaps[l, :, cp] = False
+    return leaf_gaps
+
+
+def legacy_park_closed_leaf_pairs(banks, closed_leaves, x1_jaw, x2_jaw, offset,
+                                  min_gap_moving):
+    """ The per-leaf loop previously used by filter_leaves """
+    for i in range(banks.shape[0]):
+        for j in range(banks.shape[2]):
+            if np.all(closed_leaves[i, 0, j]):
+                x1_diff = abs(banks[i, 0, j] - x1_jaw)
+                x2_diff = abs(banks[i, 0, j] - x2_jaw)
+                if x1_diff <= x2_diff:
+                    banks[i, 0, j] = x1_jaw - offset - min_gap_moving
+                    banks[i, 1, j] = x1_jaw - offset
+                elif x1_diff > x2_diff:
+                    banks[i, 0, j] = x2_jaw + offset
+                    banks[i, 1, j] = x2_jaw + offset + min_gap_moving
+
+
+def filter_legacy(banks, x1_jaw, x2_jaw, offset):
+    filtered = np.copy(banks)
+    closed = legacy_stationary_leaf_gaps(filtered, MIN_GAP_MOVING)
+    legacy_park_closed_leaf_pairs(filtered, closed, x1_jaw, x2_jaw, offset, MIN_GAP_MOVING)
+    return closed, filtered
+
+
+def filter_vectorized(banks, x1_jaw, x2_jaw, offset):
+    filtered = np.copy(banks)
+    closed = BeamOperations.stationary_leaf_gap_mask(filtered, MIN_GAP_MOVING)
+    BeamOperations.park_closed_leaf_pairs(
+        filtered, closed, x1_jaw, x2_jaw, offset, MIN_GAP_MOVING)
+    return closed, filtered
+
+
+def main():
+    banks = synthetic_banks()
+    x1_jaw = np.amin(banks[:, 0, :])
+    x2_jaw = np.amax(banks[:, 1, :])
+    offset = LEAF_JAW_OVERLAP + 0.8
+
+    closed_legacy, filtered_legacy = filter_legacy(banks, x1_jaw, x2_jaw, offset)
+    closed_new, filtered_new = filter_vectorized(banks, x1_jaw, x2_jaw, offset)
+    masks_equal = np.array_equal(closed_legacy, closed_new)
+    leaves_equal = np.array_equal(filtered_legacy, filtered_new)
+
+    t_legacy = min(timeit.repeat(lambda: filter_legacy(banks, x1_jaw, x2_jaw, offset),
+                                 number=1, repeat=REPEATS))
+    t_new = min(timeit.repeat(lambda: filter_vectorized(banks, x1_jaw, x2_jaw, offset),
+                              number=1, repeat=REPEATS))
+    message = ('Leaf filtering [{} leaves x {} control points]: {} stationary closed pairs. '
+               .format(NUMBER_LEAVES, NUMBER_CONTROL_POINTS, np.count_nonzero(closed_new[:, 0, :]))
+               + 'Masks equal: {}, leaf moves equal: {}. '.format(masks_equal, leaves_equal)
+               + 'Loop {:.4f} s, vectorized {:.4f} s, speed-up {:.0f}x'
+               .format(t_legacy, t_new, t_legacy / t_new))
+    logging.info(message)
+    print(message)
+
+
+if __name__ == '__main__':
+    main()
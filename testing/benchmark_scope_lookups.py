@@ -0,0 +1,120 @@
+""" Benchmark Scope Lookups
+
+    Count the connect.get_current calls made by the scope lookups at the top of a
+    script (find_scope per level) and by logcrit, before and after the scope snapshot.
+    A stand-in connect module records each call, so no RayStation session is needed.
+
+    This program is free software: you can redistribute it and/or modify it under
+    the terms of the GNU General Public License as published by the Free Software
+    Foundation, either version 3 of the License, or (at your option) any later
+    version.
+
+    This program is distributed in the hope that it will be useful, but WITHOUT
+    ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+    FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License along with
+    this program. If not, see <http://www.gnu.org/licenses/>.
+    """
+
+__author__ = 'Adam Bayliss'
+__contact__ = 'rabayliss@wisc.edu'
+__date__ = '2026-10-18'
+__version__ = '1.0.0'
+__status__ = 'Development'
+__deprecated__ = False
+__reviewer__ = ''
+__reviewed__ = ''
+__raystation__ = '12A'
+__maintainer__ = 'Adam Bayliss'
+__email__ = 'rabayliss@wisc.edu'
+__license__ = 'GPLv3'
+__copyright__ = 'Copyright (C) 2018, University of Wisconsin Board of Regents'
+__credits__ = []
+
+import logging
+import sys
+import types
+from collections import Counter, namedtuple
+
+# Levels requested by the usual script preamble, in the order the scripts ask for them
+PREAMBLE_LEVELS = ['Patient', 'Case', 'Examination', 'PatientDB', 'Plan', 'BeamSet']
+# Number of logcrit messages written by a typical planning script
+LOGCRIT_MESSAGES = 20
+
+
+class StandInConnect(types.ModuleType):
+    """ A connect module returning named placeholders and counting get_current calls """
+
+    def __init__(self):
+        super().__init__('connect')
+        self.calls = Counter()
+        rs_object = namedtuple('RsObject', ['Name', 'CaseName', 'DicomPlanLabel'])
+        self.objects = {l: rs_object(l, l, l) for l in
+                        ['ui', 'PatientDB', 'Patient', 'Case', 'Examination', 'Plan', 'BeamSet']}
+
+    def get_current(self, level):
+        self.calls[level] += 1
+        return self.objects[level]
+
+
+def legacy_find_scope(connect, level=None):
+    """ The level by level probe previously used by GeneralOperations.find_scope """
+    scope = {}
+    scope_levels = ["ui", "PatientDB", "Patient", "Case", "Examination", "Plan", "BeamSet"]
+    for l in scope_levels:
+        rs_obj = connect.get_current(l)
+        if l == level:
+            return rs_obj
+        else:
+            scope[l] = rs_obj
+    return scope
+
+
+def legacy_script(connect):
+    for level in PREAMBLE_LEVELS:
+        legacy_find_scope(connect, level=level)
+    for _ in range(LOGCRIT_MESSAGES):
+        legacy_find_scope(connect)
+
+
+def snapshot_script(general_operations):
+    scope = general_operations.ScopeSnapshot()
+    for level in PREAMBLE_LEVELS:
+        general_operations.find_scope(level=level, scope=scope)
+    for i in range(LOGCRIT_MESSAGES):
+        general_operations.logcrit('Message {}'.format(i), scope=scope)
+
+
+def main():
+    connect = StandInConnect()
+    sys.modules['connect'] = connect
+    import GeneralOperations
+    # Keep the logcrit messages off the console
+    logging.disable(logging.CRITICAL)
+
+    legacy_script(connect)
+    legacy_calls = sum(connect.calls.values())
+    connect.calls.clear()
+    snapshot_script(GeneralOperations)
+    snapshot_calls = sum(connect.calls.values())
+    connect.calls.clear()
+    # Without passing the snapshot: each find_scope and logcrit makes its own
+    for level in PREAMBLE_LEVELS:
+        GeneralOperations.find_scope(level=level)
+    for i in range(LOGCRIT_MESSAGES):
+        GeneralOperations.logcrit('Message {}'.format(i))
+    unshared_calls = sum(connect.calls.values())
+    logging.disable(logging.NOTSET)
+
+    message = ('get_current calls for a {} level preamble and {} logcrit messages: '
+               .format(len(PREAMBLE_LEVELS), LOGCRIT_MESSAGES)
+               + 'legacy find_scope {}, find_scope without a shared snapshot {}, '
+               .format(legacy_calls, unshared_calls)
+               + 'shared snapshot {}'.format(snapshot_calls))
+    logging.info(message)
+    print(message)
+
+
+if __name__ == '__main__':
+    main()